@@ -0,0 +1,212 @@
+# DR_Batch.py - 糖尿病视网膜病变批量诊断入口（夜间筛查任务）
+#
+# 用法: python DR_Batch.py cases.jsonl results.jsonl --batch-size 32 --concurrency 16
+#
+# 输入每行一个 JSON，结构与 grading_analysis_node 解析的输入一致：
+#   {"case_id": "...", "model_grade": 2, "confidence": 85, "image_path": "...", "patient_info": {...}}
+# 输出每行一个 JSON，顺序与输入一致；中断后重新执行同一命令会从断点续跑。
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+from DR_Metrics import log_event
+from DR_Test import format_report_for_display, get_graph, get_llm, report_from_state
+
+logger = logging.getLogger("DR.batch")
+
+
+class BatchingLLM:
+    """将并发到达的 ainvoke 请求合并为一次 llm.abatch 调用"""
+
+    def __init__(self, llm, max_batch_size=32, max_wait=0.05):
+        self.llm = llm
+        self.model_name = getattr(llm, "model_name", "")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_sizes = []
+        self._pending = []
+        self._timer = None
+
+    def invoke(self, messages, config=None, **kwargs):
+        return self.llm.invoke(messages, config, **kwargs)
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((messages, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            asyncio.ensure_future(self._run_batch(pending))
+
+    async def _run_batch(self, pending):
+        self.batch_sizes.append(len(pending))
+        try:
+            responses = await self.llm.abatch([messages for messages, _ in pending], return_exceptions=True)
+        except Exception as e:
+            responses = [e] * len(pending)
+        for (_, future), response in zip(pending, responses):
+            if future.done():
+                continue
+            if isinstance(response, BaseException):
+                future.set_exception(response)
+            else:
+                future.set_result(response)
+
+
+def _read_cases(input_path, skip):
+    """逐行读取输入，跳过已完成的前 skip 条"""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        index = 0
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if index >= skip:
+                yield index, line
+            index += 1
+
+
+def _count_completed(output_path):
+    """统计已完整写出的结果行数，并截断中断时残留的半行"""
+    if not os.path.exists(output_path):
+        return 0
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    return data[:end].count(b'\n')
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _message_text(message):
+    """状态中的消息可能是字符串（紧凑状态）或 LangChain 消息对象"""
+    return message if isinstance(message, str) else str(getattr(message, "content", message))
+
+
+async def _diagnose_case(index, line, batching_llm, semaphore, run_id):
+    async with semaphore:
+        try:
+            case = json.loads(line)
+            config = {
+                "configurable": {
+                    "thread_id": f"batch_{run_id}_{index}",
+                    "llm": batching_llm
+                }
+            }
+            # 批量任务不回读线程状态，使用无检查点的一次性模式
+            result = await get_graph({"checkpointing": False}).ainvoke({"messages": [line]}, config)
+            # 状态中只有紧凑记录，完整报告与可读文本在此展开
+            final_report = report_from_state(result)
+            if final_report is None:
+                # 诊断图未走到报告生成（如路由到 other 节点），记为错误并附上最后一条消息
+                messages = result.get("messages") or []
+                return {
+                    "index": index,
+                    "case_id": case.get("case_id"),
+                    "error": "诊断未生成报告",
+                    "report_text": _message_text(messages[-1]) if messages else ""
+                }
+            return {
+                "index": index,
+                "case_id": case.get("case_id"),
+                "final_report": final_report,
+                "report_text": format_report_for_display(final_report)
+            }
+        except Exception as e:
+            return {"index": index, "error": f"诊断处理错误: {str(e)}"}
+
+
+def _write_results(out, results):
+    """按输入顺序写出一批结果并刷新，中断后可按已写行数续跑"""
+    for result in results:
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+async def arun_batch(input_path, output_path, batch_size=32, concurrency=16, resume=True, model=None):
+    """批量诊断：有界并发执行诊断图，视觉提示词合批调用，结果按输入顺序流式写出"""
+    completed = _count_completed(output_path) if resume else 0
+    batching_llm = BatchingLLM(model or get_llm(), max_batch_size=min(batch_size, concurrency))
+    semaphore = asyncio.Semaphore(concurrency)
+    run_id = uuid.uuid4().hex[:8]
+
+    summary = {"skipped": completed, "processed": 0, "errors": 0, "batches": 0, "elapsed": 0.0}
+    start = time.perf_counter()
+    # 打开、写出与关闭结果文件都放到线程中执行，写盘时事件循环继续调度在途诊断
+    out = await asyncio.to_thread(open, output_path, 'a' if resume else 'w', encoding='utf-8')
+    try:
+        for chunk in _chunks(_read_cases(input_path, completed), batch_size):
+            batch_start = time.perf_counter()
+            llm_calls_before = len(batching_llm.batch_sizes)
+            results = await asyncio.gather(
+                *(_diagnose_case(index, line, batching_llm, semaphore, run_id) for index, line in chunk)
+            )
+            await asyncio.to_thread(_write_results, out, results)
+
+            elapsed = time.perf_counter() - batch_start
+            errors = sum(1 for r in results if "error" in r)
+            summary["processed"] += len(results)
+            summary["errors"] += errors
+            summary["batches"] += 1
+            log_event(
+                logger, logging.INFO, "batch_done",
+                batch=summary["batches"],
+                cases=len(results),
+                errors=errors,
+                llm_batches=len(batching_llm.batch_sizes) - llm_calls_before,
+                seconds=round(elapsed, 3),
+                cases_per_second=round(len(results) / elapsed, 1)
+            )
+    finally:
+        await asyncio.to_thread(out.close)
+    summary["elapsed"] = time.perf_counter() - start
+    return summary
+
+
+def run_batch(input_path, output_path, batch_size=32, concurrency=16, resume=True, model=None):
+    """arun_batch 的同步入口"""
+    return asyncio.run(arun_batch(input_path, output_path, batch_size, concurrency, resume, model))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="糖尿病视网膜病变批量诊断")
+    parser.add_argument("input", help="输入 JSONL 文件")
+    parser.add_argument("output", help="输出 JSONL 文件")
+    parser.add_argument("--batch-size", type=int, default=32, help="每批病例数，同时也是单次 abatch 的上限")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时在途的诊断数")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有输出，从头开始")
+    args = parser.parse_args()
+
+    summary = run_batch(args.input, args.output, args.batch_size, args.concurrency, not args.no_resume)
+    print(
+        f"完成: 处理 {summary['processed']} 例（跳过 {summary['skipped']} 例），"
+        f"失败 {summary['errors']} 例，耗时 {summary['elapsed']:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# DR_Cache.py - 视觉大模型结果的内容寻址缓存
+#
+# 键 = sha256(图像内容摘要或 image_path, 提示词, 模型名)
+# 内存层：LRU + TTL + 容量上限；磁盘层（可选）：SQLite，进程重启后仍可命中。
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class VisionResultCache:
+    """视觉分析结果缓存，只应写入解析成功的 vision_llm_result"""
+
+    def __init__(self, max_entries=4096, ttl=24 * 3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._image_digests = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS vision_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            # 启动时清理已过期条目，避免磁盘层无限增长
+            self._db.execute("DELETE FROM vision_cache WHERE created_at < ?", (time.time() - ttl,))
+            self._db.commit()
+
+    def _image_digest(self, image_path):
+        """图像可读时按内容摘要，否则退化为按路径；摘要按 (路径, mtime, 大小) 记忆"""
+        try:
+            stat = os.stat(image_path)
+        except (OSError, TypeError, ValueError):
+            return f"path:{image_path}"
+        marker = (stat.st_mtime_ns, stat.st_size)
+        cached = self._image_digests.get(image_path)
+        if cached and cached[0] == marker:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest = f"sha256:{digest.hexdigest()}"
+        if len(self._image_digests) >= self.max_entries:
+            self._image_digests.clear()
+        self._image_digests[image_path] = (marker, digest)
+        return digest
+
+    def make_key(self, image_path, prompt, model_name, image_digest=None):
+        """生成缓存键；调用方已有图像内容摘要（如 DR_Image 摄取结果）时传入 image_digest 免去重复哈希"""
+        key = hashlib.sha256()
+        for part in (image_digest or self._image_digest(image_path), prompt, model_name or ""):
+            key.update(part.encode('utf-8'))
+            key.update(b'\0')
+        return key.hexdigest()
+
+    def get(self, key):
+        """命中返回 vision_llm_result 副本，未命中返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return json.loads(value)
+                del self._memory[key]
+                self._counters["expirations"] += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM vision_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if now - created_at <= self.ttl:
+                        self._remember(key, created_at, value)
+                        self._counters["hits"] += 1
+                        self._counters["disk_hits"] += 1
+                        return json.loads(value)
+                    self._db.execute("DELETE FROM vision_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._counters["expirations"] += 1
+
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key, vision_result):
+        """写入解析成功的视觉分析结果"""
+        value = json.dumps(vision_result, ensure_ascii=False)
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, value)
+            self._counters["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO vision_cache (key, value, created_at) VALUES (?, ?, ?)",
+                    (key, value, created_at)
+                )
+                self._db.commit()
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def stats(self):
+        """命中/未命中/淘汰等计数"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        """清空两级缓存（计数保留）"""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM vision_cache")
+                self._db.commit()
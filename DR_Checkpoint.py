@@ -0,0 +1,153 @@
+# DR_Checkpoint.py - 有界、可淘汰的内存检查点
+#
+# InMemorySaver 会永久保留每个线程的全部检查点，长时间运行的服务内存随诊断次数线性增长。
+# BoundedMemorySaver 以整个线程为单位按 LRU/TTL 淘汰，并限制序列化数据总字节数；
+# latest_only 模式下每个线程只保留最新一个检查点及其引用的通道数据。
+import threading
+import time
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+class _ThreadUsage:
+    """单个线程占用的存储键及字节数"""
+    __slots__ = ("last_access", "bytes", "checkpoints", "blobs", "writes")
+
+    def __init__(self):
+        self.last_access = time.monotonic()
+        self.bytes = 0
+        self.checkpoints = {}
+        self.blobs = {}
+        self.writes = {}
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """按线程 LRU/TTL 淘汰、带内存上限的 InMemorySaver"""
+
+    def __init__(self, max_threads=1000, ttl=None, max_bytes=None, latest_only=False, serde=None):
+        super().__init__(serde=serde)
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.latest_only = latest_only
+        self.total_bytes = 0
+        self.evictions = 0
+        self._usage = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _touch(self, thread_id):
+        usage = self._usage.get(thread_id)
+        if usage is None:
+            usage = self._usage[thread_id] = _ThreadUsage()
+        else:
+            self._usage.move_to_end(thread_id)
+            usage.last_access = time.monotonic()
+        return usage
+
+    def _account(self, usage, bucket, key, size):
+        delta = size - bucket.get(key, 0)
+        bucket[key] = size
+        usage.bytes += delta
+        self.total_bytes += delta
+
+    def get_tuple(self, config):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            if thread_id in self._usage:
+                self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            usage = self._touch(thread_id)
+
+            for channel, version in new_versions.items():
+                key = (thread_id, checkpoint_ns, channel, version)
+                self._account(usage, usage.blobs, key, len(self.blobs[key][1]))
+            saved = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            self._account(usage, usage.checkpoints, (checkpoint_ns, checkpoint["id"]),
+                          len(saved[0][1]) + len(saved[1][1]))
+
+            if self.latest_only:
+                self._prune_thread(thread_id, checkpoint_ns, checkpoint)
+            self._evict(keep=thread_id)
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            thread_id = config["configurable"]["thread_id"]
+            outer_key = (
+                thread_id,
+                config["configurable"].get("checkpoint_ns", ""),
+                config["configurable"]["checkpoint_id"]
+            )
+            usage = self._touch(thread_id)
+            size = sum(len(value[2][1]) for value in self.writes[outer_key].values())
+            self._account(usage, usage.writes, outer_key, size)
+            self._evict(keep=thread_id)
+
+    def delete_thread(self, thread_id):
+        """按记录的键删除线程，避免 InMemorySaver 的全表扫描"""
+        with self._lock:
+            usage = self._usage.pop(thread_id, None)
+            if usage is None:
+                super().delete_thread(thread_id)
+                return
+            self.storage.pop(thread_id, None)
+            for key in usage.writes:
+                self.writes.pop(key, None)
+            for key in usage.blobs:
+                self.blobs.pop(key, None)
+            self.total_bytes -= usage.bytes
+
+    def _prune_thread(self, thread_id, checkpoint_ns, checkpoint):
+        """只保留最新检查点、其引用的通道版本及其挂起写入"""
+        usage = self._usage[thread_id]
+        ns_storage = self.storage[thread_id][checkpoint_ns]
+        for checkpoint_id in [cid for cid in ns_storage if cid != checkpoint["id"]]:
+            del ns_storage[checkpoint_id]
+            self._account(usage, usage.checkpoints, (checkpoint_ns, checkpoint_id), 0)
+            del usage.checkpoints[(checkpoint_ns, checkpoint_id)]
+            outer_key = (thread_id, checkpoint_ns, checkpoint_id)
+            if outer_key in usage.writes:
+                self.writes.pop(outer_key, None)
+                self._account(usage, usage.writes, outer_key, 0)
+                del usage.writes[outer_key]
+
+        live_versions = checkpoint["channel_versions"]
+        for key in [k for k in usage.blobs if k[1] == checkpoint_ns and live_versions.get(k[2]) != k[3]]:
+            self.blobs.pop(key, None)
+            self._account(usage, usage.blobs, key, 0)
+            del usage.blobs[key]
+
+    def _evict(self, keep=None):
+        """依次淘汰过期线程、超出线程数或字节上限的最久未用线程"""
+        now = time.monotonic()
+        while self._usage:
+            thread_id, usage = next(iter(self._usage.items()))
+            if thread_id == keep:
+                if len(self._usage) == 1:
+                    break
+                self._usage.move_to_end(thread_id)
+                continue
+            expired = self.ttl is not None and now - usage.last_access > self.ttl
+            over_count = self.max_threads is not None and len(self._usage) > self.max_threads
+            over_bytes = self.max_bytes is not None and self.total_bytes > self.max_bytes
+            if not (expired or over_count or over_bytes):
+                break
+            self.delete_thread(thread_id)
+            self.evictions += 1
+
+    def stats(self):
+        """线程数、字节数与淘汰次数"""
+        with self._lock:
+            return {
+                "threads": len(self._usage),
+                "bytes": self.total_bytes,
+                "evictions": self.evictions
+            }
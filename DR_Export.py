@@ -0,0 +1,221 @@
+# DR_Export.py - 诊断报告批量导出：后台任务从结果库逐页读取，流式写入 gzip 压缩的 JSONL 或 CSV
+#
+# 报告一条条经生成器从 DiagnosisStore.iter_rows 流到压缩文件，内存只占一页结果，与导出总量无关。
+# 任务在后台线程执行，界面轮询 ExportJob 的进度；写入临时文件，完成后原子改名，下载链接只指向完整文件。
+# JSONL 未要求可读文本时直接拼接库中的报告 JSON 原文，不做解析与再序列化。
+import csv
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from DR_Metrics import log_event
+
+logger = logging.getLogger("DR.export")
+
+EXPORT_FORMATS = ("jsonl", "csv")
+
+CSV_COLUMNS = [
+    "request_id", "patient_id", "created_at", "grade", "description", "severity",
+    "grading_model_result", "vision_llm_result", "agreement", "diagnosis_path", "followup_interval",
+    "age", "sex", "diabetes_type", "diabetes_duration", "hbA1c", "other_conditions"
+]
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+
+def jsonl_lines(rows, formatter=None):
+    """每条结果一行 JSON：元数据 + 完整 final_report（+ formatter 生成的可读报告 report_text）"""
+    for row in rows:
+        head = json.dumps({
+            "request_id": row["request_id"],
+            "patient_id": row["patient_id"],
+            "created_at": _iso(row["created_at"])
+        }, ensure_ascii=False)[:-1]
+        if formatter is None:
+            yield f'{head}, "report": {row["report"]}}}\n'
+        else:
+            report = json.loads(row["report"])
+            text = json.dumps(formatter(report), ensure_ascii=False)
+            yield f'{head}, "report": {row["report"]}, "report_text": {text}}}\n'
+
+
+def csv_records(rows, formatter=None):
+    """每条结果展开为 CSV_COLUMNS（formatter 不为空时追加 report_text 列）"""
+    for row in rows:
+        report = json.loads(row["report"])
+        summary = report.get("diagnosis_summary", {})
+        analysis = report.get("model_analysis", {})
+        patient = report.get("patient_information", {})
+        record = [
+            row["request_id"], row["patient_id"] or "", _iso(row["created_at"]),
+            summary.get("grade"), summary.get("description", ""), summary.get("severity", ""),
+            analysis.get("grading_model_result"), analysis.get("vision_llm_result"),
+            analysis.get("agreement"), analysis.get("diagnosis_path", ""),
+            report.get("clinical_recommendations", {}).get("followup_plan", {}).get("interval", ""),
+            patient.get("age"), patient.get("sex", ""), patient.get("diabetes_type", ""),
+            patient.get("diabetes_duration"), patient.get("hbA1c"), "、".join(patient.get("other_conditions", []))
+        ]
+        if formatter is not None:
+            record.append(formatter(report))
+        yield record
+
+
+class ExportJob:
+    """一次导出任务的状态，由后台线程更新、界面线程读取"""
+
+    def __init__(self, job_id, fmt, filters):
+        self.job_id = job_id
+        self.format = fmt
+        self.filters = filters
+        self.status = "pending"  # pending / running / done / failed / cancelled
+        self.total = 0
+        self.exported = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.path = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancelled = threading.Event()
+
+    @property
+    def progress(self):
+        if self.status == "done":
+            return 1.0
+        return self.exported / self.total if self.total else 0.0
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id, "format": self.format, "status": self.status,
+            "total": self.total, "exported": self.exported, "progress": self.progress,
+            "raw_bytes": self.raw_bytes, "compressed_bytes": self.compressed_bytes,
+            "path": self.path, "error": self.error
+        }
+
+
+class ExportManager:
+    """提交与跟踪导出任务；只保留最近 max_jobs 个任务的文件"""
+
+    def __init__(self, store, out_dir=None, formatter=None, workers=1, compresslevel=6, page_size=1000, max_jobs=20):
+        self.store = store
+        self.out_dir = out_dir or os.path.join(tempfile.gettempdir(), "dr_exports")
+        self.formatter = formatter
+        self.compresslevel = compresslevel
+        self.page_size = page_size
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dr-export")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.out_dir, exist_ok=True)
+
+    def submit(self, fmt="jsonl", **filters):
+        """提交导出任务立即返回 ExportJob；filters 同 DiagnosisStore.query"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        job = ExportJob(uuid.uuid4().hex[:12], fmt, filters)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                _, old = self._jobs.popitem(last=False)
+                old.cancelled.set()
+                if old.path and os.path.exists(old.path):
+                    os.remove(old.path)
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancelled.set()
+        return job
+
+    def _run(self, job):
+        if job.cancelled.is_set():
+            job.status = "cancelled"
+            return
+        job.status = "running"
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self.out_dir, f"dr_reports_{stamp}_{job.job_id}.{job.format}.gz")
+        tmp_path = path + ".part"
+        try:
+            job.total = self.store.count(**job.filters)
+            rows = self.store.iter_rows(self.page_size, **job.filters)
+            with open(tmp_path, 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.compresslevel) as compressed:
+                    sink = _Utf8Sink(compressed)
+                    if job.format == "jsonl":
+                        for line in jsonl_lines(rows, self.formatter):
+                            sink.write(line)
+                            job.exported += 1
+                            if job.cancelled.is_set():
+                                break
+                    else:
+                        writer = csv.writer(sink)
+                        writer.writerow(CSV_COLUMNS + (["report_text"] if self.formatter else []))
+                        for record in csv_records(rows, self.formatter):
+                            writer.writerow(record)
+                            job.exported += 1
+                            if job.cancelled.is_set():
+                                break
+                    sink.flush()
+                    job.raw_bytes = sink.bytes
+                job.compressed_bytes = raw.tell()
+            if job.cancelled.is_set():
+                os.remove(tmp_path)
+                job.status = "cancelled"
+            else:
+                os.replace(tmp_path, path)
+                job.path = path
+                job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            log_event(logger, logging.ERROR, "export_failed", job_id=job.job_id, error=str(e))
+        finally:
+            job.finished_at = time.time()
+        log_event(logger, logging.INFO, "export_finished", job_id=job.job_id, status=job.status,
+                  rows=job.exported, compressed_bytes=job.compressed_bytes,
+                  seconds=round(job.finished_at - job.created_at, 3))
+
+
+class _Utf8Sink:
+    """文本按 UTF-8 编码后攒够 64KB 再交给 gzip，避免逐行调用压缩；同时统计未压缩字节数"""
+    __slots__ = ("target", "bytes", "_buffer")
+
+    def __init__(self, target):
+        self.target = target
+        self.bytes = 0
+        self._buffer = bytearray()
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.bytes += len(data)
+        self._buffer += data
+        if len(self._buffer) >= 65536:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            self.target.write(self._buffer)
+            self._buffer = bytearray()
@@ -0,0 +1,168 @@
+# DR_FakeLLMServer.py - 离线测试用的 OpenAI 兼容假大模型服务
+#
+# 延迟 = latency * U(1 - jitter, 1 + jitter)，以 tail_prob 概率改为 tail_latency，用于复现长尾；
+# 以 error_rate 概率返回 500、throttle_rate 概率返回 429。响应内容回显提示词中的"等级N"。
+# 请求带 "stream": true 时以 SSE 分块返回：首块在上述延迟后发出，之后每 chunk_chars 个字符间隔 token_latency。
+#
+# 用法: python DR_FakeLLMServer.py --port 8900 --latency 0.2 --tail-prob 0.05 --tail-latency 3 --error-rate 0.02
+#       DR_LLM_BASE_URL=http://127.0.0.1:8900/v1 python DR_Test_Server.py
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GRADE_PATTERN = re.compile(r"等级(\d)")
+
+
+class FakeLLMConfig:
+    """假服务的延迟与错误注入配置，运行中可直接修改属性"""
+
+    def __init__(self, latency=0.2, jitter=0.2, tail_prob=0.0, tail_latency=2.0, error_rate=0.0,
+                 throttle_rate=0.0, seed=None, token_latency=0.0, chunk_chars=4, rationale_chars=120):
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_prob = tail_prob
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.token_latency = token_latency
+        self.chunk_chars = chunk_chars
+        self.rationale_chars = rationale_chars
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """返回 (延迟秒数, HTTP 状态码)"""
+        with self._lock:
+            self.requests += 1
+            roll = self._random.random()
+            if self._random.random() < self.tail_prob:
+                delay = self.tail_latency
+            else:
+                delay = self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+        if roll < self.error_rate:
+            return delay, 500
+        if roll < self.error_rate + self.throttle_rate:
+            return 0.0, 429
+        return delay, 200
+
+
+def _completion(model, content):
+    return {
+        "id": f"fake-{time.time_ns()}",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}]
+    }
+
+
+class _FakeLLMHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 保持长连接，客户端连接池才能复用连接
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._reply(404, {"error": {"message": "not found"}})
+            return
+        delay, status = self.server.config.sample()
+        time.sleep(delay)
+        if status != 200:
+            self._reply(status, {"error": {"message": "injected failure"}})
+            return
+
+        request = json.loads(body or b"{}")
+        prompt = " ".join(str(m.get("content", "")) for m in request.get("messages", []))
+        match = GRADE_PATTERN.search(prompt)
+        config = self.server.config
+        content = json.dumps({
+            "predicted_grade": int(match.group(1)) if match else 0,
+            "confidence": 0.85,
+            "key_findings": ["假服务回显"],
+            "rationale": ("DR_FakeLLMServer 分析理由" * config.rationale_chars)[:config.rationale_chars]
+        }, ensure_ascii=False)
+        if request.get("stream"):
+            self._stream(request.get("model", ""), content, config)
+        else:
+            self._reply(200, _completion(request.get("model", ""), content))
+
+    def _stream(self, model, content, config):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(content), config.chunk_chars):
+            if i and config.token_latency:
+                time.sleep(config.token_latency)
+            delta = {"choices": [{"index": 0, "delta": {"content": content[i:i + config.chunk_chars]}}], "model": model}
+            self._write_chunk(f"data: {json.dumps(delta, ensure_ascii=False)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _FakeLLMHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        # 客户端超时/对冲取消后主动断开属正常情况
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_fake_llm_server(port=0, host="127.0.0.1", config=None):
+    """在后台线程启动假服务，返回 server（server.config 为 FakeLLMConfig，server.server_port 为端口）"""
+    server = _FakeLLMHTTPServer((host, port), _FakeLLMHandler)
+    server.config = config or FakeLLMConfig()
+    threading.Thread(target=server.serve_forever, name="dr-fake-llm", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的假大模型服务（可配置延迟与错误率）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.2, help="基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="基础延迟的相对抖动")
+    parser.add_argument("--tail-prob", type=float, default=0.0, help="长尾请求概率")
+    parser.add_argument("--tail-latency", type=float, default=2.0, help="长尾请求延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="流式输出每个 chunk 的间隔（秒）")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(args.latency, args.jitter, args.tail_prob, args.tail_latency,
+                           args.error_rate, args.throttle_rate, args.seed, args.token_latency)
+    server = _FakeLLMHTTPServer((args.host, args.port), _FakeLLMHandler)
+    server.config = config
+    print(f"假大模型服务: http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# DR_Image.py - 眼底图像摄取：解码、按内容去重、裁剪/缩放/归一化一次，结果存入内存映射的磁盘缓存
+#
+# 缓存文件为 <cache_dir>/<sha256 前两位>/<sha256>.npy（float16, HWC），分级与视觉阶段以 np.load(mmap_mode="r")
+# 零拷贝读取。prefetch 在后台线程池中解码与预处理，图中其他节点同时执行；get 时再等待结果。
+# 缓存目录总字节数超过 max_bytes 时按最近使用顺序淘汰最旧的文件；启动时按 mtime 恢复顺序，命中时更新 mtime。
+# 已打开的内存映射在文件被删除后仍然有效。
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+IMAGE_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGE_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+# 眼底照片背景为黑色，亮度高于该阈值的像素视为视网膜区域
+FUNDUS_THRESHOLD = 15
+
+
+def preprocess_fundus(data, size=512):
+    """解码图像字节，裁掉黑色边框、补成正方形、缩放到 size×size 并按通道归一化，返回 float16 数组"""
+    import io
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    # JPEG 在解码阶段直接按 1/2、1/4、1/8 降采样，大图解码开销成倍下降
+    image.draft("RGB", (size * 2, size * 2))
+    image = image.convert("RGB")
+
+    rgb = np.asarray(image)
+    mask = rgb.max(axis=2) > FUNDUS_THRESHOLD
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size and cols.size:
+        image = image.crop((int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1))
+
+    side = max(image.size)
+    square = Image.new("RGB", (side, side))
+    square.paste(image, ((side - image.width) // 2, (side - image.height) // 2))
+    square = square.resize((size, size), Image.BILINEAR)
+
+    array = np.asarray(square, dtype=np.float32) / 255.0
+    return ((array - IMAGE_MEAN) / IMAGE_STD).astype(np.float16)
+
+
+class FundusImage:
+    """一张已预处理的眼底图像"""
+    __slots__ = ("key", "path", "store")
+
+    def __init__(self, key, path, store):
+        self.key = key
+        self.path = path
+        self.store = store
+
+    @property
+    def digest(self):
+        """与 VisionResultCache 图像摘要相同的格式"""
+        return f"sha256:{self.key}"
+
+    @property
+    def array(self):
+        """只读内存映射数组 (size, size, 3) float16"""
+        return self.store.load(self.key)
+
+
+class FundusImageStore:
+    """按内容寻址的预处理结果缓存 + 后台预处理线程池"""
+
+    def __init__(self, cache_dir=None, size=512, workers=4, max_open=256, max_bytes=2 << 30):
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "dr_fundus_cache")
+        self.size = size
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dr-image")
+        self._inflight = {}
+        self._path_keys = {}
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "ingested": 0, "processed": 0, "dedup_hits": 0, "path_hits": 0, "errors": 0, "timeouts": 0, "evictions": 0
+        }
+        # 缓存文件 key -> 字节数，按最近使用排序
+        self._files = OrderedDict()
+        self._bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+        self._evict()
+
+    def _scan(self):
+        """登记缓存目录中已有的文件（含其他进程写入的），按 mtime 排序"""
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".npy"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._files[key] = size
+            self._bytes += size
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def _touch(self, key, path):
+        """命中缓存：移到最近使用端并更新 mtime"""
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _added(self, key, path):
+        with self._lock:
+            size = os.path.getsize(path)
+            self._bytes += size - self._files.pop(key, 0)
+            self._files[key] = size
+        self._evict(keep=key)
+
+    def _evict(self, keep=None):
+        """总字节数超过上限时删除最久未用的文件；keep 为刚写入、调用方马上要读的文件"""
+        while True:
+            with self._lock:
+                if self._bytes <= self.max_bytes or not self._files:
+                    return
+                key, size = next(iter(self._files.items()))
+                if key == keep:
+                    if len(self._files) == 1:
+                        return
+                    self._files.move_to_end(key)
+                    continue
+                del self._files[key]
+                self._bytes -= size
+                self._open.pop(key, None)
+                self._counters["evictions"] += 1
+            try:
+                os.remove(self._cache_path(key))
+            except OSError:
+                pass
+
+    def ingest_bytes(self, data):
+        """摄取图像字节，返回 FundusImage；相同内容只预处理一次"""
+        self._count("ingested")
+        key = hashlib.sha256(data).hexdigest()
+        path = self._cache_path(key)
+        if os.path.exists(path):
+            self._count("dedup_hits")
+            self._touch(key, path)
+            return FundusImage(key, path, self)
+
+        array = preprocess_fundus(data, self.size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，并发摄取同一内容时读者不会看到半个文件
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+        self._count("processed")
+        self._added(key, path)
+        return FundusImage(key, path, self)
+
+    def ingest(self, image_path):
+        """摄取图像文件；同一路径在 (mtime, 大小) 不变时不再读取与哈希"""
+        stat = os.stat(image_path)
+        marker = (image_path, stat.st_mtime_ns, stat.st_size)
+        key = self._path_keys.get(marker)
+        if key is not None and os.path.exists(self._cache_path(key)):
+            self._count("path_hits")
+            self._touch(key, self._cache_path(key))
+            return FundusImage(key, self._cache_path(key), self)
+        with open(image_path, 'rb') as f:
+            image = self.ingest_bytes(f.read())
+        with self._lock:
+            if len(self._path_keys) >= 65536:
+                self._path_keys.clear()
+            self._path_keys[marker] = image.key
+        return image
+
+    def prefetch(self, image_path):
+        """在后台线程池中摄取，立即返回 Future；路径无效时返回 None"""
+        if not image_path or not os.path.isfile(image_path):
+            return None
+        with self._lock:
+            future = self._inflight.get(image_path)
+            created = future is None
+            if created:
+                future = self._inflight[image_path] = self._executor.submit(self.ingest, image_path)
+        # 回调可能在当前线程立即执行，须在锁外登记
+        if created:
+            future.add_done_callback(lambda _: self._forget(image_path))
+        return future
+
+    def _forget(self, image_path):
+        with self._lock:
+            self._inflight.pop(image_path, None)
+
+    def known_digest(self, image_path):
+        """已摄取过的路径（mtime、大小未变）直接返回内容摘要，不读文件也不等待预处理；否则返回 None"""
+        try:
+            stat = os.stat(image_path)
+        except (OSError, TypeError, ValueError):
+            return None
+        key = self._path_keys.get((image_path, stat.st_mtime_ns, stat.st_size))
+        return f"sha256:{key}" if key else None
+
+    def get(self, image_path, timeout=None):
+        """取得预处理结果：优先等待在途的预取，否则同步摄取；路径无效、无法解码或超时时返回 None"""
+        future = self.prefetch(image_path)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            self._count("timeouts")
+            return None
+        except Exception:
+            self._count("errors")
+            return None
+
+    async def aget(self, image_path, timeout=None):
+        """get 的异步版本，等待预取时不阻塞事件循环"""
+        future = self.prefetch(image_path)
+        if future is None:
+            return None
+        try:
+            # shield：超时只放弃等待，不取消其他请求共享的预取任务
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except TimeoutError:
+            self._count("timeouts")
+            return None
+        except Exception:
+            self._count("errors")
+            return None
+
+    def load(self, key):
+        """以只读内存映射打开预处理数组，最近打开的映射被复用"""
+        with self._lock:
+            array = self._open.get(key)
+            if array is not None:
+                self._open.move_to_end(key)
+                return array
+        array = np.load(self._cache_path(key), mmap_mode="r")
+        with self._lock:
+            self._open[key] = array
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return array
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["inflight"] = len(self._inflight)
+            stats["files"] = len(self._files)
+            stats["bytes"] = self._bytes
+        return stats
@@ -0,0 +1,398 @@
+# DR_JobQueue.py - 异步诊断任务队列：SQLite 持久化 + 工作线程/进程池，提交立即返回任务 ID，轮询取结果
+#
+# 界面点击同步诊断时，HTTP 请求要一直挂到视觉大模型返回，大模型慢时客户端先超时。
+# JobQueue 把诊断输入写入本地 SQLite（WAL）后立即返回 job_id，JobWorkerPool 的工作线程或进程从库中领取执行，
+# 调用方用 status/result 轮询；任务与结果都在库里，服务重启后未完成的任务继续执行。
+#   优先级：按 priority 降序领取，默认由分级推断，疑似 PDR（4 级）最先、重度 NPDR（3 级）次之；
+#   背压：排队与执行中的任务达到 max_pending 时 submit 抛出 JobQueueFull，由调用方提示稍后重试；
+#   可见性超时：领取时写入租约到期时间，执行期间由心跳续租；工作者崩溃（进程被杀、机器重启）后租约过期，
+#   任务重新可见并由其他工作者再次领取，领取满 max_attempts 次仍未完成则标记失败。
+#   结果按领取次数（attempts）校验，租约已被接管的迟到结果直接丢弃，不会覆盖新的执行。
+# 领取在 BEGIN IMMEDIATE 事务中完成，多个线程、多个进程共用同一个库文件也不会重复领取。
+import json
+import logging
+import multiprocessing
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from DR_Metrics import job_duration, job_events, job_queue_wait, log_event
+
+logger = logging.getLogger("DR.jobs")
+
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 1  # 疑似重度 NPDR
+PRIORITY_URGENT = 2  # 疑似 PDR
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+# queued 时 visible_at 为可领取时间，running 时为租约到期时间；
+# 部分索引只含未完成任务，领取、排队位置与背压计数都不随已完成任务增多而变慢
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT NOT NULL UNIQUE,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    visible_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (priority DESC, id) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at) WHERE finished_at IS NOT NULL;
+"""
+
+_PENDING = "status IN ('queued', 'running')"
+
+
+def priority_of(payload):
+    """按诊断输入中的分级推断优先级：疑似 PDR 最先，重度 NPDR 次之"""
+    grade = payload.get("model_grade")
+    if grade is None:
+        grade = payload.get("patient_info", {}).get("dr_grade")
+    try:
+        grade = int(grade)
+    except (TypeError, ValueError):
+        return PRIORITY_NORMAL
+    if grade >= 4:
+        return PRIORITY_URGENT
+    return PRIORITY_HIGH if grade == 3 else PRIORITY_NORMAL
+
+
+class JobQueueFull(Exception):
+    """未完成任务已达上限（背压），调用方应稍后重试"""
+
+
+class Claim(NamedTuple):
+    """一次领取：attempt 为第几次执行，提交结果与续租时用于校验租约"""
+    job_id: str
+    attempt: int
+    payload: dict
+
+
+class JobQueue:
+    """持久化任务队列；各方法可在任意线程调用，多个进程可打开同一个库文件"""
+
+    def __init__(self, db_path, max_pending=1000, visibility_timeout=300.0, max_attempts=3, synchronous="NORMAL"):
+        self.db_path = db_path
+        self.max_pending = max_pending
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._ready = threading.Condition()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        """每个线程一个连接；isolation_level=None 由本类显式控制事务"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """写事务一开始就取得写锁，读-改-写之间不会被其他连接插入"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ---- 提交与查询 ----
+
+    def submit(self, payload, priority=None, job_id=None):
+        """
+        写入任务立即返回 job_id；priority 默认由 priority_of(payload) 推断。
+        传入已存在的 job_id 时直接返回、不重复入队（客户端重试幂等）。未完成任务达到 max_pending 时抛出 JobQueueFull。
+        """
+        if priority is None:
+            priority = priority_of(payload)
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                if conn.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone():
+                    return job_id
+                pending = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE {_PENDING}").fetchone()[0]
+                if pending >= self.max_pending:
+                    raise JobQueueFull(f"排队中的诊断任务已达上限 {self.max_pending}")
+                conn.execute(
+                    "INSERT INTO jobs (job_id, priority, status, payload, created_at, visible_at) "
+                    "VALUES (?, ?, 'queued', ?, ?, ?)",
+                    (job_id, priority, json.dumps(payload, ensure_ascii=False), now, now)
+                )
+        except JobQueueFull:
+            job_events.inc("rejected")
+            raise
+        job_events.inc("submitted")
+        with self._ready:
+            self._ready.notify()
+        return job_id
+
+    def status(self, job_id):
+        """任务状态 dict，不存在时返回 None；排队中的任务带 ahead（前面还有几个任务等待领取）"""
+        row = self._conn().execute(
+            "SELECT id, status, priority, attempts, created_at, finished_at, error FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        rowid, status, priority, attempts, created_at, finished_at, error = row
+        info = {
+            "job_id": job_id, "status": status, "priority": priority, "attempts": attempts,
+            "created_at": created_at, "finished_at": finished_at, "error": error
+        }
+        if status == "queued":
+            info["ahead"] = self._conn().execute(
+                f"SELECT COUNT(*) FROM jobs WHERE {_PENDING} AND status = 'queued' "
+                "AND (priority > ? OR (priority = ? AND id < ?))",
+                (priority, priority, rowid)
+            ).fetchone()[0]
+        return info
+
+    def result(self, job_id):
+        """已完成任务的结果，未完成、失败或不存在时返回 None"""
+        row = self._conn().execute(
+            "SELECT result FROM jobs WHERE job_id = ? AND status = 'done'", (job_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def wait(self, job_id, timeout=None, poll_interval=0.2):
+        """轮询直到任务完成或失败，返回最终状态；超时返回当前状态"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            info = self.status(job_id)
+            if info is None or info["status"] in ("done", "failed"):
+                return info
+            if deadline is not None and time.monotonic() >= deadline:
+                return info
+            time.sleep(poll_interval)
+
+    # ---- 工作者接口 ----
+
+    def claim(self):
+        """领取优先级最高的可执行任务（含租约已过期的任务），没有时返回 None"""
+        now = time.time()
+        redelivered = False
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    f"SELECT id, job_id, status, attempts, payload, created_at FROM jobs "
+                    f"WHERE {_PENDING} AND visible_at <= ? ORDER BY priority DESC, id LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    return None
+                rowid, job_id, status, attempts, payload, created_at = row
+                if attempts >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                        (f"执行 {attempts} 次均未完成（工作者崩溃或租约超时）", now, rowid)
+                    )
+                    job_events.inc("abandoned")
+                    log_event(logger, logging.WARNING, "job_abandoned", job_id=job_id, attempts=attempts)
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, visible_at = ? WHERE id = ?",
+                    (now + self.visibility_timeout, rowid)
+                )
+                redelivered = status == "running"
+                break
+        if redelivered:
+            job_events.inc("redelivered")
+            log_event(logger, logging.WARNING, "job_redelivered", job_id=job_id, attempt=attempts + 1)
+        else:
+            job_queue_wait.observe(now - created_at)
+        return Claim(job_id, attempts + 1, json.loads(payload))
+
+    def extend(self, leases):
+        """为执行中的 (job_id, attempt) 续租"""
+        visible_at = time.time() + self.visibility_timeout
+        with self._transaction() as conn:
+            conn.executemany(
+                "UPDATE jobs SET visible_at = ? WHERE job_id = ? AND status = 'running' AND attempts = ?",
+                [(visible_at, job_id, attempt) for job_id, attempt in leases]
+            )
+
+    def complete(self, claim, result):
+        """写入结果；租约已被其他工作者接管时丢弃并返回 False"""
+        return self._finish(claim, "done", json.dumps(result, ensure_ascii=False), None)
+
+    def fail(self, claim, error):
+        """标记失败；处理函数抛出的异常视为确定性错误，不重试"""
+        return self._finish(claim, "failed", None, error)
+
+    def _finish(self, claim, status, result, error):
+        updated = self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+            "WHERE job_id = ? AND status = 'running' AND attempts = ?",
+            (status, result, error, time.time(), claim.job_id, claim.attempt)
+        ).rowcount
+        if not updated:
+            job_events.inc("stale")
+            log_event(logger, logging.WARNING, "job_stale_result", job_id=claim.job_id, attempt=claim.attempt)
+            return False
+        job_events.inc("completed" if status == "done" else "failed")
+        return True
+
+    def wait_for_work(self, timeout):
+        """等待本进程内的新提交；其他进程的提交靠调用方按 timeout 轮询发现"""
+        with self._ready:
+            self._ready.wait(timeout)
+
+    # ---- 维护 ----
+
+    def purge(self, max_age):
+        """删除完成超过 max_age 秒的任务，返回删除条数"""
+        return self._conn().execute(
+            "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (time.time() - max_age,)
+        ).rowcount
+
+    def stats(self):
+        """未完成任务按状态计数（走部分索引，不扫描已完成任务）"""
+        stats = {"queued": 0, "running": 0}
+        rows = self._conn().execute(f"SELECT status, COUNT(*) FROM jobs WHERE {_PENDING} GROUP BY status")
+        stats.update(dict(rows.fetchall()))
+        return stats
+
+
+class JobWorkerPool:
+    """
+    从 JobQueue 领取并执行任务的工作者池。handler(payload) 返回可 JSON 序列化的结果。
+    mode="thread" 为 workers 个线程；mode="process" 为 workers 个进程（spawn 启动，各自打开同一个库文件，
+    每个进程 threads_per_process 个线程），此时 handler 须为可 pickle 的模块级函数。
+    """
+
+    def __init__(self, queue, handler, workers=4, mode="thread", threads_per_process=1, poll_interval=0.2):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"不支持的工作者模式: {mode}")
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.mode = mode
+        self.threads_per_process = threads_per_process
+        self.poll_interval = poll_interval
+        self._threads = []
+        self._heartbeat = None
+        self._processes = []
+        self._leases = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        # 心跳单独停止：停机时等在途任务完成期间仍要续租，否则超过可见性超时的任务会被重投
+        self._heartbeat_stop = threading.Event()
+        self._process_stop = None
+
+    def start(self):
+        if self.mode == "process":
+            context = multiprocessing.get_context("spawn")
+            self._process_stop = context.Event()
+            options = {
+                "max_pending": self.queue.max_pending, "visibility_timeout": self.queue.visibility_timeout,
+                "max_attempts": self.queue.max_attempts, "synchronous": self.queue.synchronous
+            }
+            for i in range(self.workers):
+                process = context.Process(
+                    target=_process_main, name=f"dr-job-worker-{i}", daemon=True,
+                    args=(self.queue.db_path, options, self.handler, self.threads_per_process,
+                          self.poll_interval, self._process_stop)
+                )
+                process.start()
+                self._processes.append(process)
+        else:
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work_loop, name=f"dr-job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="dr-job-heartbeat", daemon=True)
+            self._heartbeat.start()
+        log_event(logger, logging.INFO, "job_workers_started", mode=self.mode, workers=self.workers)
+        return self
+
+    def stop(self, timeout=None):
+        """不再领取新任务，等待执行中的任务完成；工作线程全部退出后才停止心跳"""
+        self._stop.set()
+        if self._process_stop is not None:
+            self._process_stop.set()
+        with self.queue._ready:
+            self.queue._ready.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        for process in self._processes:
+            process.join(timeout)
+        self._heartbeat_stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout)
+
+    def _work_loop(self):
+        while not self._stop.is_set():
+            try:
+                claim = self.queue.claim()
+            except sqlite3.Error as e:
+                log_event(logger, logging.ERROR, "job_claim_failed", error=str(e))
+                self._stop.wait(self.poll_interval)
+                continue
+            if claim is None:
+                self.queue.wait_for_work(self.poll_interval)
+                continue
+            self._run(claim)
+
+    def _run(self, claim):
+        lease = (claim.job_id, claim.attempt)
+        with self._lock:
+            self._leases.add(lease)
+        start = time.perf_counter()
+        try:
+            try:
+                result = self.handler(claim.payload)
+            except Exception as e:
+                log_event(logger, logging.ERROR, "job_failed", job_id=claim.job_id, error=str(e))
+                self.queue.fail(claim, str(e))
+            else:
+                self._complete(claim, result)
+        except Exception as e:
+            # 写库失败不能让工作线程退出：任务保持 running，租约过期后重投
+            log_event(logger, logging.ERROR, "job_finish_failed", job_id=claim.job_id, error=str(e))
+        finally:
+            with self._lock:
+                self._leases.discard(lease)
+            job_duration.observe(time.perf_counter() - start)
+
+    def _complete(self, claim, result):
+        """写入结果；结果无法 JSON 序列化或写入失败时改为标记失败"""
+        try:
+            self.queue.complete(claim, result)
+        except Exception as e:
+            log_event(logger, logging.ERROR, "job_complete_failed", job_id=claim.job_id, error=str(e))
+            self.queue.fail(claim, f"结果写入失败: {e}")
+
+    def _heartbeat_loop(self):
+        """每三分之一个可见性超时为执行中的任务续租，长耗时任务不会被误判为崩溃"""
+        interval = self.queue.visibility_timeout / 3
+        while not self._heartbeat_stop.wait(interval):
+            with self._lock:
+                leases = list(self._leases)
+            if leases:
+                try:
+                    self.queue.extend(leases)
+                except sqlite3.Error as e:
+                    log_event(logger, logging.ERROR, "job_heartbeat_failed", error=str(e))
+
+
+def _process_main(db_path, options, handler, threads, poll_interval, stop):
+    """工作进程入口：在本进程内打开队列并运行线程池，直到父进程通知停止"""
+    pool = JobWorkerPool(JobQueue(db_path, **options), handler, workers=threads, poll_interval=poll_interval).start()
+    stop.wait()
+    pool.stop()
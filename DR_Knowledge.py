@@ -0,0 +1,283 @@
+# DR_Knowledge.py - 临床知识库：治疗建议由 JSON 数据文件驱动，载入时按 (分级, 风险因素) 预先生成全部条目
+#
+# 知识文件包含各分级的基础建议和患者风险因素（HbA1c 分档、高血压、糖尿病病程分档）的附加建议。
+# 载入时对 分级 × 各风险因素取值 的全部组合逐一合并成完整建议，按元组键建索引。
+# 查询只需把患者信息归入各风险档位再查一次字典，不再逐次构造嵌套字典。
+# 条目在各诊断间共享：字典为只读的 FrozenDict，列表字段存为元组，修改时抛出 TypeError。
+# 热更新：每隔 check_interval 秒检查一次文件 (mtime, 大小)，有变化就重新载入并整体替换快照；
+# 新文件无效时保留旧快照并记录日志。每条建议带 knowledge_version，报告可追溯所用知识库版本；
+# 最近 keep_versions 个版本的快照保留在内存中，按 (版本, 索引键) 展开的旧诊断仍得到生成时的建议。
+# 版本号为文件中的 "version" 加内容摘要前 8 位：改了内容却忘了改 "version" 时也是不同版本。
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from DR_Metrics import log_event
+
+logger = logging.getLogger("DR.knowledge")
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "DR_Knowledge.json")
+
+GRADES = range(5)
+
+
+def _number(value):
+    """数值或形如 "8.5%"、"10年" 的字符串转 float，无法识别时返回 None"""
+    if type(value) is float or type(value) is int:
+        return value
+    if isinstance(value, str):
+        digits = value.strip().rstrip("%年岁").strip()
+        try:
+            return float(digits)
+        except ValueError:
+            return None
+    return None
+
+
+def _band_classifier(spec):
+    """数值分档：取 min 不超过该值的最高一档，无值或低于最低档时为 None"""
+    field = spec["field"]
+    bands = sorted(spec["bands"], key=lambda band: band["min"])
+    bounds = [band["min"] for band in bands]
+    band_ids = [None] + [band["id"] for band in bands]
+
+    def classify(patient_info):
+        value = patient_info.get(field)
+        if value is None:
+            return None
+        if type(value) is not float and type(value) is not int:
+            value = _number(value)
+            if value is None:
+                return None
+        return band_ids[bisect.bisect_right(bounds, value)]
+
+    return classify, {band["id"]: band for band in bands}
+
+
+def _condition_classifier(factor_id, spec):
+    """合并症：other_conditions 中出现关键词，或血压达到阈值"""
+    keywords = tuple(spec.get("conditions", ()))
+    systolic_min = spec.get("systolic_min")
+    diastolic_min = spec.get("diastolic_min")
+
+    def classify(patient_info):
+        for condition in patient_info.get("other_conditions") or ():
+            for keyword in keywords:
+                if keyword in condition:
+                    return factor_id
+        pressure = patient_info.get("blood_pressure")
+        if pressure and isinstance(pressure, dict):
+            systolic = _number(pressure.get("systolic"))
+            diastolic = _number(pressure.get("diastolic"))
+            if systolic_min is not None and systolic is not None and systolic >= systolic_min:
+                return factor_id
+            if diastolic_min is not None and diastolic is not None and diastolic >= diastolic_min:
+                return factor_id
+        return None
+
+    return classify, {factor_id: spec}
+
+
+class FrozenDict(dict):
+    """只读字典：仍是 dict 的子类，可直接 JSON 序列化与 pickle，写操作抛出 TypeError"""
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("知识库条目只读，请先复制再修改")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _merge(base, contributions, field):
+    """基础列表后追加各风险因素的条目，去重并保持顺序"""
+    items = list(base)
+    for contribution in contributions:
+        for item in contribution.get(field, ()):
+            if item not in items:
+                items.append(item)
+    return tuple(items)
+
+
+def _build_entry(version, defaults, grade_spec, contributions):
+    shorten = any(contribution.get("shorten_followup") for contribution in contributions)
+    return FrozenDict({
+        "treatment_recommendations": FrozenDict({
+            "medication": _merge(grade_spec.get("medication", ()), contributions, "medication"),
+            "procedures": _merge(grade_spec.get("procedures", ()), contributions, "procedures"),
+            "lifestyle": _merge(grade_spec.get("lifestyle", ()), contributions, "lifestyle")
+        }),
+        "followup_plan": FrozenDict({
+            "interval": grade_spec.get("interval_high_risk", grade_spec["interval"]) if shorten else grade_spec["interval"],
+            "next_exams": _merge(defaults.get("next_exams", ()), contributions, "next_exams")
+        }),
+        "targets": FrozenDict(defaults.get("targets", {})),
+        "patient_education": _merge(grade_spec.get("patient_education", ()), contributions, "patient_education"),
+        "warning_signs": tuple(defaults.get("warning_signs", ())),
+        "risk_factors": tuple(contribution["label"] for contribution in contributions),
+        "knowledge_version": version
+    })
+
+
+class _Snapshot:
+    """一次载入的知识库：风险分档函数 + 预生成的全部条目"""
+    __slots__ = ("version", "digest", "marker", "classifiers", "index")
+
+    def __init__(self, data, digest, marker):
+        self.digest = digest
+        self.marker = marker
+        # 版本按内容区分：文件内容变了而 "version" 没改时仍是新版本，不会覆盖保留的旧快照
+        self.version = f"{data['version']}+{digest[:8]}" if data.get("version") else digest[:12]
+        defaults = data.get("defaults", {})
+        grades = {int(grade): spec for grade, spec in data["grades"].items()}
+        missing = [grade for grade in GRADES if grade not in grades]
+        if missing:
+            raise ValueError(f"知识库缺少分级: {missing}")
+
+        # 每个风险因素：分档函数 + {档位 id: 附加建议}；取值 None 表示不适用
+        factors = []
+        for factor_id, spec in data.get("risk_factors", {}).items():
+            if "bands" in spec:
+                factors.append(_band_classifier(spec))
+            else:
+                factors.append(_condition_classifier(factor_id, spec))
+        self.classifiers = tuple(classify for classify, _ in factors)
+
+        self.index = {}
+        options = [[None, *contributions] for _, contributions in factors]
+        for grade in GRADES:
+            for profile in itertools.product(*options):
+                contributions = [factors[i][1][option] for i, option in enumerate(profile) if option is not None]
+                self.index[(grade, *profile)] = _build_entry(self.version, defaults, grades[grade], contributions)
+
+    def key(self, grade, patient_info):
+        key = [grade]
+        for classify in self.classifiers:
+            key.append(classify(patient_info))
+        return tuple(key)
+
+
+def _read(path):
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return _Snapshot(json.loads(raw), hashlib.sha256(raw).hexdigest(), (stat.st_mtime_ns, stat.st_size))
+
+
+class KnowledgeBase:
+    """治疗建议知识库；lookup 可在任意线程调用，热更新时整体替换快照，读取方不加锁"""
+
+    def __init__(self, path=DEFAULT_PATH, check_interval=5.0, keep_versions=4):
+        self.path = path
+        self.check_interval = check_interval
+        self.keep_versions = keep_versions
+        self._lock = threading.Lock()
+        self._counters = {"reloads": 0, "reload_errors": 0}
+        self._snapshot = _read(path)
+        self._history = OrderedDict([(self._snapshot.version, self._snapshot)])
+        self._next_check = time.monotonic() + (check_interval or 0)
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def _current(self):
+        """到检查时间时先检查文件是否变化，返回当前快照；所有读取入口都经过这里"""
+        if self.check_interval and time.monotonic() >= self._next_check:
+            self._check()
+        return self._snapshot
+
+    def lookup(self, grade, patient_info=None):
+        """返回该分级与患者风险因素对应的预生成建议（共享只读）"""
+        snapshot = self._current()
+        return snapshot.index[snapshot.key(int(grade), patient_info or {})]
+
+    def resolve(self, grade, patient_info=None):
+        """返回 (版本, 索引键)，两者取自同一快照，可代替建议内容存入状态"""
+        snapshot = self._current()
+        return snapshot.version, snapshot.key(int(grade), patient_info or {})
+
+    def key(self, grade, patient_info=None):
+        """建议的索引键 (分级, 各风险因素档位)"""
+        return self.resolve(grade, patient_info)[1]
+
+    def entry(self, key, version=None):
+        """
+        按索引键取建议。指定 version 且该版本仍在保留范围内时取该版本的建议，
+        否则取当前版本；键不在所取版本中（风险因素定义已变）时返回 None。
+        返回条目的 knowledge_version 与 version 不同即表示已按当前版本展开。
+        """
+        snapshot = self._current()
+        if version is not None and version != snapshot.version:
+            snapshot = self._history.get(version, snapshot)
+        return snapshot.index.get(tuple(key))
+
+    def _check(self):
+        # 只让一个线程检查文件，其余线程继续用当前快照
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return
+            if (stat.st_mtime_ns, stat.st_size) != self._snapshot.marker:
+                self._reload()
+        finally:
+            self._lock.release()
+
+    def reload(self):
+        """立即重新载入知识文件，成功返回 True；文件无效时保留当前版本"""
+        with self._lock:
+            return self._reload()
+
+    def _reload(self):
+        old = self._snapshot
+        try:
+            snapshot = _read(self.path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self._counters["reload_errors"] += 1
+            log_event(logger, logging.WARNING, "knowledge_reload_failed", path=self.path, error=str(e))
+            return False
+        if snapshot.digest != old.digest:
+            self._counters["reloads"] += 1
+            log_event(logger, logging.INFO, "knowledge_reloaded", old_version=old.version,
+                      version=snapshot.version, entries=len(snapshot.index))
+        self._snapshot = snapshot
+        self._history.pop(snapshot.version, None)
+        self._history[snapshot.version] = snapshot
+        while len(self._history) > max(self.keep_versions, 1):
+            self._history.popitem(last=False)
+        return True
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {"version": snapshot.version, "entries": len(snapshot.index), **self._counters}
+
+
+def main(argv=None):
+    """校验知识文件：python DR_Knowledge.py [path]，打印版本与条目数"""
+    import sys
+    argv = sys.argv[1:] if argv is None else argv
+    knowledge = KnowledgeBase(argv[0] if argv else DEFAULT_PATH, check_interval=None)
+    stats = knowledge.stats()
+    print(f"{knowledge.path}: 版本 {stats['version']}，{stats['entries']} 条预生成建议")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,554 @@
+# DR_LLMClient.py - 带连接池、限流、截止时间、重试、对冲请求与熔断的大模型客户端
+#
+# OpenAICompatibleChatClient: 基于 httpx 连接池调用 OpenAI 兼容接口
+#   （DashScope compatible-mode 或 DR_FakeLLMServer）。
+# ResilientLLM: 包装任意提供 invoke/ainvoke 的模型，依次施加
+#   熔断 -> 令牌桶限流 -> 并发信号量 -> 截止时间内的（对冲）调用 -> 抖动退避重试。
+# 所有失败最终以 LLMUnavailableError 抛出，由 vision_analysis_node 回退到确定性的默认 vision_result。
+# 同步调用超过截止时间后，已在执行的底层调用无法中断：它继续占用执行线程，调用方的并发槽位也到它结束才释放，
+# 因此执行线程数始终不超过 max_concurrency × 2（主请求 + 对冲），被放弃的调用不会让新请求排队到超时。
+import asyncio
+import contextvars
+import json
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+class LLMUnavailableError(Exception):
+    """大模型调用在截止时间/重试次数内未能成功"""
+
+
+class DeadlineExceeded(LLMUnavailableError, TimeoutError):
+    """超过单次调用的截止时间"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """熔断器打开，直接拒绝调用"""
+
+
+class TokenBucket:
+    """令牌桶限流：rate 为每秒补充的令牌数，burst 为桶容量"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """预订一个令牌，返回需要等待的秒数；等待超过 max_wait 时不预订并返回 None"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait_seconds = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait_seconds > max_wait:
+                return None
+            self._tokens -= 1
+            return wait_seconds
+
+
+class CircuitBreaker:
+    """连续失败 failure_threshold 次后打开，reset_timeout 秒后放行一次试探调用"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.opened_count = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("大模型熔断中")
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    raise CircuitOpenError("大模型熔断试探中")
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened_count += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class OpenAICompatibleChatClient:
+    """基于 httpx 连接池的 OpenAI 兼容 Chat Completions 客户端"""
+
+    def __init__(self, base_url, model, api_key="", timeout=60.0, pool_size=32):
+        import httpx
+        self._httpx = httpx
+        self.base_url = base_url.rstrip("/")
+        self.model_name = model
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._client = httpx.Client(headers=headers, limits=limits, timeout=timeout)
+        self._headers = headers
+        self._limits = limits
+        self._timeout = timeout
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _payload(self, messages, kwargs):
+        payload = {"model": self.model_name, "messages": [_to_openai_message(m) for m in messages]}
+        payload.update({k: v for k, v in kwargs.items() if k in ("max_tokens", "temperature", "top_p")})
+        return payload
+
+    @staticmethod
+    def _parse(response):
+        response.raise_for_status()
+        return AIMessage(content=response.json()["choices"][0]["message"]["content"])
+
+    def invoke(self, messages, config=None, **kwargs):
+        return self._parse(self._client.post(f"{self.base_url}/chat/completions", json=self._payload(messages, kwargs)))
+
+    def _async_client(self):
+        # httpx.AsyncClient 绑定事件循环，按循环各维护一个连接池
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = self._httpx.AsyncClient(
+                headers=self._headers, limits=self._limits, timeout=self._timeout
+            )
+        return client
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        client = self._async_client()
+        return self._parse(await client.post(f"{self.base_url}/chat/completions", json=self._payload(messages, kwargs)))
+
+    @staticmethod
+    def _sse_chunk(line):
+        """解析一行 SSE，返回 AIMessageChunk；非数据行返回 None"""
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            return None
+        choices = json.loads(data).get("choices") or [{}]
+        return AIMessageChunk(content=choices[0].get("delta", {}).get("content") or "")
+
+    def stream(self, messages, config=None, **kwargs):
+        payload = dict(self._payload(messages, kwargs), stream=True)
+        with self._client.stream("POST", f"{self.base_url}/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                chunk = self._sse_chunk(line)
+                if chunk is not None:
+                    yield chunk
+
+    async def astream(self, messages, config=None, **kwargs):
+        payload = dict(self._payload(messages, kwargs), stream=True)
+        async with self._async_client().stream("POST", f"{self.base_url}/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                chunk = self._sse_chunk(line)
+                if chunk is not None:
+                    yield chunk
+
+    def close(self):
+        self._client.close()
+
+
+def _to_openai_message(message):
+    if isinstance(message, dict):
+        return message
+    role = {"human": "user", "ai": "assistant"}.get(message.type, message.type)
+    return {"role": role, "content": message.content}
+
+
+class ResilientLLM:
+    """为底层模型增加限流、并发上限、截止时间、抖动重试、对冲请求与熔断"""
+
+    def __init__(self, model, max_concurrency=16, rate=None, burst=None, timeout=30.0,
+                 max_retries=2, backoff=0.2, hedge=False, hedge_quantile=0.95, hedge_min_samples=20,
+                 breaker=None):
+        self.model = model
+        self.model_name = getattr(model, "model_name", "")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self._limiter = TokenBucket(rate, burst) if rate else None
+        self._max_concurrency = max_concurrency
+        self._sync_slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = weakref.WeakKeyDictionary()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="dr-llm")
+        self._latencies = deque(maxlen=200)
+        self._counters = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0, "timeouts": 0,
+            "hedges": 0, "hedge_wins": 0, "rejected": 0, "abandoned": 0
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def supports_streaming(self):
+        return hasattr(self.model, "astream")
+
+    # ---- 统计 ----
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._counters[key] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["breaker_state"] = self.breaker.state
+        stats["breaker_opened"] = self.breaker.opened_count
+        stats["hedge_delay"] = self._hedge_delay()
+        return stats
+
+    def _record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _hedge_delay(self):
+        """最近成功调用延迟的 p95（样本不足时不对冲）"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_quantile))]
+
+    def _backoff_delay(self, attempt):
+        """全抖动指数退避"""
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def _admit(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self._count("rejected")
+            raise
+        self._count("calls")
+        return time.monotonic() + self.timeout
+
+    def _reserve_token(self, deadline):
+        if self._limiter is None:
+            return 0.0
+        wait_seconds = self._limiter.reserve(deadline - time.monotonic())
+        if wait_seconds is None:
+            raise DeadlineExceeded("等待限流令牌超过截止时间")
+        return wait_seconds
+
+    def _finish(self, error):
+        if error is None:
+            self.breaker.record_success()
+            self._count("successes")
+            return
+        self.breaker.record_failure()
+        self._count("failures")
+        if isinstance(error, DeadlineExceeded):
+            self._count("timeouts")
+        if isinstance(error, LLMUnavailableError):
+            raise error
+        raise LLMUnavailableError(f"大模型调用失败: {error}") from error
+
+    # ---- 同步路径 ----
+
+    def invoke(self, messages, config=None, **kwargs):
+        deadline = self._admit()
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                time.sleep(self._reserve_token(deadline))
+                if not self._sync_slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    raise DeadlineExceeded("等待并发槽位超过截止时间")
+                futures = []
+                try:
+                    response = self._call_sync(messages, config, kwargs, deadline, futures)
+                finally:
+                    self._release_after(futures)
+                self._finish(None)
+                return response
+            except DeadlineExceeded as e:
+                error = e
+                break
+            except Exception as e:
+                error = e
+                delay = self._backoff_delay(attempt)
+                if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    break
+                self._count("retries")
+                time.sleep(delay)
+        self._finish(error)
+
+    def _submit(self, messages, config, kwargs):
+        # 复制上下文，保留 LangChain 回调（messages 流式模式依赖它）
+        context = contextvars.copy_context()
+        started = time.monotonic()
+        future = self._executor.submit(context.run, self.model.invoke, messages, config, **kwargs)
+        future.started = started
+        return future
+
+    def _release_after(self, futures):
+        """所有底层调用结束后释放并发槽位；超时放弃但仍在执行的调用继续占用槽位"""
+        running = [future for future in futures if not future.done()]
+        if not running:
+            self._sync_slots.release()
+            return
+        self._count("abandoned", len(running))
+        remaining = [len(running)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._sync_slots.release()
+
+        for future in running:
+            future.add_done_callback(on_done)
+
+    def _call_sync(self, messages, config, kwargs, deadline, futures):
+        """futures 由调用方传入空列表，返回后其中为本次提交的全部底层调用"""
+        futures.append(self._submit(messages, config, kwargs))
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None:
+            done, _ = wait(futures, timeout=min(hedge_delay, max(0.0, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline:
+                self._count("hedges")
+                futures.append(self._submit(messages, config, kwargs))
+
+        pending = set(futures)
+        first_error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is not futures[0]:
+                        self._count("hedge_wins")
+                    self._record_latency(time.monotonic() - future.started)
+                    return future.result()
+                first_error = first_error or future.exception()
+        for future in pending:
+            future.cancel()
+        if first_error is not None and not pending:
+            raise first_error
+        raise DeadlineExceeded(f"大模型调用超过 {self.timeout}s 截止时间")
+
+    # ---- 异步路径 ----
+
+    def _loop_slots(self):
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.get(loop)
+        if slots is None:
+            slots = self._async_slots[loop] = asyncio.Semaphore(self._max_concurrency)
+        return slots
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        deadline = self._admit()
+        error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.sleep(self._reserve_token(deadline))
+                slots = self._loop_slots()
+                try:
+                    await asyncio.wait_for(slots.acquire(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded("等待并发槽位超过截止时间")
+                try:
+                    response = await self._call_async(messages, config, kwargs, deadline)
+                finally:
+                    slots.release()
+                self._finish(None)
+                return response
+            except DeadlineExceeded as e:
+                error = e
+                break
+            except Exception as e:
+                error = e
+                delay = self._backoff_delay(attempt)
+                if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    break
+                self._count("retries")
+                await asyncio.sleep(delay)
+        self._finish(error)
+
+    async def _timed(self, messages, config, kwargs):
+        started = time.monotonic()
+        response = await self.model.ainvoke(messages, config, **kwargs)
+        return response, time.monotonic() - started
+
+    async def _call_async(self, messages, config, kwargs, deadline):
+        primary = asyncio.ensure_future(self._timed(messages, config, kwargs))
+        tasks = [primary]
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=min(hedge_delay, max(0.0, deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline:
+                self._count("hedges")
+                tasks.append(asyncio.ensure_future(self._timed(messages, config, kwargs)))
+
+        pending = set(tasks)
+        first_error = None
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        response, seconds = task.result()
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        self._record_latency(seconds)
+                        return response
+                    first_error = first_error or task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        if first_error is not None and not pending:
+            raise first_error
+        raise DeadlineExceeded(f"大模型调用超过 {self.timeout}s 截止时间")
+
+    # ---- 流式 ----
+    # 已输出部分内容后不再重试也不对冲；调用方提前关闭流视为成功
+
+    def stream(self, messages, config=None, **kwargs):
+        """同步流式：截止时间只在 chunk 之间检查（阻塞读取的超时由底层客户端负责）"""
+        deadline = self._admit()
+        error = None
+        for attempt in range(self.max_retries + 1):
+            yielded = False
+            try:
+                time.sleep(self._reserve_token(deadline))
+                if not self._sync_slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    raise DeadlineExceeded("等待并发槽位超过截止时间")
+                started = time.monotonic()
+                try:
+                    for chunk in self.model.stream(messages, config, **kwargs):
+                        if time.monotonic() >= deadline:
+                            raise DeadlineExceeded(f"大模型调用超过 {self.timeout}s 截止时间")
+                        yielded = True
+                        yield chunk
+                finally:
+                    self._sync_slots.release()
+                self._record_latency(time.monotonic() - started)
+                self._finish(None)
+                return
+            except GeneratorExit:
+                self._finish(None)
+                raise
+            except DeadlineExceeded as e:
+                error = e
+                break
+            except Exception as e:
+                error = e
+                delay = self._backoff_delay(attempt)
+                if yielded or attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    break
+                self._count("retries")
+                time.sleep(delay)
+        self._finish(error)
+
+    async def astream(self, messages, config=None, **kwargs):
+        """异步流式：每个 chunk 的等待都受截止时间约束"""
+        deadline = self._admit()
+        error = None
+        for attempt in range(self.max_retries + 1):
+            yielded = False
+            try:
+                await asyncio.sleep(self._reserve_token(deadline))
+                slots = self._loop_slots()
+                try:
+                    await asyncio.wait_for(slots.acquire(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded("等待并发槽位超过截止时间")
+                started = time.monotonic()
+                stream = self.model.astream(messages, config, **kwargs)
+                try:
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), max(0.0, deadline - time.monotonic()))
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            raise DeadlineExceeded(f"大模型调用超过 {self.timeout}s 截止时间")
+                        yielded = True
+                        yield chunk
+                finally:
+                    slots.release()
+                    await stream.aclose()
+                self._record_latency(time.monotonic() - started)
+                self._finish(None)
+                return
+            except GeneratorExit:
+                self._finish(None)
+                raise
+            except DeadlineExceeded as e:
+                error = e
+                break
+            except Exception as e:
+                error = e
+                delay = self._backoff_delay(attempt)
+                if yielded or attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    break
+                self._count("retries")
+                await asyncio.sleep(delay)
+        self._finish(error)
+
+    # ---- 批量 ----
+
+    def batch(self, inputs, config=None, return_exceptions=False, **kwargs):
+        """
+        逐条 invoke。外层条目在临时线程池中执行，不占用底层调用使用的 self._executor：
+        否则外层任务占满执行线程后，内层调用只能排队到截止时间。
+        """
+        if not inputs:
+            return []
+        workers = min(len(inputs), self._max_concurrency)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dr-llm-batch") as pool:
+            futures = [pool.submit(contextvars.copy_context().run, self.invoke, messages, config, **kwargs)
+                       for messages in inputs]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results.append(e)
+        return results
+
+    async def abatch(self, inputs, config=None, return_exceptions=False, **kwargs):
+        return await asyncio.gather(
+            *(self.ainvoke(messages, config, **kwargs) for messages in inputs),
+            return_exceptions=return_exceptions
+        )
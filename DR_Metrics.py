@@ -0,0 +1,314 @@
+# DR_Metrics.py - 节点耗时埋点、进程内直方图与本地 Prometheus 指标端点
+#
+# instrument_node 包装经 builder.add_node 注册的每个节点，记录墙钟耗时与输入状态大小；
+# 视觉节点额外记录大模型耗时与解析失败次数。指标以 Prometheus 文本格式在本地 HTTP 端口暴露。
+# 日志统一为 key=value 结构化格式，DR_LOG_LEVEL=OFF 可在生产环境关闭。
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+TOKEN_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+# 状态序列化有开销，每个节点每 N 次调用采样一次状态大小
+STATE_SAMPLE_EVERY = int(os.environ.get("DR_METRICS_STATE_SAMPLE_EVERY", 10))
+
+
+class Histogram:
+    """带标签的累积直方图"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            for labels, (bucket_counts, total, count) in items:
+                base = _format_labels(self.label_names, labels)
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + (repr(float(bound)),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names + ('le',), labels + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{base} {total}")
+                lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+
+class Counter:
+    """带标签的单调计数器"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class MetricsRegistry:
+    """指标注册表；collector 为返回 [(名称, 类型, 说明, 数值)] 的回调，用于导出缓存等组件的统计"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, metric_type, help_text, value in collector():
+                lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+node_latency = registry.register(Histogram(
+    "dr_node_duration_seconds", "诊断图节点墙钟耗时", ("node",)))
+node_state_bytes = registry.register(Histogram(
+    "dr_node_state_bytes", "节点输入状态的 JSON 序列化大小（按 DR_METRICS_STATE_SAMPLE_EVERY 采样）", ("node",), SIZE_BUCKETS))
+node_errors = registry.register(Counter(
+    "dr_node_errors_total", "节点异常次数", ("node",)))
+llm_latency = registry.register(Histogram(
+    "dr_llm_duration_seconds", "视觉大模型调用耗时", ("node",)))
+parse_failures = registry.register(Counter(
+    "dr_vision_parse_failures_total", "视觉大模型输出解析失败（回退到分级模型结果）次数"))
+vision_parse_outcomes = registry.register(Counter(
+    "dr_vision_parse_total", "视觉大模型输出解析方式（json/repaired/partial/failed）", ("outcome",)))
+vision_fields_ready = registry.register(Histogram(
+    "dr_vision_fields_ready_seconds", "流式输出中 predicted_grade 与 confidence 就绪耗时"))
+vision_stream_tail = registry.register(Histogram(
+    "dr_vision_stream_tail_seconds", "字段就绪后剩余的生成耗时，即提前结束模式每次可节省的时间"))
+vision_early_stops = registry.register(Counter(
+    "dr_vision_early_stops_total", "字段就绪后提前结束生成的次数"))
+vote_samples = registry.register(Counter(
+    "dr_vision_vote_samples_total", "自洽投票采样数：counted 计票，failed 失败或无法解析，cancelled 判定后取消", ("status",)))
+vote_early_stops = registry.register(Counter(
+    "dr_vision_vote_early_stops_total", "投票结果已定、提前取消剩余采样的次数"))
+vote_share = registry.register(Histogram(
+    "dr_vision_vote_share", "胜出等级的票数占比（作为视觉大模型置信度）", buckets=(0.2, 0.4, 0.5, 0.6, 0.8, 1.0)))
+triage_decisions = registry.register(Counter(
+    "dr_triage_decisions_total", "分诊结果：vision 调用视觉大模型，grading_only 跳过", ("route",)))
+llm_fallbacks = registry.register(Counter(
+    "dr_vision_llm_fallbacks_total", "视觉大模型超时/熔断/重试耗尽后回退到默认结果的次数", ("reason",)))
+grading_batch_size = registry.register(Histogram(
+    "dr_grading_batch_size", "分级模型每次推理的批大小", buckets=(1, 2, 4, 8, 16, 32, 64, 128)))
+grading_queue_wait = registry.register(Histogram(
+    "dr_grading_queue_wait_seconds", "分级请求从入队到所在批开始推理的等待时间"))
+grading_inference_latency = registry.register(Histogram(
+    "dr_grading_inference_seconds", "分级模型单批推理耗时"))
+singleflight_requests = registry.register(Counter(
+    "dr_singleflight_requests_total", "诊断请求去重：leader 实际执行，coalesced 并入在途的相同请求，cached 命中近期结果", ("outcome",)))
+job_events = registry.register(Counter(
+    "dr_jobs_total", "异步诊断任务事件：submitted/rejected（背压）/completed/failed/redelivered（租约过期重投）/abandoned/stale", ("event",)))
+job_queue_wait = registry.register(Histogram(
+    "dr_job_queue_wait_seconds", "异步诊断任务从提交到首次被领取的排队时间"))
+job_duration = registry.register(Histogram(
+    "dr_job_duration_seconds", "异步诊断任务单次执行耗时"))
+prompt_tokens = registry.register(Histogram(
+    "dr_prompt_tokens", "每次调用的提示词输入 token 数（静态前缀 + 可变部分）", ("template",), TOKEN_BUCKETS))
+prompt_build_seconds = registry.register(Histogram(
+    "dr_prompt_build_seconds", "提示词渲染与 token 计数耗时", ("template",),
+    (0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005)))
+prompt_over_budget = registry.register(Counter(
+    "dr_prompt_over_budget_total", "提示词 token 数超过 DR_PROMPT_TOKEN_BUDGET 的次数", ("template",)))
+stream_first_event = registry.register(Histogram(
+    "dr_stream_first_event_seconds", "流式诊断从提交到推送首个阶段事件、视觉 token 或最终结果的时间（不含立即返回的占位内容）"))
+shard_requests = registry.register(Counter(
+    "dr_shard_requests_total", "分片服务请求：ok 完成，error 出错或分片退出，busy 分片已满被拒绝", ("shard", "outcome")))
+
+
+# ---- 结构化日志 ----
+
+class KeyValueFormatter(logging.Formatter):
+    """输出 ts level logger event key=value ... 形式的单行日志"""
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        parts = [
+            self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            record.levelname,
+            record.name,
+            record.getMessage()
+        ]
+        parts.extend(f"{key}={json.dumps(value, ensure_ascii=False, default=str)}" for key, value in fields.items())
+        line = " ".join(parts)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def configure_logging(level=None):
+    """按 DR_LOG_LEVEL（DEBUG/INFO/WARNING/ERROR/OFF）配置 DR 日志"""
+    level = (level or os.environ.get("DR_LOG_LEVEL", "INFO")).upper()
+    logger = logging.getLogger("DR")
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(KeyValueFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.disabled = level == "OFF"
+    logger.setLevel(logging.INFO if level == "OFF" else level)
+    return logger
+
+
+def log_event(logger, level, event, **fields):
+    """记录一条结构化日志事件"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+logger = logging.getLogger("DR.metrics")
+
+
+# ---- 节点埋点 ----
+
+def _state_size(state):
+    try:
+        return len(json.dumps(state, ensure_ascii=False, default=str).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _current_node(default):
+    from langgraph.config import get_config
+    try:
+        return get_config().get("metadata", {}).get("langgraph_node", default)
+    except RuntimeError:
+        return default
+
+
+def instrument_node(func, afunc, node_logger=None):
+    """包装节点的同步/异步实现，返回保留原签名的 (func, afunc)"""
+    node_logger = node_logger or logger
+    default_name = func.__name__
+    calls = itertools.count()
+
+    def _start(state):
+        node = _current_node(default_name)
+        if STATE_SAMPLE_EVERY and next(calls) % STATE_SAMPLE_EVERY == 0:
+            node_state_bytes.observe(_state_size(state), node)
+        log_event(node_logger, logging.DEBUG, "node_start", node=node)
+        return node, time.perf_counter()
+
+    def _finish(node, start, error=None):
+        elapsed = time.perf_counter() - start
+        node_latency.observe(elapsed, node)
+        if error is not None:
+            node_errors.inc(node)
+            log_event(node_logger, logging.ERROR, "node_error", node=node, seconds=round(elapsed, 6), error=str(error))
+        else:
+            log_event(node_logger, logging.DEBUG, "node_done", node=node, seconds=round(elapsed, 6))
+
+    @functools.wraps(func)
+    def wrapped(state, *args, **kwargs):
+        node, start = _start(state)
+        try:
+            result = func(state, *args, **kwargs)
+        except Exception as e:
+            _finish(node, start, e)
+            raise
+        _finish(node, start)
+        return result
+
+    @functools.wraps(afunc)
+    async def awrapped(state, *args, **kwargs):
+        node, start = _start(state)
+        try:
+            result = await afunc(state, *args, **kwargs)
+        except Exception as e:
+            _finish(node, start, e)
+            raise
+        _finish(node, start)
+        return result
+
+    return wrapped, awrapped
+
+
+@contextmanager
+def llm_timer(node="vision_analysis_node"):
+    """统计一次大模型调用耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        llm_latency.observe(time.perf_counter() - start, node)
+
+
+# ---- 本地指标端点 ----
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """在后台线程启动 /metrics 端点，返回 server 以便关闭"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="dr-metrics", daemon=True).start()
+    log_event(logger, logging.INFO, "metrics_server_started", host=host, port=server.server_port)
+    return server
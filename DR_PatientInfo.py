@@ -0,0 +1,271 @@
+# DR_PatientInfo.py - 从医生输入的自由文本中抽取结构化患者信息（不调用大模型）
+#
+# 所有规则编译为一个带命名分组的正则，finditer 单遍扫描全文，按命中的分组分派到对应字段：
+#   age / sex / diabetes_type / diabetes_duration（年）/ hbA1c（%）/ blood_pressure（mmHg）/ other_conditions
+# 以及文本中提及的 DR 分级 dr_grade。中英文单位均可：个月→年、mmol/mol→%、kPa→mmHg。
+# “N级”“grade N”只在附近有 DR 语境（视网膜、眼底、增殖、分期、DR/NPDR/PDR 等）时才算 DR 分级，
+# 紧邻高血压、心功能等其他分级对象时不算；轻度/重度/severe 等程度词须与 DR 词同在一个分句并紧挨着，
+# “轻度贫血”“severe hypoglycemia”不算。否定词“不”不作用于“不佳、不良、不全”等描述。
+# 否定词（无、否认、no、denies 等）作用到下一个分句分隔符为止，被否定的合并症不计入。
+# 单值字段取第一次出现的值。
+#
+# 用法: python DR_PatientInfo.py notes.txt > patient_info.jsonl   # 每行一条病历文本
+import json
+import re
+import sys
+
+_NUM = r"\d+(?:\.\d+)?|[一二两三四五六七八九十]{1,3}"
+_CN_DIGITS = {"一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_EN_YEARS = r"(?:years?|yrs?|y)(?![a-z])"
+_EN_MONTHS = r"(?:months?|mos?)(?![a-z])"
+_IS = r"\s*(?:[:：=]|为|是|(?<![a-z])(?:of|was|is|at)(?![a-z]))?\s*"
+
+# 合并症：规范名 -> 同义词（中英文）
+CONDITIONS = {
+    "高血压": ["高血压病", "高血压", "hypertension", "htn"],
+    "高脂血症": ["高脂血症", "高血脂", "血脂异常", "hyperlipidemia", "dyslipidemia", "hypercholesterolemia"],
+    "冠心病": ["冠心病", "冠状动脉粥样硬化性心脏病", "coronary artery disease", "cad"],
+    "糖尿病肾病": ["糖尿病肾病", "慢性肾病", "慢性肾脏病", "肾功能不全", "diabetic nephropathy", "nephropathy", "ckd"],
+    "脑卒中": ["脑卒中", "脑梗死", "脑梗", "中风", "stroke"],
+    "周围神经病变": ["周围神经病变", "peripheral neuropathy", "neuropathy"],
+    "白内障": ["白内障", "cataract"],
+    "青光眼": ["青光眼", "glaucoma"],
+    "肥胖": ["肥胖", "obesity", "obese"],
+    "吸烟": ["吸烟", "抽烟", "smoker", "smoking"],
+    "妊娠": ["妊娠", "怀孕", "pregnant", "pregnancy"],
+}
+
+_GRADE_WORDS = {"轻度": 1, "中度": 2, "重度": 3, "增殖": 4, "mild": 1, "moderate": 2, "severe": 3, "proliferative": 4, "pdr": 4}
+
+
+def _word(pattern):
+    """英文词两侧不能紧挨字母；中文不受影响"""
+    return rf"(?<![a-z])(?:{pattern})(?![a-z])"
+
+
+# 数字分级前后各取一小段文本判断语境：前文中最后出现的是 DR 词而不是其他分级对象，或后文以 DR 词为对象
+_CONTEXT_BEFORE = 12
+_CONTEXT_AFTER = 10
+_DR_CONTEXT = r"视网膜|眼底|糖网|增殖|分期|" + _word(r"n?pdr|dr|retinopathy|fundus")
+_NON_DR_CONTEXT = (r"高血压|心功能|心衰|心力衰竭|肌力|肾|贫血|肥胖|体重|" +
+                   _word(r"nyha|ckd|htn|hypertension|heart\s+failure|stage"))
+_GRADE_CONTEXT = re.compile(rf"(?P<dr>{_DR_CONTEXT})|(?P<other>{_NON_DR_CONTEXT})", re.I)
+_NON_DR_AFTER = re.compile(rf"\s*(?:{_NON_DR_CONTEXT})", re.I)
+# 程度词只看所在分句：后文最先出现的对象词须是 DR 词（含“病变”），或前文紧邻 DR 词（如“DR中度”）
+_WORD_AFTER = 48
+_WORD_BEFORE = 8
+_MODIFIERS = _word(r"diabetic|diabetes|non[-\s]?proliferative") + r"|糖尿病性?|非|期|性|的|型"
+_WORD_CONTEXT = re.compile(
+    rf"(?P<dr>{_DR_CONTEXT}|病变)|"
+    rf"(?P<skip>{_MODIFIERS})|"
+    rf"(?P<other>{_NON_DR_CONTEXT}|[a-z]+|[\u4e00-\u9fff])",
+    re.I
+)
+_WORD_BEFORE_DR = re.compile(rf"(?:{_DR_CONTEXT}|视网膜病变)\s*[:：]?\s*$", re.I)
+_CLAUSE_END = re.compile(r"[，。；;,！!？?\n]")
+
+
+def _in_dr_context(text, start, end):
+    """分级数字 text[start:end] 是否在描述 DR"""
+    after = text[end:end + _CONTEXT_AFTER]
+    if _NON_DR_AFTER.match(after):
+        return False
+    last = None
+    for match in _GRADE_CONTEXT.finditer(text, max(0, start - _CONTEXT_BEFORE), start):
+        last = match.lastgroup
+    if last is not None:
+        return last == "dr"
+    return any(match.lastgroup == "dr" for match in _GRADE_CONTEXT.finditer(after))
+
+
+def _word_in_dr_context(text, start, end):
+    """程度词 text[start:end] 是否在描述 DR：PDR 自身即是，其余须与 DR 词同句紧邻"""
+    word = text[start:end].lower()
+    if word == "pdr":
+        return True
+    after = _CLAUSE_END.split(text[end:end + _WORD_AFTER], 1)[0]
+    # 跳过“diabetic”“非”“期”等修饰，看后文第一个对象词
+    for match in _WORD_CONTEXT.finditer(after):
+        if match.lastgroup == "dr":
+            return True
+        if match.lastgroup == "other":
+            break
+    before = _CLAUSE_END.split(text[max(0, start - _WORD_BEFORE):start])[-1]
+    return bool(_WORD_BEFORE_DR.search(before))
+
+
+def _synonyms(words):
+    return "|".join(_word(re.escape(w).replace(r"\ ", r"\s+")) if w.isascii() else re.escape(w)
+                    for w in sorted(words, key=len, reverse=True))
+
+
+# 顺序即同一位置上的优先级：较长、较具体的规则在前
+_RULES = [
+    ("SEP", r"[，。；;,！!？?\n]"),
+    ("GDM", r"妊娠期?糖尿病|" + _word(r"gestational\s+diabetes|gdm")),
+    ("NEG", r"否认|没有|未见|不伴|不吸|不饮|不(?!佳|良|详|全|足|规律|稳定|适)|无|" +
+     _word(r"no|denies|denied|without|negative\s+for")),
+    ("TYPE_CN", r"(?P<type_cn>[12一二ⅠⅡ]|I{1,2})\s*型"),
+    ("TYPE_T", _word(r"t(?P<type_t>[12])dm") +
+     rf"(?:\s*(?:for|x)?\s*(?P<dur_t>\d+(?:\.\d+)?)\s*(?P<dur_t_unit>{_EN_YEARS}|{_EN_MONTHS}))?"),
+    ("TYPE_EN", _word(r"type\s*(?P<type_en>[12]|i{1,2})")),
+    ("AGE_CN", rf"(?P<age_cn>{_NUM})\s*周?岁"),
+    ("AGE_LABEL", rf"(?:年龄|{_word('age[d]?')}){_IS}(?P<age_label>\d{{1,3}}|{_NUM})"),
+    ("AGE_EN", r"(?<![\d.])(?P<age_en>\d{1,3})\s*(?:-\s*)?(?:years?|yrs?|y)[-\s]*old|(?<![\d.])(?P<age_yo>\d{1,3})\s*y/?o(?![a-z])"),
+    # 英文病历常见的 "67F" / "58 M" 写法，性别字母须大写
+    ("AGE_SEX", r"(?<![\w.])(?P<age_sex>\d{1,3})\s?(?P<sex_abbr>(?-i:[MF]))(?![a-z])"),
+    ("HBA1C", "(?:" + _word(r"hb\s*a1c|a1c") + rf"|糖化血红蛋白|糖化){_IS}(?:水平{_IS})?"
+              r"(?P<hba1c>\d+(?:\.\d+)?)\s*(?P<hba1c_unit>%|mmol/mol)?"),
+    ("BP", "(?:血压|" + _word(r"bp|blood\s+pressure") + rf"){_IS}"
+           r"(?P<sbp>\d{2,3}(?:\.\d)?)\s*/\s*(?P<dbp>\d{2,3}(?:\.\d)?)\s*(?P<bp_unit>mmhg|kpa)?"),
+    ("BP_UNIT", r"(?<![\d.])(?P<sbp2>\d{2,3})\s*/\s*(?P<dbp2>\d{2,3})\s*mmhg"),
+    ("DUR_CN", rf"(?:糖尿病|血糖升高|病程|确诊|{_word('dm')})\s*(?:病?史|病程)?\s*(?:约|已|有|达|为)?\s*"
+               rf"(?P<dur_cn>{_NUM})\s*(?P<dur_cn_unit>余年|多年|年|个多?月|月)"),
+    ("DUR_CN_PRE", rf"(?P<dur_pre>{_NUM})\s*(?P<dur_pre_unit>余年|多年|年|个多?月)的?(?:糖尿病|病史|病程)"),
+    ("DUR_EN", _word(r"diabetes(?:\s+mellitus)?|dm") + r"\s*(?:for|x|duration(?:\s+of)?)?\s*"
+               rf"(?P<dur_en>\d+(?:\.\d+)?)\s*(?P<dur_en_unit>{_EN_YEARS}|{_EN_MONTHS})"),
+    ("DUR_EN_PRE", rf"(?<![\d.])(?P<dur_en_pre>\d+(?:\.\d+)?)[-\s]*(?P<dur_en_pre_unit>{_EN_YEARS}|{_EN_MONTHS})[-\s]*"
+                   r"(?:history\s+of\s+)?(?:diabetes|t(?P<type_pre>[12])dm|dm)(?![a-z])"),
+    # "高血压2级" 是高血压分级，整体吞掉以免被当作 DR 分级
+    ("COND_HTN_GRADE", r"高血压病?\s*[1-3一二三]\s*级"),
+] + [
+    (f"COND_{i}", _synonyms(words)) for i, words in enumerate(CONDITIONS.values())
+] + [
+    ("NON_PROLIFERATIVE", r"非增殖|" + _word(r"non[-\s]?proliferative|npdr")),
+    ("GRADE_NUM", r"(?P<grade_num>[0-4一二三四])\s*级|" + _word(r"grade\s*(?P<grade_en>[0-4])")),
+    ("GRADE_WORD", "|".join(_word(w) if w.isascii() else w for w in _GRADE_WORDS)),
+    ("SEX_F", r"女性|女|" + _word(r"female|woman")),
+    ("SEX_M", r"男性|男|" + _word(r"male|man")),
+]
+
+# 规则可能的起始字符：数字、分隔符、上面规则中中文关键词的首字、合并症同义词的首字，以及英文单词词首。
+# 先用前瞻排除不可能命中的位置，逐位置尝试全部分支的开销只落在少数候选位置上（吞吐约为不加前瞻时的 1.6 倍）；
+# 新增以其他汉字开头的规则时须把首字加入 _RULE_FIRST_CHARS
+_RULE_FIRST_CHARS = "糖血病确妊否没未不无年男女非轻中重增ⅠⅡ一二两三四五六七八九十"
+_FIRST_CHARS = "".join(sorted(
+    set(_RULE_FIRST_CHARS) | {word[0] for words in CONDITIONS.values() for word in words if not word.isascii()}
+))
+_PATTERN = re.compile(
+    rf"(?=[\d{_FIRST_CHARS}，。；;,！!？?\n]|(?<![a-z])[a-z])(?:"
+    + "|".join(f"(?P<{kind}>{pattern})" for kind, pattern in _RULES) + ")",
+    re.I
+)
+_CONDITION_NAMES = {f"COND_{i}": name for i, name in enumerate(CONDITIONS)}
+_CONDITION_NAMES["COND_HTN_GRADE"] = "高血压"
+
+
+def _number(text):
+    """阿拉伯数字或不超过两位的中文数字"""
+    if text[0].isdigit():
+        value = float(text)
+        return int(value) if value.is_integer() else value
+    if "十" in text:
+        tens, _, ones = text.partition("十")
+        return _CN_DIGITS.get(tens, 1) * 10 + _CN_DIGITS.get(ones, 0)
+    return _CN_DIGITS.get(text)
+
+
+def _years(number, unit):
+    value = _number(number)
+    if value is None:
+        return None
+    unit = unit.lower()
+    if "月" in unit or unit.startswith("mo"):
+        return round(value / 12, 1)
+    return value
+
+
+def _diabetes_type(text):
+    return "1型" if text.upper() in ("1", "一", "I", "Ⅰ") else "2型"
+
+
+def extract(text):
+    """单遍扫描文本，返回抽取到的字段；未提及的字段不出现在结果中（other_conditions 总是存在）"""
+    info = {}
+    conditions = []
+    negated = False
+    for match in _PATTERN.finditer(text or ""):
+        kind = match.lastgroup
+        group = match.group
+        if kind == "SEP":
+            negated = False
+        elif kind == "NEG":
+            negated = True
+        elif kind.startswith("COND_"):
+            name = _CONDITION_NAMES[kind]
+            if not negated and name not in conditions:
+                conditions.append(name)
+        elif kind.startswith("AGE_"):
+            age = _number(group("age_cn") or group("age_label") or group("age_en") or group("age_yo") or group("age_sex"))
+            if age is not None and 0 < age < 120:
+                info.setdefault("age", age)
+                if group("sex_abbr"):
+                    info.setdefault("sex", "男" if group("sex_abbr") == "M" else "女")
+        elif kind == "SEX_F":
+            info.setdefault("sex", "女")
+        elif kind == "SEX_M":
+            info.setdefault("sex", "男")
+        elif kind == "GDM":
+            info.setdefault("diabetes_type", "妊娠期")
+        elif kind == "TYPE_CN":
+            info.setdefault("diabetes_type", _diabetes_type(group("type_cn")))
+        elif kind == "TYPE_EN":
+            info.setdefault("diabetes_type", _diabetes_type(group("type_en")))
+        elif kind == "TYPE_T":
+            info.setdefault("diabetes_type", _diabetes_type(group("type_t")))
+            if group("dur_t"):
+                info.setdefault("diabetes_duration", _years(group("dur_t"), group("dur_t_unit")))
+        elif kind.startswith("DUR_"):
+            if group("type_pre"):
+                info.setdefault("diabetes_type", _diabetes_type(group("type_pre")))
+            for name in ("dur_cn", "dur_pre", "dur_en", "dur_en_pre"):
+                if group(name):
+                    duration = _years(group(name), group(f"{name}_unit"))
+                    if duration is not None:
+                        info.setdefault("diabetes_duration", duration)
+                    break
+        elif kind == "HBA1C":
+            value = float(group("hba1c"))
+            # IFCC 单位（mmol/mol）换算为 NGSP 百分比；不带单位且数值明显超出百分比范围时按 mmol/mol 处理
+            if (group("hba1c_unit") or "").lower() == "mmol/mol" or value > 25:
+                value = 0.09148 * value + 2.152
+            info.setdefault("hbA1c", round(value, 1))
+        elif kind in ("BP", "BP_UNIT"):
+            systolic = float(group("sbp") or group("sbp2"))
+            diastolic = float(group("dbp") or group("dbp2"))
+            if (group("bp_unit") or "").lower() == "kpa" or systolic < 40:
+                systolic, diastolic = systolic * 7.5, diastolic * 7.5
+            info.setdefault("blood_pressure", {"systolic": round(systolic), "diastolic": round(diastolic)})
+        elif kind == "GRADE_NUM":
+            if "dr_grade" not in info and _in_dr_context(text, match.start(), match.end()):
+                grade = group("grade_num") or group("grade_en")
+                info["dr_grade"] = int(grade) if grade.isdigit() else _CN_DIGITS[grade]
+        elif kind == "GRADE_WORD":
+            if "dr_grade" not in info and _word_in_dr_context(text, match.start(), match.end()):
+                info["dr_grade"] = _GRADE_WORDS[match.group().lower()]
+    info["other_conditions"] = conditions
+    return info
+
+
+def extract_patient_info(text):
+    """诊断图使用的 patient_info：extract 的结果去掉文本中提及的 DR 分级"""
+    info = extract(text)
+    info.pop("dr_grade", None)
+    return info
+
+
+def extract_many(texts):
+    """批量抽取"""
+    return [extract(text) for text in texts]
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    with (open(path, 'r', encoding='utf-8') if path else sys.stdin) as f:
+        for line in f:
+            if line.strip():
+                sys.stdout.write(json.dumps(extract(line), ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# DR_Prompts.py - 提示词模板：启动时编译一次，静态前缀在前便于服务商前缀缓存，逐次统计 token 并对照预算
+#
+# 原视觉提示词每次调用都用 f-string 重建约 600 字符：分级标准中间夹着本例的分级结果，每行还带 4 个空格缩进，
+# 这些空白每次都计入输入 token。这里把提示词拆成两条消息：
+#   system：分级标准、输出格式等静态内容，编译时去掉缩进与空行，所有请求逐字节相同且放在最前面，
+#           服务商的前缀缓存（上下文缓存）可以命中；
+#   user：本例的可变内容，编译时拆成字面量片段与字段名，渲染只需一次 join。
+# 静态前缀的 token 数只在首次渲染时计算一次，之后每次只数可变部分；超过预算（DR_PROMPT_TOKEN_BUDGET）时
+# 记录告警与计数，不截断（分级提示词的可变部分只有分级结果）。
+# token 计数优先使用 dashscope 自带的通义千问分词器（依赖 tiktoken），不可用时按字符类别近似估计。
+import hashlib
+import logging
+import math
+import os
+import re
+import string
+import time
+from typing import NamedTuple
+
+from DR_Metrics import log_event, prompt_build_seconds, prompt_over_budget, prompt_tokens
+
+logger = logging.getLogger("DR.prompts")
+
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("DR_PROMPT_TOKEN_BUDGET", 1024))
+
+_TOKEN_PATTERN = re.compile(r"([\u3400-\u9fff\uf900-\ufaff])|([A-Za-z]+)|(\d)|(\n)|([ \t]+)|(\S)")
+
+
+def estimate_tokens(text):
+    """按字符类别近似估计 token 数：汉字、数字、标点、换行各计 1，英文单词与连续空格约每 4 个字符计 1"""
+    count = 0
+    for _, word, _, _, spaces, _ in _TOKEN_PATTERN.findall(text):
+        if word:
+            count += math.ceil(len(word) / 4)
+        elif spaces:
+            count += math.ceil(len(spaces) / 4)
+        else:
+            count += 1
+    return count
+
+
+_counter = None
+
+
+def count_tokens(text):
+    """输入 token 数；首次调用时选择分词器"""
+    global _counter
+    if _counter is None:
+        _counter = _load_counter()
+    return _counter(text)
+
+
+def _load_counter():
+    """DR_PROMPT_TOKENIZER 为 dashscope 分词器名（默认 qwen-turbo），estimate 或加载失败时近似估计"""
+    name = os.environ.get("DR_PROMPT_TOKENIZER", "qwen-turbo")
+    if name != "estimate":
+        try:
+            from dashscope import get_tokenizer
+            tokenizer = get_tokenizer(name)
+            return lambda text: len(tokenizer.encode(text))
+        except Exception as e:
+            log_event(logger, logging.INFO, "prompt_tokenizer_fallback", tokenizer=name, error=str(e))
+    return estimate_tokens
+
+
+def compact(text):
+    """去掉每行首尾空白与空行；模板源码可以按代码缩进书写，编译结果不含缩进"""
+    return "\n".join(line.strip() for line in text.strip().splitlines() if line.strip())
+
+
+class RenderedPrompt(NamedTuple):
+    """一次渲染结果：messages 直接传给大模型，cache_text 用于结果缓存键"""
+    messages: list
+    tokens: int
+    prefix_tokens: int
+    cache_text: str
+
+
+class PromptTemplate:
+    """编译后的两段式提示词：system 为静态前缀，user 为带 {字段} 的可变部分（只支持简单字段名）"""
+
+    def __init__(self, name, system, user, token_budget=None):
+        self.name = name
+        self.system = compact(system)
+        user = compact(user)
+        self._parts = []
+        for literal, field, spec, conversion in string.Formatter().parse(user):
+            if spec or conversion:
+                raise ValueError(f"模板 {name} 不支持格式说明: {{{field}}}")
+            self._parts.append((literal, field))
+        self.fields = tuple(field for _, field in self._parts if field)
+        self.token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+        # 模板内容变化时缓存键随之变化
+        self.digest = hashlib.sha256(f"{self.system}\x00{user}".encode("utf-8")).hexdigest()[:16]
+        self._prefix_tokens = None
+
+    @property
+    def prefix_tokens(self):
+        if self._prefix_tokens is None:
+            self._prefix_tokens = count_tokens(self.system)
+        return self._prefix_tokens
+
+    def render(self, **values):
+        """填入可变字段，返回 RenderedPrompt；缺少字段时抛出 KeyError"""
+        start = time.perf_counter()
+        user = "".join(literal + (str(values[field]) if field else "") for literal, field in self._parts)
+        tokens = self.prefix_tokens + count_tokens(user)
+        elapsed = time.perf_counter() - start
+        prompt_tokens.observe(tokens, self.name)
+        prompt_build_seconds.observe(elapsed, self.name)
+        if tokens > self.token_budget:
+            prompt_over_budget.inc(self.name)
+            log_event(logger, logging.WARNING, "prompt_over_budget", template=self.name, tokens=tokens,
+                      budget=self.token_budget)
+        log_event(logger, logging.DEBUG, "prompt_built", template=self.name, tokens=tokens,
+                  prefix_tokens=self.prefix_tokens, build_us=round(elapsed * 1e6, 1))
+        return RenderedPrompt(
+            [{"role": "system", "content": self.system}, {"role": "user", "content": user}],
+            tokens,
+            self.prefix_tokens,
+            f"{self.digest}:{user}"
+        )
+
+
+# 视觉大模型分级：分级标准与输出格式为静态前缀，本例只有分级模型结果
+VISION_GRADING = PromptTemplate(
+    "vision_grading",
+    system="""
+        请分析糖尿病视网膜眼底图像，给出病变分级：
+        分级标准：
+        0级 - 无视网膜病变
+        1级 - 轻度非增殖性糖尿病视网膜病变（仅微动脉瘤）
+        2级 - 中度非增殖性糖尿病视网膜病变
+        3级 - 重度非增殖性糖尿病视网膜病变
+        4级 - 增殖性糖尿病视网膜病变
+        请输出JSON格式：
+        {"predicted_grade":等级数字,"confidence":置信度,"key_findings":["主要发现"],"rationale":"分析理由"}
+    """,
+    user="当前分级模型结果: 等级{grade}"
+)
@@ -0,0 +1,140 @@
+# DR_Records.py - 诊断状态中的紧凑记录：状态里存按位置排列的普通元组，读取时套上 NamedTuple 视图
+#
+# 检查点序列化器（langgraph JsonPlusSerializer，msgpack）把普通元组编码为数组，不写字段名；
+# NamedTuple 与 dataclass 会连同模块名、类名和全部字段名一起编码，比 dict 还大，严格模式下也无法反序列化。
+# 因此节点写入状态时用 pack(record) 转成普通元组，读取时用 Record.of(value) 取得带字段名的视图
+# （检查点恢复后元组变为列表，of 同样适用）。
+# 共享数据只存一份：患者信息只在 patient_data；融合权重属于诊断系统配置，不入状态；
+# 治疗建议只存知识库索引键，完整报告与可读文本在出口处（落库、界面、批量任务）按需展开。
+from typing import NamedTuple
+
+
+def pack(record):
+    """转为普通元组写入状态"""
+    return tuple(record)
+
+
+class GradingRecord(NamedTuple):
+    """分级模型结果（患者信息单独存于 patient_data）"""
+    grade: int
+    confidence: float
+    image_path: str = ""
+    patient_id: str = None
+    source: str = "input"
+    probabilities: list = None
+
+    @classmethod
+    def of(cls, value):
+        return cls._make(value)
+
+    @classmethod
+    def from_result(cls, result):
+        return cls(
+            result.get("grade", 0), result.get("confidence", 0), result.get("image_path", ""),
+            result.get("patient_id"), result.get("source", "input"), result.get("probabilities")
+        )
+
+    def as_result(self):
+        """还原为 DRDiagnosisSystem 接口使用的 dict"""
+        result = self._asdict()
+        if result["probabilities"] is None:
+            del result["probabilities"]
+        return result
+
+
+class VisionRecord(NamedTuple):
+    """视觉大模型结果；只保留报告与集成用到的字段，模型额外输出的键不入状态"""
+    predicted_grade: int
+    confidence: float = None
+    key_findings: list = ()
+    rationale: str = ""
+    vote_share: float = None
+    vote: dict = None
+
+    @classmethod
+    def of(cls, value):
+        return cls._make(value)
+
+    @classmethod
+    def from_result(cls, result):
+        return cls(
+            result.get("predicted_grade", 0), result.get("confidence"), result.get("key_findings", []),
+            result.get("rationale", ""), result.get("vote_share"), result.get("vote")
+        )
+
+    def as_result(self):
+        result = {
+            "predicted_grade": self.predicted_grade,
+            "confidence": self.confidence,
+            "key_findings": list(self.key_findings),
+            "rationale": self.rationale
+        }
+        # 未投票时不带 vote_share，集成沿用默认视觉置信度
+        if self.vote_share is not None:
+            result["vote_share"] = self.vote_share
+            result["vote"] = self.vote
+        return result
+
+
+class IntegrationRecord(NamedTuple):
+    """集成结果；model_weights 为诊断系统配置，展开时由调用方传入"""
+    final_grade: int
+    grading_grade: int
+    vision_grade: int
+    grading_confidence: float
+    vision_confidence: float
+    weighted_score: float
+    agreement: bool
+    mode: str
+
+    @classmethod
+    def of(cls, value):
+        return cls._make(value)
+
+    @classmethod
+    def from_result(cls, result):
+        confidence = result["confidence_scores"]
+        return cls(
+            result["final_grade"], result["grading_model_grade"], result["vision_llm_grade"],
+            confidence["grading_model"], confidence["vision_llm"],
+            result["integration_details"]["weighted_score"], result["agreement"], result.get("mode", "ensemble")
+        )
+
+    def as_result(self, model_weights):
+        """还原为 DRDiagnosisSystem.integrate_predictions 的返回结构"""
+        return {
+            "final_grade": self.final_grade,
+            "grading_model_grade": self.grading_grade,
+            "vision_llm_grade": self.vision_grade,
+            "confidence_scores": {
+                "grading_model": self.grading_confidence,
+                "vision_llm": self.vision_confidence
+            },
+            "integration_details": {
+                "weighted_score": self.weighted_score,
+                "model_weights": model_weights
+            },
+            "agreement": self.agreement,
+            "mode": self.mode
+        }
+
+
+class KnowledgeRecord(NamedTuple):
+    """知识查询结果：知识库版本 + 索引键，建议内容由 KnowledgeBase.entry(key, version) 取得"""
+    version: str
+    key: tuple
+
+    @classmethod
+    def of(cls, value):
+        return cls._make(value)
+
+
+class ReportRecord(NamedTuple):
+    """报告引用：落库用的请求 ID + 生成报告时的知识库版本与索引键；内容由集成结果、患者信息与知识库展开"""
+    request_id: str
+    knowledge_version: str
+    knowledge_key: tuple
+
+    @classmethod
+    def of(cls, value):
+        return cls._make(value)
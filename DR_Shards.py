@@ -0,0 +1,231 @@
+# DR_Shards.py - 多进程分片服务：N 个工作进程各自编译诊断图，请求按线程/请求 ID 路由到固定分片
+#
+# demo.launch 只有一个 Python 进程，JSON 解析、报告格式化以及图像预处理、分级推理等 CPU 工作共用一个 GIL。
+# ShardPool 启动 N 个工作进程，每个进程在自己的事件循环里并发执行诊断图（DR_Test.astream_diagnosis），
+# 报告文本也在工作进程中生成，只有进度事件与最终文本经队列回传服务进程。
+# 请求按 ID 的 crc32 取模路由：同一线程 ID 总落在同一分片，检查点等按线程保存的状态留在该进程内；
+# 分片进程退出时，其在途请求立即失败，后续请求顺延到下一个存活分片。
+# 每个分片最多 max_inflight 个在途请求，超出时 run 立即抛出 ShardBusy，由界面返回“服务繁忙”，不无限排队。
+# Linux 上工作进程以 fork 启动，不重新导入服务端模块与 Gradio；须在服务进程创建其他线程之前 start()。
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+import zlib
+
+from DR_Metrics import log_event, shard_requests
+
+logger = logging.getLogger("DR.shards")
+
+
+class ShardBusy(Exception):
+    """目标分片在途请求已满，调用方应提示稍后重试"""
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+
+
+def _ignore(kind, text):
+    pass
+
+
+def _post(loop, callback, *args):
+    """把回调交给调用方的事件循环；循环已关闭（调用方已退出）时丢弃，不影响分发线程"""
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+def _settle(future, kind, payload):
+    if future.done():
+        return
+    if kind == "done":
+        future.set_result(payload)
+    else:
+        future.set_exception(RuntimeError(payload))
+
+
+class ShardPool:
+    """
+    分片工作进程池；run 在任意事件循环中调用。
+    initializer(*initargs) 在每个工作进程编译图之前执行（如注入桩模型），spawn 启动时须可 pickle。
+    """
+
+    def __init__(self, shards=2, graph_config=None, max_inflight=64, initializer=None, initargs=(), ready_timeout=120.0):
+        self.shards = shards
+        self.graph_config = graph_config or {"checkpointing": False}
+        self.max_inflight = max_inflight
+        self.initializer = initializer
+        self.initargs = initargs
+        self.ready_timeout = ready_timeout
+        self._context = _context()
+        self._requests = [self._context.Queue() for _ in range(shards)]
+        self._responses = self._context.Queue()
+        self._processes = []
+        self._dead = [False] * shards
+        self._inflight = [0] * shards
+        self._pending = {}  # token -> (loop, on_event, future, shard)
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Semaphore(0)
+        self._stopping = threading.Event()
+        self._dispatcher = None
+
+    def start(self):
+        """启动工作进程并等待全部完成预热"""
+        start = time.perf_counter()
+        for index in range(self.shards):
+            process = self._context.Process(
+                target=_shard_main, name=f"dr-shard-{index}", daemon=True,
+                args=(index, self._requests[index], self._responses, self.graph_config, self.initializer, self.initargs)
+            )
+            process.start()
+            self._processes.append(process)
+        # 分发线程在所有 fork 之后才创建
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="dr-shard-dispatch", daemon=True)
+        self._dispatcher.start()
+        for _ in range(self.shards):
+            if not self._ready.acquire(timeout=self.ready_timeout):
+                raise RuntimeError(f"分片进程未在 {self.ready_timeout} 秒内完成预热")
+        log_event(logger, logging.INFO, "shards_started", shards=self.shards,
+                  seconds=round(time.perf_counter() - start, 3))
+        return self
+
+    def stop(self, timeout=30.0):
+        """通知各分片处理完在途请求后退出"""
+        self._stopping.set()
+        for requests in self._requests:
+            requests.put(None)
+        for process in self._processes:
+            process.join(timeout)
+        if self._dispatcher is not None:
+            self._dispatcher.join(timeout)
+
+    def shard_for(self, request_id):
+        """request_id 固定映射到一个分片；该分片已退出时顺延到下一个存活分片"""
+        first = zlib.crc32(request_id.encode("utf-8")) % self.shards
+        for offset in range(self.shards):
+            index = (first + offset) % self.shards
+            if not self._dead[index]:
+                return index
+        raise RuntimeError("没有存活的分片进程")
+
+    async def run(self, diagnosis_input, on_event=None, request_id=None):
+        """
+        在 request_id（即线程 ID）对应的分片上执行诊断，进度经 on_event(kind, text) 回调，
+        返回可显示的报告文本（未生成报告时为 None）。分片在途请求已满时立即抛出 ShardBusy。
+        """
+        request_id = request_id or uuid.uuid4().hex
+        shard = self.shard_for(request_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        token = next(self._tokens)
+        with self._lock:
+            if self._inflight[shard] >= self.max_inflight:
+                shard_requests.inc(str(shard), "busy")
+                raise ShardBusy(f"分片 {shard} 在途请求已满（{self.max_inflight}）")
+            self._inflight[shard] += 1
+            # 调用方取消后条目仍保留到分片返回，在途计数与分片实际负载一致
+            self._pending[token] = (loop, on_event or _ignore, future, shard)
+        self._requests[shard].put((token, request_id, diagnosis_input))
+        return await future
+
+    def _dispatch_loop(self):
+        next_check = time.monotonic() + 1.0
+        while True:
+            try:
+                message = self._responses.get(timeout=1.0)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                message = None
+            # 每秒检查一次分片进程存活，繁忙时也不跳过
+            if time.monotonic() >= next_check:
+                self._check_shards()
+                next_check = time.monotonic() + 1.0
+            if message is None:
+                continue
+            token, kind, payload = message
+            if kind == "ready":
+                self._ready.release()
+                continue
+            if kind in ("step", "token"):
+                entry = self._pending.get(token)
+                if entry is not None:
+                    loop, on_event, _, _ = entry
+                    _post(loop, on_event, kind, payload)
+                continue
+            with self._lock:
+                entry = self._pending.pop(token, None)
+                if entry is None:
+                    continue
+                loop, _, future, shard = entry
+                self._inflight[shard] -= 1
+            shard_requests.inc(str(shard), "ok" if kind == "done" else "error")
+            _post(loop, _settle, future, kind, payload)
+
+    def _check_shards(self):
+        """分片进程异常退出时，立即让其在途请求失败，不等调用方超时"""
+        if self._stopping.is_set():
+            return
+        for index, process in enumerate(self._processes):
+            if self._dead[index] or process.is_alive():
+                continue
+            self._dead[index] = True
+            with self._lock:
+                lost = [token for token, entry in self._pending.items() if entry[3] == index]
+                entries = [self._pending.pop(token) for token in lost]
+                self._inflight[index] = 0
+            log_event(logger, logging.ERROR, "shard_exited", shard=index, exitcode=process.exitcode, lost=len(entries))
+            for loop, _, future, _ in entries:
+                shard_requests.inc(str(index), "error")
+                _post(loop, _settle, future, "error", f"分片 {index} 进程异常退出")
+
+    def stats(self):
+        with self._lock:
+            inflight = list(self._inflight)
+        return {"shards": self.shards, "alive": self._dead.count(False), "inflight": inflight}
+
+
+def _shard_main(index, requests, responses, graph_config, initializer, initargs):
+    """工作进程入口：预热诊断图后在事件循环中并发处理分到本分片的请求"""
+    if initializer is not None:
+        initializer(*initargs)
+    import DR_Test
+    DR_Test.warm_up([graph_config])
+    responses.put((None, "ready", index))
+    asyncio.run(_serve(requests, responses, graph_config))
+
+
+async def _serve(requests, responses, graph_config):
+    from DR_Test import astream_diagnosis, format_report_for_display
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def handle(token, request_id, diagnosis_input):
+        def emit(kind, text):
+            responses.put((token, kind, text))
+        try:
+            report = await astream_diagnosis(
+                diagnosis_input, emit, graph_config, {"configurable": {"thread_id": request_id}}
+            )
+            responses.put((token, "done", format_report_for_display(report) if report else None))
+        except Exception as e:
+            responses.put((token, "error", str(e)))
+
+    while True:
+        message = await loop.run_in_executor(None, requests.get)
+        if message is None:
+            break
+        task = asyncio.ensure_future(handle(*message))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
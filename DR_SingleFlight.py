@@ -0,0 +1,129 @@
+# DR_SingleFlight.py - 重复诊断请求合并：相同输入在途时只执行一次，完成结果短时复用
+#
+# 医生连点“开始诊断”、集成方超时重试时，同一输入会被提交多次，每次都完整执行诊断图和视觉大模型调用。
+# SingleFlight 以规范化输入的指纹为键：第一个请求（leader）实际执行，执行期间到达的相同请求（coalesced）
+# 等待同一结果；完成后的结果在 ttl 秒内直接返回（cached）。只缓存成功结果，异常只传给在途的等待者。
+# 在途表基于 concurrent.futures.Future，同步线程与事件循环中的协程可以互相合并。
+# 异步执行放在独立任务中并 shield，发起者断开（生成器关闭、任务取消）不会中断其他等待者共享的执行。
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from DR_Metrics import singleflight_requests
+
+# 与诊断内容无关、每次提交都会变化的字段，不参与指纹
+VOLATILE_FIELDS = ("timestamp", "request_id", "thread_id")
+
+
+def _normalize(value, exclude):
+    if isinstance(value, dict):
+        return {key: _normalize(item, exclude) for key, item in value.items() if key not in exclude}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item, exclude) for item in value]
+    if isinstance(value, str):
+        # 首尾与连续空白不影响诊断
+        return " ".join(value.split())
+    return value
+
+
+def fingerprint(data, exclude=VOLATILE_FIELDS):
+    """诊断输入（dict 或 JSON 字符串）的规范化指纹：去掉易变字段、键排序、压缩空白后取 sha256"""
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            pass
+    normalized = json.dumps(_normalize(data, frozenset(exclude)), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """按键合并在途调用并短时缓存结果；do/ado 可在任意线程或事件循环中调用"""
+
+    def __init__(self, ttl=30.0, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inflight = {}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._tasks = set()  # 事件循环只弱引用任务，执行中的 leader 任务在此保持引用
+        self._counters = {"leader": 0, "coalesced": 0, "cached": 0}
+
+    def _join(self, key):
+        """返回 (角色, 值)：cached 时为结果，coalesced 时为在途 Future，leader 时为本次要完成的 Future"""
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if time.monotonic() < expires_at:
+                    self._results.move_to_end(key)
+                    return self._count("cached"), result
+                del self._results[key]
+            future = self._inflight.get(key)
+            if future is not None:
+                return self._count("coalesced"), future
+            future = self._inflight[key] = Future()
+            return self._count("leader"), future
+
+    def _count(self, outcome):
+        self._counters[outcome] += 1
+        singleflight_requests.inc(outcome)
+        return outcome
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            self._inflight.pop(key, None)
+            if error is None and self.ttl:
+                self._results[key] = (time.monotonic() + self.ttl, result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def do(self, key, fn):
+        """同步版本：leader 在当前线程执行 fn()，其余调用阻塞等待同一结果（不要在事件循环线程中调用）"""
+        role, value = self._join(key)
+        if role == "cached":
+            return value
+        if role == "coalesced":
+            return value.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, value, error=e)
+            raise
+        self._finish(key, value, result)
+        return result
+
+    async def ado(self, key, coro_fn):
+        """异步版本：leader 以独立任务执行 coro_fn()，所有调用者 shield 等待，单个调用者取消不影响执行"""
+        role, value = self._join(key)
+        if role == "cached":
+            return value
+        if role == "leader":
+            def done(task):
+                self._tasks.discard(task)
+                if task.cancelled():
+                    self._finish(key, value, error=asyncio.CancelledError())
+                elif task.exception() is not None:
+                    self._finish(key, value, error=task.exception())
+                else:
+                    self._finish(key, value, task.result())
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks.add(task)
+            task.add_done_callback(done)
+        return await asyncio.shield(asyncio.wrap_future(value))
+
+    def in_flight(self, key):
+        return key in self._inflight
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "in_flight": len(self._inflight), "cached_results": len(self._results)}
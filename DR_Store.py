@@ -0,0 +1,220 @@
+# DR_Store.py - 诊断结果持久化：SQLite WAL + 后台合批写入 + 键集分页查询
+#
+# 报告节点只调用 put() 把结果放入内存队列即返回，请求路径不等待磁盘；后台写线程把队列中的结果
+# 合并为一个事务批量写入（默认 synchronous=NORMAL：WAL 下提交不 fsync，只在检查点时 fsync，
+# 进程崩溃不丢已提交数据，断电可能丢最近一批）。
+# 查询按 (created_at, id) 倒序、以上一页最后一行作为游标分页（键集分页），翻到第几页都只读一页的行，
+# 不像 OFFSET 那样越往后越慢。各索引末尾隐含 rowid(id)，patient_id/severity 等值过滤时 (x, created_at)
+# 索引可直接按该顺序输出，无需排序。grade >= N 是范围条件，跨多个等级无法按时间有序输出，分页查询改由
+# created_at 索引倒序扫描并逐行过滤等级（近期窗口内扫描量约为页大小 / 高等级占比）；(grade, created_at)
+# 索引用于计数等无需排序的查询。
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from DR_Metrics import log_event
+
+logger = logging.getLogger("DR.store")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diagnoses (
+    id INTEGER PRIMARY KEY,
+    request_id TEXT NOT NULL UNIQUE,
+    patient_id TEXT,
+    grade INTEGER NOT NULL,
+    severity TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    report TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_diagnoses_created ON diagnoses (created_at);
+CREATE INDEX IF NOT EXISTS idx_diagnoses_patient ON diagnoses (patient_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_diagnoses_grade ON diagnoses (grade, created_at);
+CREATE INDEX IF NOT EXISTS idx_diagnoses_severity ON diagnoses (severity, created_at);
+"""
+
+_COLUMNS = "id, request_id, patient_id, grade, severity, created_at"
+
+_STOP = object()
+
+
+def _connect(db_path, synchronous):
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+class DiagnosisStore:
+    """诊断结果库；put 非阻塞，query/get/count 可在任意线程调用"""
+
+    def __init__(self, db_path, batch_size=512, flush_interval=0.05, max_queue=100000, synchronous="NORMAL"):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.synchronous = synchronous
+        self._queue = queue.Queue(max_queue)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {"queued": 0, "written": 0, "batches": 0, "dropped": 0, "errors": 0}
+        self._writer_conn = _connect(db_path, synchronous)
+        self._writer_conn.executescript(_SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="dr-store-writer", daemon=True)
+        self._writer.start()
+
+    # ---- 写入 ----
+
+    def put(self, request_id, report, patient_id=None, created_at=None):
+        """放入写队列立即返回；队列已满时丢弃并计数，不阻塞请求"""
+        summary = report.get("diagnosis_summary", {})
+        row = (
+            request_id,
+            patient_id,
+            int(summary.get("grade", 0)),
+            summary.get("severity", ""),
+            created_at or time.time(),
+            json.dumps(report, ensure_ascii=False)
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._counters["dropped"] += 1
+            return False
+        with self._lock:
+            self._counters["queued"] += 1
+        return True
+
+    def _take_batch(self):
+        """阻塞到第一条，再在 flush_interval 内尽量凑满一批"""
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                row = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is _STOP:
+                # 放回队尾，本批写完后退出
+                self._queue.task_done()
+                self._queue.put(_STOP)
+                break
+            batch.append(row)
+        return batch
+
+    def _write_loop(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                self._queue.task_done()
+                return
+            try:
+                with self._writer_conn:
+                    self._writer_conn.executemany(
+                        "INSERT OR REPLACE INTO diagnoses (request_id, patient_id, grade, severity, created_at, report) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        batch
+                    )
+                with self._lock:
+                    self._counters["written"] += len(batch)
+                    self._counters["batches"] += 1
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._counters["errors"] += 1
+                log_event(logger, logging.ERROR, "store_write_failed", rows=len(batch), error=str(e))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """等待队列中已有的结果全部落库"""
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._writer_conn.close()
+
+    # ---- 查询 ----
+
+    def _reader(self):
+        """每个线程一个读连接，WAL 下读写互不阻塞"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.db_path, self.synchronous)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _where(min_grade=None, max_grade=None, severity=None, patient_id=None, since=None, until=None):
+        clauses, params = [], []
+        for clause, value in (
+            ("grade >= ?", min_grade),
+            ("grade <= ?", max_grade),
+            ("severity = ?", severity),
+            ("patient_id = ?", patient_id),
+            ("created_at >= ?", since),
+            ("created_at < ?", until),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return clauses, params
+
+    def _page(self, limit, cursor, include_report, filters):
+        clauses, params = self._where(**filters)
+        if cursor is not None:
+            clauses.append("(created_at, id) < (?, ?)")
+            params.extend(cursor)
+        columns = _COLUMNS + (", report" if include_report else "")
+        sql = f"SELECT {columns} FROM diagnoses"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        rows = [dict(row) for row in self._reader().execute(sql, params + [limit])]
+        next_cursor = (rows[-1]["created_at"], rows[-1]["id"]) if len(rows) == limit else None
+        return rows, next_cursor
+
+    def query(self, limit=50, cursor=None, include_report=False, **filters):
+        """
+        按时间倒序分页查询，filters 为 min_grade/max_grade/severity/patient_id/since/until。
+        返回 (行列表, 下一页游标)；把游标原样传回即可取下一页，没有更多时游标为 None。
+        """
+        rows, next_cursor = self._page(limit, cursor, include_report, filters)
+        if include_report:
+            for row in rows:
+                row["report"] = json.loads(row["report"])
+        return rows, next_cursor
+
+    def iter_rows(self, page_size=1000, **filters):
+        """逐页遍历全部匹配结果的生成器，内存只占一页；report 为未解析的 JSON 文本，供导出直接拼接"""
+        cursor = None
+        while True:
+            rows, cursor = self._page(page_size, cursor, True, filters)
+            yield from rows
+            if cursor is None:
+                return
+
+    def get(self, request_id):
+        """按请求 ID 取完整报告，不存在时返回 None"""
+        row = self._reader().execute("SELECT report FROM diagnoses WHERE request_id = ?", (request_id,)).fetchone()
+        return json.loads(row["report"]) if row else None
+
+    def count(self, **filters):
+        clauses, params = self._where(**filters)
+        sql = "SELECT COUNT(*) FROM diagnoses" + (" WHERE " + " AND ".join(clauses) if clauses else "")
+        return self._reader().execute(sql, params).fetchone()[0]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["pending"] = self._queue.qsize()
+        return stats
@@ -0,0 +1,172 @@
+# DR_StreamParse.py - 视觉大模型输出的增量、容错 JSON 解析
+#
+# VisionStreamParser 随流式 chunk 增量扫描，predicted_grade / confidence 一出现即可取用，
+# 集成节点所需字段齐全后调用方可提前结束生成。结束时按以下顺序容错解析：
+#   json      整段输出即合法 JSON
+#   repaired  去掉 markdown 代码块、前后说明文字、尾逗号、中文标点、百分号，或补齐被截断的括号后可解析
+#   partial   整体无法解析，但已扫描到 predicted_grade（如提前结束生成）
+#   failed    以上均失败，调用方回退到默认结果
+# predicted_grade 须为 0-4 的整数，超出范围的分级视为未给出。
+# partial 只在调用方有意提前结束生成（early_stopped）时才应缓存，畸形输出得到的 partial 只用于本次集成。
+import json
+import re
+import time
+
+# 集成节点所需字段
+REQUIRED_FIELDS = ("predicted_grade", "confidence")
+GRADES = range(5)
+
+_FIELD_PATTERN = re.compile(
+    r'["\']?(predicted_grade|confidence)["\']?\s*[:：]\s*["\']?(-?\d+(?:\.\d+)?)\s*(%?)(?=[^\d.%])'
+)
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.S)
+_TRAILING_COMMA_PATTERN = re.compile(r",\s*([}\]])")
+_PERCENT_PATTERN = re.compile(r"(:\s*)(\d+(?:\.\d+)?)\s*%")
+_QUOTE_TRANSLATION = str.maketrans({"“": '"', "”": '"', "，": ",", "：": ":"})
+
+
+def _convert(field, number, percent):
+    """扫描到的数值转为字段值；分级不是 0-4 的整数时返回 None"""
+    if field == "predicted_grade":
+        value = float(number)
+        return int(value) if value.is_integer() and int(value) in GRADES else None
+    value = float(number)
+    return value / 100.0 if percent else value
+
+
+def _close_truncated(text):
+    """为被截断的 JSON 补齐未闭合的字符串与括号"""
+    stack = []
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    text = text + '"' if in_string else text
+    text = re.sub(r'(,\s*"[^"]*"?\s*:?\s*|,\s*)$', "", text)
+    return text + "".join(reversed(stack))
+
+
+def _clean(text):
+    """中文标点转英文、去尾逗号、百分数转小数"""
+    text = _TRAILING_COMMA_PATTERN.sub(r"\1", text.translate(_QUOTE_TRANSLATION))
+    return _PERCENT_PATTERN.sub(lambda m: f"{m.group(1)}{float(m.group(2)) / 100}", text)
+
+
+def _candidates(text):
+    """依次产生待尝试解析的文本：代码块内部、首个 { 起的对象、清理标点/尾逗号/百分数、补齐截断"""
+    fenced = _FENCE_PATTERN.search(text)
+    body = fenced.group(1) if fenced else text
+    start = body.find("{")
+    if start < 0:
+        return
+    end = body.rfind("}")
+    obj = body[start:end + 1] if end > start else body[start:]
+    yield obj
+    yield _clean(obj)
+    yield _clean(_close_truncated(body[start:].translate(_QUOTE_TRANSLATION)))
+
+
+def parse_vision_output(text):
+    """一次性容错解析完整输出，返回 (结果 dict 或 None, 解析方式)"""
+    parser = VisionStreamParser()
+    parser.feed(text)
+    return parser.finish()
+
+
+class VisionStreamParser:
+    """增量扫描视觉大模型输出"""
+
+    def __init__(self):
+        self.fields = {}
+        self.started = time.perf_counter()
+        self.ready = False
+        self.fields_ready_at = None
+        self.early_stopped = False
+        self.outcome = None
+        self._chunks = []
+        self._text = ""
+        self._scan_from = 0
+
+    @property
+    def text(self):
+        if self._chunks:
+            self._text += "".join(self._chunks)
+            self._chunks = []
+        return self._text
+
+    def feed(self, chunk):
+        """追加一个 chunk，返回所需字段是否已齐全"""
+        if self.ready:
+            self._chunks.append(chunk)
+            return True
+        if not chunk:
+            return False
+        self._chunks.append(chunk)
+        # 只从上次确认匹配的位置往后扫描；末尾未完结的数字留待下个 chunk
+        for match in _FIELD_PATTERN.finditer(self.text, self._scan_from):
+            field, number, percent = match.groups()
+            value = _convert(field, number, percent)
+            if value is not None:
+                self.fields.setdefault(field, value)
+            self._scan_from = match.end()
+        if all(field in self.fields for field in REQUIRED_FIELDS):
+            self.ready = True
+            self.fields_ready_at = time.perf_counter()
+        return self.ready
+
+    def _usable(self, result):
+        """解析结果需含 0-4 的整数分级；"2"、"2级" 之类的字符串用扫描到的数值替换"""
+        if not isinstance(result, dict) or "predicted_grade" not in result:
+            return False
+        grade = result["predicted_grade"]
+        if type(grade) is int and grade not in GRADES:
+            return False
+        if type(grade) is not int:
+            if "predicted_grade" not in self.fields:
+                return False
+            result["predicted_grade"] = self.fields["predicted_grade"]
+        return True
+
+    @property
+    def cacheable(self):
+        """finish 的结果可否缓存：partial 仅在有意提前结束时可缓存"""
+        return self.outcome != "partial" or self.early_stopped
+
+    def finish(self):
+        """结束解析，返回 (结果 dict 或 None, 'json'|'repaired'|'partial'|'failed')，解析方式同时记在 outcome"""
+        result, self.outcome = self._finish()
+        return result, self.outcome
+
+    def _finish(self):
+        try:
+            result = json.loads(self.text)
+            if self._usable(result):
+                return result, "json"
+        except ValueError:
+            pass
+
+        for candidate in _candidates(self.text):
+            try:
+                result = json.loads(candidate)
+            except ValueError:
+                continue
+            if self._usable(result):
+                return result, "repaired"
+
+        # 提前结束或严重畸形：只要拿到了分级就可用于集成
+        if "predicted_grade" in self.fields:
+            result = {"key_findings": [], "rationale": ""}
+            result.update(self.fields)
+            return result, "partial"
+        return None, "failed"
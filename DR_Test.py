@@ -1,47 +1,314 @@
 # Director_DR.py - 糖尿病视网膜病变专用工作流
+#
+# 导入本模块不产生重量级副作用：大模型客户端、诊断系统与编译后的图均在首次使用时构建
+# （get_llm / get_dr_system / get_graph），服务启动时可调用 warm_up() 提前完成。
 from typing import TypedDict, Annotated
-from langchain_core.messages import HumanMessage
-from langchain_community.chat_models import ChatTongyi
-from langgraph.checkpoint.memory import InMemorySaver
-from langgraph.config import get_stream_writer
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
 from langchain_core.messages import AnyMessage
 from operator import add
-from langgraph.graph import StateGraph
 import os
-from langgraph.constants import START, END
+from langgraph.constants import START, END, TAG_NOSTREAM
 import json
 import asyncio
+import atexit
+import threading
+import uuid
+import time
+from contextlib import aclosing, closing
+from DR_LLMClient import LLMUnavailableError
+from DR_Prompts import VISION_GRADING
+from DR_Records import GradingRecord, IntegrationRecord, KnowledgeRecord, ReportRecord, VisionRecord, pack
+from DR_Metrics import (
+    configure_logging, instrument_node, llm_fallbacks, llm_timer, log_event, parse_failures, registry,
+    triage_decisions, vision_early_stops, vision_fields_ready, vision_parse_outcomes, vision_stream_tail,
+    vote_early_stops, vote_samples, vote_share
+)
+from DR_StreamParse import VisionStreamParser
+from DR_Voting import avote, vote
+import logging
 
-# 设置环境变量
-os.environ["LANGCHAIN_TRACING_V2"] = "true"
-os.environ["LANGCHAIN_API_KEY"] = ""
-os.environ["LANGCHAIN_PROJECT"] = ""
-os.environ["LANGSMITH_ENDPOINT"] = ""
+# LangSmith 追踪改为显式开启（DR_ENABLE_TRACING=1），API Key/项目沿用 LANGCHAIN_* 环境变量
+if os.environ.get("DR_ENABLE_TRACING") == "1":
+    os.environ["LANGCHAIN_TRACING_V2"] = "true"
 
-# 初始化大模型
-llm = ChatTongyi(
-    model="",
-    api_key=""
-)
+# 结构化日志（DR_LOG_LEVEL=DEBUG 输出每个节点的进出与耗时，OFF 关闭）
+configure_logging()
+logger = logging.getLogger("DR.graph")
+
+_init_lock = threading.RLock()
+_llm = None
+_dr_system = None
+_checkpointer = None
+_image_store = None
+_vision_cache = None
+_grader = None
+_result_store = None
+_export_manager = None
+_knowledge = None
+_single_flight = None
+_job_queue = None
+_job_pool = None
+_shard_pool = None
+# 分片工作进程以 fork 启动，不能在持有 _init_lock 时启动，否则子进程继承到已被持有的锁
+_shard_lock = threading.Lock()
+_graphs = {}
+
+def _create_llm():
+    """创建底层大模型；设置 DR_LLM_BASE_URL 时改用连接池化的 OpenAI 兼容客户端（如本地 DR_FakeLLMServer）"""
+    base_url = os.environ.get("DR_LLM_BASE_URL")
+    if base_url:
+        from DR_LLMClient import OpenAICompatibleChatClient
+        return OpenAICompatibleChatClient(
+            base_url,
+            model=os.environ.get("DR_LLM_MODEL", ""),
+            api_key=os.environ.get("DR_LLM_API_KEY", ""),
+            pool_size=int(os.environ.get("DR_LLM_POOL_SIZE", 32))
+        )
+    from langchain_community.chat_models import ChatTongyi
+    return ChatTongyi(
+        model="",
+        api_key=""
+    )
+
+def get_llm():
+    """获取大模型客户端，首次调用时创建；默认包装限流、截止时间、重试与熔断（DR_LLM_RESILIENT=0 关闭）"""
+    global _llm
+    if _llm is None:
+        with _init_lock:
+            if _llm is None:
+                model = _create_llm()
+                if os.environ.get("DR_LLM_RESILIENT", "1") != "0":
+                    from DR_LLMClient import ResilientLLM
+                    rate = float(os.environ.get("DR_LLM_RATE", 0))
+                    model = ResilientLLM(
+                        model,
+                        max_concurrency=int(os.environ.get("DR_LLM_MAX_CONCURRENCY", 16)),
+                        rate=rate or None,
+                        burst=int(os.environ.get("DR_LLM_BURST", 0)) or None,
+                        timeout=float(os.environ.get("DR_LLM_TIMEOUT", 30)),
+                        max_retries=int(os.environ.get("DR_LLM_RETRIES", 2)),
+                        hedge=os.environ.get("DR_LLM_HEDGE") == "1"
+                    )
+                _llm = model
+    return _llm
+
+def set_llm(model):
+    """替换全局大模型（测试桩、包装后的客户端等）"""
+    global _llm
+    _llm = model
+
+def get_image_store():
+    """眼底图像摄取与预处理缓存，首次调用时创建"""
+    global _image_store
+    if _image_store is None:
+        with _init_lock:
+            if _image_store is None:
+                from DR_Image import FundusImageStore
+                _image_store = FundusImageStore(
+                    cache_dir=os.environ.get("DR_IMAGE_CACHE_DIR"),
+                    size=int(os.environ.get("DR_IMAGE_SIZE", 512)),
+                    workers=int(os.environ.get("DR_IMAGE_WORKERS", 4)),
+                    max_bytes=int(os.environ.get("DR_IMAGE_CACHE_MAX_MB", 2048)) << 20
+                )
+    return _image_store
+
+def get_vision_cache():
+    """视觉结果缓存，首次调用时创建（设置 DR_VISION_CACHE_DB 启用 SQLite 磁盘层，重启后仍可命中）"""
+    global _vision_cache
+    if _vision_cache is None:
+        with _init_lock:
+            if _vision_cache is None:
+                from DR_Cache import VisionResultCache
+                _vision_cache = VisionResultCache(
+                    max_entries=int(os.environ.get("DR_VISION_CACHE_SIZE", 4096)),
+                    ttl=float(os.environ.get("DR_VISION_CACHE_TTL", 24 * 3600)),
+                    db_path=os.environ.get("DR_VISION_CACHE_DB")
+                )
+    return _vision_cache
+
+def set_vision_cache(cache):
+    """替换视觉结果缓存（测试或基准注入），传入 None 时按环境变量重新创建"""
+    global _vision_cache
+    _vision_cache = cache
+
+# 视觉节点等待后台图像预处理的上限（秒），超时按路径退化处理
+IMAGE_TIMEOUT = float(os.environ.get("DR_IMAGE_TIMEOUT", 10))
+
+def get_grader():
+    """本地分级模型的微批推理队列；未设置 DR_GRADING_MODEL 时返回 None，沿用输入 JSON 中的 model_grade"""
+    global _grader
+    if _grader is None:
+        spec = os.environ.get("DR_GRADING_MODEL")
+        if not spec:
+            return None
+        with _init_lock:
+            if _grader is None:
+                from DR_Grading import MicroBatcher, load_grading_model
+                _grader = MicroBatcher(
+                    load_grading_model(spec),
+                    max_batch_size=int(os.environ.get("DR_GRADING_BATCH_SIZE", 16)),
+                    max_wait=float(os.environ.get("DR_GRADING_MAX_WAIT_MS", 5)) / 1000,
+                    workers=int(os.environ.get("DR_GRADING_WORKERS", 1))
+                )
+    return _grader
+
+def set_grader(grader):
+    """替换分级模型推理队列（测试或基准注入），传入 None 时按环境变量重新创建"""
+    global _grader
+    _grader = grader
+
+# 分级节点等待模型推理的上限（秒），超时沿用输入分级
+GRADING_TIMEOUT = float(os.environ.get("DR_GRADING_TIMEOUT", 5))
+
+def get_result_store():
+    """诊断结果库（SQLite WAL，后台合批写入）；未设置 DR_RESULT_DB 时返回 None，不落库"""
+    global _result_store
+    if _result_store is None:
+        db_path = os.environ.get("DR_RESULT_DB")
+        if not db_path:
+            return None
+        with _init_lock:
+            if _result_store is None:
+                from DR_Store import DiagnosisStore
+                _result_store = DiagnosisStore(
+                    db_path,
+                    batch_size=int(os.environ.get("DR_RESULT_BATCH_SIZE", 512)),
+                    flush_interval=float(os.environ.get("DR_RESULT_FLUSH_MS", 50)) / 1000
+                )
+                # 写线程为守护线程，退出前把队列中剩余结果落库
+                atexit.register(_result_store.flush)
+    return _result_store
+
+def get_export_manager():
+    """报告批量导出任务管理；未启用结果库时返回 None"""
+    global _export_manager
+    if _export_manager is None:
+        store = get_result_store()
+        if store is None:
+            return None
+        with _init_lock:
+            if _export_manager is None:
+                from DR_Export import ExportManager
+                _export_manager = ExportManager(
+                    store,
+                    out_dir=os.environ.get("DR_EXPORT_DIR"),
+                    formatter=format_report_for_display,
+                    compresslevel=int(os.environ.get("DR_EXPORT_GZIP_LEVEL", 6))
+                )
+    return _export_manager
+
+def get_knowledge_base():
+    """临床知识库（DR_KNOWLEDGE_PATH 指定知识文件），每隔 DR_KNOWLEDGE_RELOAD_S 秒检查文件变化并热更新，0 关闭"""
+    global _knowledge
+    if _knowledge is None:
+        with _init_lock:
+            if _knowledge is None:
+                from DR_Knowledge import DEFAULT_PATH, KnowledgeBase
+                _knowledge = KnowledgeBase(
+                    os.environ.get("DR_KNOWLEDGE_PATH") or DEFAULT_PATH,
+                    check_interval=float(os.environ.get("DR_KNOWLEDGE_RELOAD_S", 5))
+                )
+    return _knowledge
+
+def get_single_flight():
+    """重复诊断请求合并；完成结果复用 DR_COALESCE_TTL 秒（0 只合并在途请求）"""
+    global _single_flight
+    if _single_flight is None:
+        with _init_lock:
+            if _single_flight is None:
+                from DR_SingleFlight import SingleFlight
+                _single_flight = SingleFlight(ttl=float(os.environ.get("DR_COALESCE_TTL", 30)))
+    return _single_flight
+
+def get_job_queue():
+    """异步诊断任务队列（SQLite）；未设置 DR_JOB_DB 时返回 None"""
+    global _job_queue
+    if _job_queue is None:
+        db_path = os.environ.get("DR_JOB_DB")
+        if not db_path:
+            return None
+        with _init_lock:
+            if _job_queue is None:
+                from DR_JobQueue import JobQueue
+                _job_queue = JobQueue(
+                    db_path,
+                    max_pending=int(os.environ.get("DR_JOB_MAX_PENDING", 1000)),
+                    visibility_timeout=float(os.environ.get("DR_JOB_VISIBILITY_S", 300)),
+                    max_attempts=int(os.environ.get("DR_JOB_MAX_ATTEMPTS", 3))
+                )
+    return _job_queue
 
-# 定义状态
+def get_job_pool():
+    """启动并返回执行队列任务的工作者池（DR_JOB_WORKERS 个，DR_JOB_WORKER_MODE=thread/process）；未启用队列时返回 None"""
+    global _job_pool
+    if _job_pool is None:
+        jobs = get_job_queue()
+        if jobs is None:
+            return None
+        with _init_lock:
+            if _job_pool is None:
+                from DR_JobQueue import JobWorkerPool
+                _job_pool = JobWorkerPool(
+                    jobs,
+                    run_diagnosis_job,
+                    workers=int(os.environ.get("DR_JOB_WORKERS", 4)),
+                    mode=os.environ.get("DR_JOB_WORKER_MODE", "thread"),
+                    threads_per_process=int(os.environ.get("DR_JOB_THREADS_PER_PROCESS", 4))
+                ).start()
+    return _job_pool
+
+def get_shard_pool(graph_config=None):
+    """
+    多进程分片服务：DR_SHARDS>0 时启动对应数量的工作进程，各自编译 graph_config 对应的诊断图；未设置时返回 None。
+    须在服务进程启动其他线程之前首次调用（见 DR_Shards）。
+    """
+    global _shard_pool
+    if _shard_pool is None:
+        shards = int(os.environ.get("DR_SHARDS", 0))
+        if shards <= 0:
+            return None
+        with _shard_lock:
+            if _shard_pool is None:
+                from DR_Shards import ShardPool
+                _shard_pool = ShardPool(
+                    shards,
+                    graph_config,
+                    max_inflight=int(os.environ.get("DR_SHARD_MAX_INFLIGHT", 64))
+                ).start()
+    return _shard_pool
+
+def get_stream_writer():
+    """延迟导入 langgraph 运行时，import DR_Test 时无需加载"""
+    from langgraph.config import get_stream_writer as _get_stream_writer
+    return _get_stream_writer()
+
+# 定义状态：各阶段结果以 DR_Records 中记录的普通元组形式存放，患者信息只存于 patient_data；
+# messages 只含输入，可读报告由出口处 report_from_state + format_report_for_display 生成
 class DiagnosisState(TypedDict):
     messages: Annotated[list[AnyMessage], add]
     current_step: str
     patient_data: dict
-    grading_result: dict
-    vision_llm_result: dict
-    integrated_result: dict
-    knowledge_content: dict
-    final_report: dict
+    grading_result: tuple  # GradingRecord
+    vision_llm_result: tuple  # VisionRecord
+    integrated_result: tuple  # IntegrationRecord
+    knowledge_content: tuple  # KnowledgeRecord
+    final_report: tuple  # ReportRecord
+    route: str
 
 # 糖尿病视网膜病变诊断系统
 class DRDiagnosisSystem:
-    def __init__(self):
+    def __init__(self, knowledge=None):
+        # 未指定时使用全局知识库 get_knowledge_base()
+        self.knowledge = knowledge
         self.model_weights = {
             'grading_model': 0.6,
             'vision_llm': 0.4
         }
+        # 可由 DR_Ensemble 标定结果覆盖
+        self.grading_confidence_scale = 1.0
+        self.vision_confidence = 0.8
+        # 分诊阈值：分级置信度（0-100）达到该等级的阈值时跳过视觉大模型；未列出的等级总是调用
+        self.triage_thresholds = {0: 95}
         
         self.grade_descriptions = {
             0: "无视网膜病变",
@@ -51,13 +318,44 @@ class DRDiagnosisSystem:
             4: "增殖性糖尿病视网膜病变（PDR）"
         }
     
-    def integrate_predictions(self, grading_model_result, vision_llm_result):
-        """集成两个模型的预测结果"""
+    def triage_route(self, grading_model_result):
+        """分诊：返回 'grading_only'（跳过视觉大模型）或 'vision'"""
+        threshold = self.triage_thresholds.get(grading_model_result.get('grade', 0))
+        if threshold is not None and grading_model_result.get('confidence', 0) >= threshold:
+            return 'grading_only'
+        return 'vision'
+    
+    def set_triage_thresholds(self, thresholds):
+        """设置分诊阈值，键为等级（JSON 中的字符串键会转换为整数）"""
+        self.triage_thresholds = {int(grade): threshold for grade, threshold in (thresholds or {}).items()}
+    
+    def integrate_predictions(self, grading_model_result, vision_llm_result=None):
+        """集成两个模型的预测结果；vision_llm_result 为空时（分诊跳过视觉大模型）只采用分级模型结果"""
         grading_grade = grading_model_result.get('grade', 0)
-        grading_confidence = grading_model_result.get('confidence', 0) / 100.0
+        grading_confidence = grading_model_result.get('confidence', 0) / 100.0 * self.grading_confidence_scale
+        
+        if vision_llm_result is None:
+            return {
+                'final_grade': max(0, min(4, grading_grade)),
+                'grading_model_grade': grading_grade,
+                'vision_llm_grade': None,
+                'confidence_scores': {
+                    'grading_model': grading_confidence,
+                    'vision_llm': None
+                },
+                'integration_details': {
+                    'weighted_score': None,
+                    'model_weights': self.model_weights
+                },
+                'agreement': None,
+                'mode': 'grading_only'
+            }
         
         vision_grade = self._parse_vision_llm_output(vision_llm_result)
-        vision_confidence = 0.8
+        # 自洽投票时以票数占比作为视觉大模型置信度
+        vision_confidence = self.vision_confidence
+        if isinstance(vision_llm_result, dict) and 'vote_share' in vision_llm_result:
+            vision_confidence = vision_llm_result['vote_share']
         
         weighted_score = (
             grading_grade * self.model_weights['grading_model'] * grading_confidence +
@@ -79,9 +377,33 @@ class DRDiagnosisSystem:
                 'weighted_score': weighted_score,
                 'model_weights': self.model_weights
             },
-            'agreement': grading_grade == vision_grade
+            'agreement': grading_grade == vision_grade,
+            'mode': 'ensemble'
         }
     
+    def integrate_predictions_batch(self, grading_grades, grading_confidences, vision_grades, vision_confidences=None):
+        """批量集成（NumPy 向量化），返回 (final_grades, agreement) 数组"""
+        from DR_Ensemble import integrate_batch
+        return integrate_batch(
+            grading_grades,
+            grading_confidences,
+            vision_grades,
+            self.vision_confidence if vision_confidences is None else vision_confidences,
+            self.model_weights,
+            self.grading_confidence_scale
+        )
+    
+    def load_calibration(self, path):
+        """载入 DR_Ensemble 输出的标定参数"""
+        with open(path, 'r', encoding='utf-8') as f:
+            calibration = json.load(f)
+        self.model_weights = dict(calibration['model_weights'])
+        self.grading_confidence_scale = calibration.get('grading_confidence_scale', 1.0)
+        if calibration.get('vision_confidence') is not None:
+            self.vision_confidence = calibration['vision_confidence']
+        if 'triage_thresholds' in calibration:
+            self.set_triage_thresholds(calibration['triage_thresholds'])
+    
     def _parse_vision_llm_output(self, vision_output):
         """解析视觉大模型的输出"""
         if isinstance(vision_output, dict):
@@ -93,9 +415,11 @@ class DRDiagnosisSystem:
                 return int(grade_match.group(1))
         return 0
     
-    def generate_diagnosis_report(self, integrated_result, patient_info=None):
-        """生成综合诊断报告"""
+    def generate_diagnosis_report(self, integrated_result, patient_info=None, recommendations=None):
+        """生成综合诊断报告；recommendations 为知识查询节点已得到的建议时直接复用"""
         final_grade = integrated_result['final_grade']
+        if recommendations is None:
+            recommendations = self._get_treatment_recommendations(final_grade, patient_info)
         
         return {
             'diagnosis_summary': {
@@ -107,9 +431,10 @@ class DRDiagnosisSystem:
                 'grading_model_result': integrated_result['grading_model_grade'],
                 'vision_llm_result': integrated_result['vision_llm_grade'],
                 'agreement': integrated_result['agreement'],
-                'final_confidence': integrated_result['confidence_scores']
+                'final_confidence': integrated_result['confidence_scores'],
+                'diagnosis_path': integrated_result.get('mode', 'ensemble')
             },
-            'clinical_recommendations': self._get_treatment_recommendations(final_grade, patient_info),
+            'clinical_recommendations': recommendations,
             'patient_information': patient_info or {},
             'report_timestamp': '2024-01-01 10:00:00'
         }
@@ -124,59 +449,30 @@ class DRDiagnosisSystem:
         else:
             return "极高风险"
     
+    def _knowledge_base(self):
+        return self.knowledge or get_knowledge_base()
+    
     def _get_treatment_recommendations(self, grade, patient_info):
-        """获取治疗建议"""
-        recommendations = {
-            "treatment_recommendations": {
-                "medication": [],
-                "procedures": [],
-                "lifestyle": []
-            },
-            "followup_plan": {
-                "interval": "",
-                "next_exams": ["视力检查", "眼底照相", "OCT检查"]
-            },
-            "targets": {
-                "hba1c": "<7.0%",
-                "blood_pressure": "<130/80mmHg"
-            },
-            "patient_education": [],
-            "warning_signs": ["视力突然下降", "视物变形", "眼前黑影"]
-        }
-        
-        if grade == 0:
-            recommendations["treatment_recommendations"]["lifestyle"] = ["严格控制血糖", "健康饮食", "适量运动"]
-            recommendations["followup_plan"]["interval"] = "12个月"
-            recommendations["patient_education"] = ["定期眼科检查", "控制血糖血压"]
-            
-        elif grade == 1:
-            recommendations["treatment_recommendations"]["medication"] = ["羟苯磺酸钙"]
-            recommendations["treatment_recommendations"]["lifestyle"] = ["严格血糖控制", "控制血压血脂"]
-            recommendations["followup_plan"]["interval"] = "6-12个月"
-            
-        elif grade == 2:
-            recommendations["treatment_recommendations"]["medication"] = ["羟苯磺酸钙", "改善微循环药物"]
-            recommendations["treatment_recommendations"]["procedures"] = ["评估激光治疗必要性"]
-            recommendations["followup_plan"]["interval"] = "4-6个月"
-            
-        elif grade == 3:
-            recommendations["treatment_recommendations"]["procedures"] = ["全视网膜光凝治疗", "评估抗VEGF治疗"]
-            recommendations["followup_plan"]["interval"] = "3-4个月"
-            recommendations["patient_education"] = ["高危状态，需要及时干预"]
-            
-        elif grade == 4:
-            recommendations["treatment_recommendations"]["procedures"] = ["紧急全视网膜光凝", "评估玻璃体手术"]
-            recommendations["followup_plan"]["interval"] = "1个月或立即随访"
-            recommendations["patient_education"] = ["急诊状态，有失明风险"]
-            
-        return recommendations
-
-# 创建诊断系统实例
-dr_system = DRDiagnosisSystem()
+        """获取治疗建议：按分级与患者风险因素查预生成的知识库条目（共享只读）"""
+        return self._knowledge_base().lookup(grade, patient_info)
+
+def get_dr_system():
+    """获取诊断系统实例，首次调用时创建并载入标定参数"""
+    global _dr_system
+    if _dr_system is None:
+        with _init_lock:
+            if _dr_system is None:
+                system = DRDiagnosisSystem()
+                if os.environ.get("DR_ENSEMBLE_CALIBRATION"):
+                    system.load_calibration(os.environ["DR_ENSEMBLE_CALIBRATION"])
+                # 如 DR_TRIAGE_THRESHOLDS='{"0": 95, "1": 98}'；'{}' 关闭分诊，每例都调用视觉大模型
+                if os.environ.get("DR_TRIAGE_THRESHOLDS"):
+                    system.set_triage_thresholds(json.loads(os.environ["DR_TRIAGE_THRESHOLDS"]))
+                _dr_system = system
+    return _dr_system
 
 # 工作流节点函数
 def supervisor_node(state: DiagnosisState):
-    print(">>>supervisor_node")
     writer = get_stream_writer()
     
     if "final_report" in state and state["final_report"]:
@@ -188,8 +484,10 @@ def supervisor_node(state: DiagnosisState):
         return {"current_step": "grading_analysis"}
     
     current_step = state["current_step"]
+    if current_step == "triage":
+        return {"current_step": "integration" if state.get("route") == "grading_only" else "vision_analysis"}
     step_flow = {
-        "grading_analysis": "vision_analysis",
+        "grading_analysis": "triage",
         "vision_analysis": "integration", 
         "integration": "knowledge_query",
         "knowledge_query": "report_generation",
@@ -198,136 +496,420 @@ def supervisor_node(state: DiagnosisState):
     
     return {"current_step": step_flow.get(current_step, "other")}
 
+def _parse_grading_input(state):
+    """从首条消息解析诊断输入，model_grade/confidence 为上游分级结果"""
+    # 兼容直接传入 JSON 字符串（operator.add 归约不会将其转换为消息对象）
+    first_message = state["messages"][0]
+    user_input = getattr(first_message, "content", first_message)
+    input_data = json.loads(user_input)
+    patient_info = input_data.get("patient_info")
+    if patient_info is None and input_data.get("patient_query"):
+        # 只给了自由文本（如批量任务的原始病历）时本地抽取结构化患者信息
+        from DR_PatientInfo import extract_patient_info
+        patient_info = extract_patient_info(input_data["patient_query"])
+    return {
+        "grade": input_data.get("model_grade", 0),
+        "confidence": input_data.get("confidence", 0),
+        "image_path": input_data.get("image_path", ""),
+        "patient_info": patient_info or {},
+        "patient_id": input_data.get("patient_id") or input_data.get("case_id"),
+        "source": "input"
+    }
+
+def _apply_model_grading(writer, grading_result, probabilities=None, error=None):
+    """用本地分级模型的输出覆盖输入分级；推理失败或超时时保留输入分级"""
+    if error is not None:
+        log_event(logger, logging.WARNING, "grading_model_failed", reason=type(error).__name__, error=str(error))
+        writer({"grading_step": f"分级模型不可用（{type(error).__name__}），沿用输入分级"})
+        return
+    from DR_Grading import grading_result as model_grading_result
+    grading_result.update(model_grading_result(probabilities), source="model")
+
+def _grading_update(writer, grading_result):
+    writer({"grading_step": f"分级结果: 等级{grading_result['grade']}"})
+    return {
+        "grading_result": pack(GradingRecord.from_result(grading_result)),
+        "patient_data": grading_result["patient_info"],
+        "current_step": "grading_analysis"
+    }
+
+def _grading_error(writer, e):
+    writer({"grading_error": f"解析失败: {str(e)}"})
+    return {
+        "grading_result": pack(GradingRecord(0, 0)),
+        "current_step": "grading_analysis"
+    }
+
 def grading_analysis_node(state: DiagnosisState):
-    print(">>>grading_analysis_node")
     writer = get_stream_writer()
     
-    user_input = state["messages"][0].content
     try:
-        input_data = json.loads(user_input)
-        grading_result = {
-            "grade": input_data.get("model_grade", 0),
-            "confidence": input_data.get("confidence", 0),
-            "image_path": input_data.get("image_path", ""),
-            "patient_info": input_data.get("patient_info", {})
-        }
-        
-        writer({"grading_step": f"分级结果: 等级{grading_result['grade']}"})
-        
-        return {
-            "grading_result": grading_result,
-            "patient_data": grading_result["patient_info"],
-            "current_step": "grading_analysis"
-        }
+        grading_result = _parse_grading_input(state)
+        grader = get_grader()
+        # 只有分级模型需要预处理后的数组；视觉阶段只用内容摘要，不预处理
+        if grader is not None:
+            image = get_image_store().get(grading_result["image_path"], IMAGE_TIMEOUT)
+            if image is not None:
+                try:
+                    _apply_model_grading(writer, grading_result, grader.predict(image.array, GRADING_TIMEOUT))
+                except Exception as e:
+                    _apply_model_grading(writer, grading_result, error=e)
+        return _grading_update(writer, grading_result)
     except Exception as e:
-        writer({"grading_error": f"解析失败: {str(e)}"})
-        return {
-            "grading_result": {"grade": 0, "confidence": 0},
-            "current_step": "grading_analysis"
-        }
+        return _grading_error(writer, e)
 
-def vision_analysis_node(state: DiagnosisState):
-    print(">>>vision_analysis_node")
+def triage_policy_node(state: DiagnosisState):
     writer = get_stream_writer()
     
-    grading_result = state["grading_result"]
-    
-    prompt = f"""
-    请分析糖尿病视网膜眼底图像，给出病变分级：
-    
-    分级标准：
-    0级 - 无视网膜病变
-    1级 - 轻度非增殖性糖尿病视网膜病变（仅微动脉瘤）
-    2级 - 中度非增殖性糖尿病视网膜病变
-    3级 - 重度非增殖性糖尿病视网膜病变  
-    4级 - 增殖性糖尿病视网膜病变
-    
-    当前分级模型结果: 等级{grading_result.get('grade', 0)}
-    
-    请输出JSON格式：
-    {{
-        "predicted_grade": 等级数字,
-        "confidence": 置信度,
-        "key_findings": ["主要发现"],
-        "rationale": "分析理由"
-    }}
+    grading_result = GradingRecord.of(state["grading_result"]).as_result()
+    route = get_dr_system().triage_route(grading_result)
+    triage_decisions.inc(route)
+    if route == "grading_only":
+        writer({"triage_step": f"分级置信度{grading_result.get('confidence', 0)}达到阈值，跳过视觉分析"})
+    return {
+        "route": route,
+        "current_step": "triage"
+    }
+
+def _build_vision_prompt(grading_result):
+    """渲染视觉大模型分级提示词（预编译模板：静态分级标准在前作为 system，本例分级结果在后）"""
+    return VISION_GRADING.render(grade=grading_result.get('grade', 0))
+
+def _default_vision_result(grading_result):
+    """确定性的默认视觉结果：沿用分级模型结果"""
+    return {
+        "predicted_grade": grading_result.get('grade', 0),
+        "confidence": 0.7,
+        "key_findings": ["视觉分析完成"],
+        "rationale": "基于图像特征分析"
+    }
+
+# 支持流式的模型边生成边解析（DR_VISION_STREAM=0 关闭）；
+# DR_VISION_EARLY_STOP=1 时 predicted_grade 与 confidence 一就绪即结束生成，报告中不再有 rationale 等字段
+VISION_STREAM = os.environ.get("DR_VISION_STREAM", "1") != "0"
+VISION_EARLY_STOP = os.environ.get("DR_VISION_EARLY_STOP") == "1"
+
+def _can_stream(model):
+    return VISION_STREAM and getattr(model, "supports_streaming", hasattr(model, "astream"))
+
+def _observe_stream(parser):
+    """记录字段就绪耗时与其后的剩余生成耗时"""
+    if parser.fields_ready_at is None:
+        return
+    vision_fields_ready.observe(parser.fields_ready_at - parser.started)
+    if parser.early_stopped:
+        vision_early_stops.inc()
+    else:
+        vision_stream_tail.observe(time.perf_counter() - parser.fields_ready_at)
+
+def _call_vision_llm(model, messages, config=None, cancelled=None):
+    """调用视觉大模型，返回已读入输出的 VisionStreamParser；cancelled（threading.Event）被设置后停止读取流式输出"""
+    parser = VisionStreamParser()
+    if not _can_stream(model):
+        parser.feed(model.invoke(messages, config).content)
+        return parser
+    with closing(model.stream(messages, config)) as stream:
+        for chunk in stream:
+            if cancelled is not None and cancelled.is_set():
+                break
+            if parser.feed(chunk.content) and VISION_EARLY_STOP:
+                parser.early_stopped = True
+                break
+    _observe_stream(parser)
+    return parser
+
+async def _acall_vision_llm(model, messages, config=None):
+    """_call_vision_llm 的异步版本"""
+    parser = VisionStreamParser()
+    if not _can_stream(model):
+        parser.feed((await model.ainvoke(messages, config)).content)
+        return parser
+    async with aclosing(model.astream(messages, config)) as stream:
+        async for chunk in stream:
+            if parser.feed(chunk.content) and VISION_EARLY_STOP:
+                parser.early_stopped = True
+                break
+    _observe_stream(parser)
+    return parser
+
+def _parse_vision_response(parser, grading_result):
     """
+    容错解析视觉大模型输出，返回 (结果, 是否解析成功, 可否缓存)；失败时回退到分级模型结果。
+    畸形输出中只扫描到分级（partial，且不是有意提前结束）时结果可用于本次集成，但不缓存。
+    """
+    result, outcome = parser.finish()
+    vision_parse_outcomes.inc(outcome)
+    if result is None:
+        return _default_vision_result(grading_result), False, False
+    return result, True, parser.cacheable
+
+# 自洽投票：DR_VISION_SAMPLES>1 时并发采样 N 次，按 DR_VISION_VOTE_RULE（majority/plurality/all）提前结束
+VISION_SAMPLES = int(os.environ.get("DR_VISION_SAMPLES", 1))
+VISION_VOTE_RULE = os.environ.get("DR_VISION_VOTE_RULE", "majority")
+
+def _sample_config(index):
+    """除第一个采样外不向界面流式输出 token，避免多路输出交错"""
+    return {"tags": [TAG_NOSTREAM]} if index else None
+
+def _vote_result(summary, grading_result):
+    """以胜出等级序号最小的采样为代表结果，附上票数占比与投票统计；summary["ballots"] 是判定时的快照"""
+    vote_samples.inc("counted", amount=summary["counted"])
+    vote_samples.inc("failed", amount=summary["failed"])
+    vote_samples.inc("cancelled", amount=summary["cancelled"])
+    if summary["early_stopped"]:
+        vote_early_stops.inc()
+    if summary["grade"] is None:
+        return _default_vision_result(grading_result), False, False
+    vote_share.observe(summary["share"])
+    result = dict(next(payload for _, grade, (payload, _) in summary["ballots"] if grade == summary["grade"]))
+    result["vote_share"] = summary["share"]
+    result["vote"] = {key: value for key, value in summary.items() if key not in ("grade", "share", "ballots")}
+    # 任一计入的采样来自畸形输出时整个投票结果不缓存
+    return result, True, all(cacheable for _, _, (_, cacheable) in summary["ballots"])
+
+def _vote_vision(model, messages, grading_result):
+    def sample(index, cancelled):
+        if cancelled.is_set():
+            return None
+        parser = _call_vision_llm(model, messages, _sample_config(index), cancelled)
+        # 投票已判定时不再解析，避免半截输出计入解析失败
+        if cancelled.is_set():
+            return None
+        result, parsed, cacheable = _parse_vision_response(parser, grading_result)
+        return (result["predicted_grade"], (result, cacheable)) if parsed else None
+    return _vote_result(vote(sample, VISION_SAMPLES, VISION_VOTE_RULE), grading_result)
+
+async def _avote_vision(model, messages, grading_result):
+    async def sample(index):
+        parser = await _acall_vision_llm(model, messages, _sample_config(index))
+        result, parsed, cacheable = _parse_vision_response(parser, grading_result)
+        return (result["predicted_grade"], (result, cacheable)) if parsed else None
+    return _vote_result(await avote(sample, VISION_SAMPLES, VISION_VOTE_RULE), grading_result)
+
+def _vision_fallback(grading_result, error):
+    """大模型超时/熔断/重试耗尽时回退到默认结果（不入缓存）"""
+    reason = type(error).__name__
+    llm_fallbacks.inc(reason)
+    log_event(logger, logging.WARNING, "vision_llm_unavailable", reason=reason, error=str(error))
+    return _default_vision_result(grading_result)
+
+def _get_llm():
+    """优先使用调用方经 configurable.llm 注入的模型（如批量诊断的合批代理）"""
+    from langgraph.config import get_config
+    configurable = get_config().get("configurable", {})
+    return configurable.get("llm") or get_llm()
+
+def _vision_cache_key(grading_result, prompt, model):
+    """
+    按图像内容（或路径）、提示词（模板摘要 + 可变部分）与模型名生成缓存键。
+    只需要内容摘要，不等待图像预处理：已摄取过的路径直接用 DR_Image 记下的哈希，否则由缓存读文件哈希（按 mtime 记忆）。
+    """
+    model_name = getattr(model, "model_name", None) or getattr(model, "model", "")
+    if VISION_SAMPLES > 1:
+        model_name = f"{model_name}|vote:{VISION_SAMPLES}:{VISION_VOTE_RULE}"
+    image_path = grading_result.get("image_path", "")
+    return get_vision_cache().make_key(
+        image_path, prompt.cache_text, str(model_name), get_image_store().known_digest(image_path)
+    )
+
+def vision_analysis_node(state: DiagnosisState):
+    writer = get_stream_writer()
     
-    response = llm.invoke([{"role": "user", "content": prompt}])
-    
-    try:
-        vision_result = json.loads(response.content)
-    except:
-        vision_result = {
-            "predicted_grade": grading_result.get('grade', 0),
-            "confidence": 0.7,
-            "key_findings": ["视觉分析完成"],
-            "rationale": "基于图像特征分析"
-        }
+    grading_result = GradingRecord.of(state["grading_result"]).as_result()
+    prompt = _build_vision_prompt(grading_result)
+    model = _get_llm()
     
-    writer({"vision_step": "视觉分析完成"})
+    cache_key = _vision_cache_key(grading_result, prompt, model)
+    vision_result = get_vision_cache().get(cache_key)
+    if vision_result is not None:
+        writer({"vision_step": "视觉分析完成（缓存命中）"})
+    else:
+        messages = prompt.messages
+        try:
+            with llm_timer():
+                if VISION_SAMPLES > 1:
+                    vision_result, parsed, cacheable = _vote_vision(model, messages, grading_result)
+                else:
+                    parser = _call_vision_llm(model, messages)
+                    vision_result, parsed, cacheable = _parse_vision_response(parser, grading_result)
+        except LLMUnavailableError as e:
+            vision_result = _vision_fallback(grading_result, e)
+        else:
+            # 只缓存解析成功的结果；回退结果与畸形输出得到的 partial 不入缓存
+            if parsed:
+                if cacheable:
+                    get_vision_cache().put(cache_key, vision_result)
+            else:
+                parse_failures.inc()
+                log_event(logger, logging.WARNING, "vision_parse_failed", fallback_grade=vision_result["predicted_grade"])
+        writer({"vision_step": "视觉分析完成"})
     return {
-        "vision_llm_result": vision_result,
+        "vision_llm_result": pack(VisionRecord.from_result(vision_result)),
         "current_step": "vision_analysis"
     }
 
 def integration_node(state: DiagnosisState):
-    print(">>>integration_node")
     writer = get_stream_writer()
     
-    integrated_result = dr_system.integrate_predictions(
-        state["grading_result"],
-        state["vision_llm_result"]
+    vision = state.get("vision_llm_result") if state.get("route") != "grading_only" else None
+    integrated_result = get_dr_system().integrate_predictions(
+        GradingRecord.of(state["grading_result"]).as_result(),
+        VisionRecord.of(vision).as_result() if vision else None
     )
     
     writer({"integration_step": f"集成结果: 等级{integrated_result['final_grade']}"})
     return {
-        "integrated_result": integrated_result,
+        "integrated_result": pack(IntegrationRecord.from_result(integrated_result)),
         "current_step": "integration"
     }
 
 def knowledge_query_node(state: DiagnosisState):
-    print(">>>knowledge_query_node")
     writer = get_stream_writer()
     
-    # 使用内置知识库，不依赖外部Redis
-    knowledge_content = dr_system._get_treatment_recommendations(
-        state["integrated_result"]['final_grade'],
-        state["patient_data"]
+    # 使用内置知识库，不依赖外部Redis；状态中只存索引键，建议内容在生成报告时按键取出
+    knowledge = get_dr_system()._knowledge_base()
+    knowledge_content = KnowledgeRecord(
+        *knowledge.resolve(IntegrationRecord.of(state["integrated_result"]).final_grade, state.get("patient_data"))
     )
     
     writer({"knowledge_step": "知识查询完成"})
     return {
-        "knowledge_content": knowledge_content,
+        "knowledge_content": pack(knowledge_content),
         "current_step": "knowledge_query"
     }
 
 def report_generation_node(state: DiagnosisState):
-    print(">>>report_generation_node")
     writer = get_stream_writer()
     
-    final_report = dr_system.generate_diagnosis_report(
-        state["integrated_result"],
-        state["patient_data"]
-    )
+    system = get_dr_system()
+    knowledge = system._knowledge_base()
+    integrated = IntegrationRecord.of(state["integrated_result"])
+    patient_info = state.get("patient_data") or {}
+    # supervisor 拓扑中知识查询先于报告生成，直接复用其索引键；DAG 拓扑两者并行，由报告节点自行查询
+    if state.get("knowledge_content"):
+        knowledge_content = KnowledgeRecord.of(state["knowledge_content"])
+    else:
+        knowledge_content = KnowledgeRecord(*knowledge.resolve(integrated.final_grade, patient_info))
+    
+    from langgraph.config import get_config
+    request_id = get_config().get("configurable", {}).get("thread_id") or new_request_id()
     
-    # 生成可读的报告
-    report_text = format_report_for_display(final_report)
+    # 完整报告只在落库时构造，状态中只存引用，可读文本由出口处生成
+    store = get_result_store()
+    if store is not None:
+        final_report = system.generate_diagnosis_report(
+            integrated.as_result(system.model_weights),
+            patient_info,
+            knowledge.entry(knowledge_content.key, knowledge_content.version)
+        )
+        # 只入队，由后台线程合批落库，不等待磁盘
+        store.put(request_id, final_report, GradingRecord.of(state["grading_result"]).patient_id)
     
     writer({"report_step": "报告生成完成"})
     return {
-        "final_report": final_report,
-        "messages": [HumanMessage(content=report_text)],
+        "final_report": pack(ReportRecord(request_id, knowledge_content.version, knowledge_content.key)),
         "current_step": "report_generation"
     }
 
 def other_node(state: DiagnosisState):
-    print(">>>other_node")
     return {
         "messages": [HumanMessage(content="诊断系统无法处理此请求")],
         "current_step": "other"
     }
 
+# 异步节点：graph.ainvoke 时走原生协程路径，视觉节点使用 llm.ainvoke 不阻塞事件循环
+async def asupervisor_node(state: DiagnosisState):
+    return supervisor_node(state)
+
+async def agrading_analysis_node(state: DiagnosisState):
+    writer = get_stream_writer()
+    
+    try:
+        grading_result = _parse_grading_input(state)
+        grader = get_grader()
+        if grader is not None:
+            # 并发请求在微批队列中合并推理，等待期间不阻塞事件循环
+            image = await get_image_store().aget(grading_result["image_path"], IMAGE_TIMEOUT)
+            if image is not None:
+                try:
+                    _apply_model_grading(writer, grading_result, await grader.apredict(image.array, GRADING_TIMEOUT))
+                except Exception as e:
+                    _apply_model_grading(writer, grading_result, error=e)
+        return _grading_update(writer, grading_result)
+    except Exception as e:
+        return _grading_error(writer, e)
+
+async def atriage_policy_node(state: DiagnosisState):
+    return triage_policy_node(state)
+
+async def avision_analysis_node(state: DiagnosisState):
+    writer = get_stream_writer()
+    
+    grading_result = GradingRecord.of(state["grading_result"]).as_result()
+    prompt = _build_vision_prompt(grading_result)
+    model = _get_llm()
+    
+    # 首次见到的图像需要读文件哈希，放到线程池中，不阻塞事件循环
+    cache_key = await asyncio.get_running_loop().run_in_executor(None, _vision_cache_key, grading_result, prompt, model)
+    vision_result = get_vision_cache().get(cache_key)
+    if vision_result is not None:
+        writer({"vision_step": "视觉分析完成（缓存命中）"})
+    else:
+        messages = prompt.messages
+        try:
+            with llm_timer():
+                if VISION_SAMPLES > 1:
+                    vision_result, parsed, cacheable = await _avote_vision(model, messages, grading_result)
+                else:
+                    parser = await _acall_vision_llm(model, messages)
+                    vision_result, parsed, cacheable = _parse_vision_response(parser, grading_result)
+        except LLMUnavailableError as e:
+            vision_result = _vision_fallback(grading_result, e)
+        else:
+            # 只缓存解析成功的结果；回退结果与畸形输出得到的 partial 不入缓存
+            if parsed:
+                if cacheable:
+                    get_vision_cache().put(cache_key, vision_result)
+            else:
+                parse_failures.inc()
+                log_event(logger, logging.WARNING, "vision_parse_failed", fallback_grade=vision_result["predicted_grade"])
+        writer({"vision_step": "视觉分析完成"})
+    return {
+        "vision_llm_result": pack(VisionRecord.from_result(vision_result)),
+        "current_step": "vision_analysis"
+    }
+
+async def aintegration_node(state: DiagnosisState):
+    return integration_node(state)
+
+async def aknowledge_query_node(state: DiagnosisState):
+    return knowledge_query_node(state)
+
+async def areport_generation_node(state: DiagnosisState):
+    return report_generation_node(state)
+
+async def aother_node(state: DiagnosisState):
+    return other_node(state)
+
+def report_from_state(state):
+    """由紧凑状态展开完整诊断报告（界面、批量任务等出口处调用）；诊断未完成时返回 None"""
+    if not state.get("final_report"):
+        return None
+    system = get_dr_system()
+    report = ReportRecord.of(state["final_report"])
+    integrated = IntegrationRecord.of(state["integrated_result"])
+    patient_info = state.get("patient_data") or {}
+    knowledge = system._knowledge_base()
+    recommendations = knowledge.entry(report.knowledge_key, report.knowledge_version)
+    if recommendations is None or recommendations["knowledge_version"] != report.knowledge_version:
+        # 生成时的知识库版本已不在内存中：按当前版本展开，并在报告中注明原版本
+        if recommendations is None:
+            recommendations = knowledge.lookup(integrated.final_grade, patient_info)
+        recommendations = {**recommendations, "recorded_knowledge_version": report.knowledge_version}
+        log_event(logger, logging.WARNING, "knowledge_version_mismatch", recorded=report.knowledge_version,
+                  current=recommendations["knowledge_version"])
+    return system.generate_diagnosis_report(integrated.as_result(system.model_weights), patient_info, recommendations)
+
 def format_report_for_display(report_data):
     """格式化报告用于显示"""
     diagnosis = report_data['diagnosis_summary']
@@ -335,24 +917,34 @@ def format_report_for_display(report_data):
     recommendations = report_data['clinical_recommendations']
     
     report = "## 🩺 糖尿病视网膜病变诊断报告\n\n"
-    report += f"### 📋 诊断摘要\n"
+    report += "### 📋 诊断摘要\n"
     report += f"- **病变分级**: {diagnosis['grade']}级 ({diagnosis['description']})\n"
     report += f"- **严重程度**: {diagnosis['severity']}\n\n"
     
-    report += f"### 🔬 AI模型分析\n"
+    report += "### 🔬 AI模型分析\n"
     report += f"- **分级模型**: {analysis['grading_model_result']}级\n"
-    report += f"- **视觉分析**: {analysis['vision_llm_result']}级\n"
-    report += f"- **模型一致性**: {'✅ 一致' if analysis['agreement'] else '⚠️ 不一致'}\n\n"
+    if analysis.get('diagnosis_path') == 'grading_only':
+        report += "- **视觉分析**: 未调用（分级模型置信度达到分诊阈值）\n"
+        report += "- **诊断路径**: 仅分级模型\n\n"
+    else:
+        report += f"- **视觉分析**: {analysis['vision_llm_result']}级\n"
+        report += f"- **模型一致性**: {'✅ 一致' if analysis['agreement'] else '⚠️ 不一致'}\n"
+        report += "- **诊断路径**: 分级模型 + 视觉大模型\n\n"
     
-    report += f"### 💊 治疗建议\n"
+    report += "### 💊 治疗建议\n"
     treatment = recommendations['treatment_recommendations']
     if treatment['medication']:
         report += f"- **药物治疗**: {', '.join(treatment['medication'])}\n"
     if treatment['procedures']:
         report += f"- **治疗措施**: {', '.join(treatment['procedures'])}\n"
     
+    if recommendations.get('risk_factors'):
+        report += f"- **风险因素**: {', '.join(recommendations['risk_factors'])}\n"
     report += f"- **随访间隔**: {recommendations['followup_plan']['interval']}\n"
     report += f"- **血糖目标**: {recommendations['targets']['hba1c']}\n\n"
+    if recommendations.get('recorded_knowledge_version'):
+        report += (f"> ⚠️ 诊断时使用知识库版本 {recommendations['recorded_knowledge_version']}，"
+                   f"该版本已不可用，以上建议按当前版本 {recommendations['knowledge_version']} 生成\n\n")
     
     report += "---\n*本报告由AI系统生成，仅供参考*"
     
@@ -364,6 +956,7 @@ def diagnosis_routing_func(state: DiagnosisState):
     
     routing_map = {
         "grading_analysis": "grading_analysis_node",
+        "triage": "triage_policy_node",
         "vision_analysis": "vision_analysis_node", 
         "integration": "integration_node",
         "knowledge_query": "knowledge_query_node",
@@ -373,29 +966,330 @@ def diagnosis_routing_func(state: DiagnosisState):
     
     return routing_map.get(current_step, "other_node")
 
-# 构建图
-builder = StateGraph(DiagnosisState)
-
-# 添加节点
-builder.add_node("supervisor_node", supervisor_node)
-builder.add_node("grading_analysis_node", grading_analysis_node)
-builder.add_node("vision_analysis_node", vision_analysis_node)
-builder.add_node("integration_node", integration_node)
-builder.add_node("knowledge_query_node", knowledge_query_node)
-builder.add_node("report_generation_node", report_generation_node)
-builder.add_node("other_node", other_node)
-
-# 添加边
-builder.add_edge(START, "supervisor_node")
-builder.add_conditional_edges("supervisor_node", diagnosis_routing_func)
-builder.add_edge("grading_analysis_node", "supervisor_node")
-builder.add_edge("vision_analysis_node", "supervisor_node")
-builder.add_edge("integration_node", "supervisor_node")
-builder.add_edge("knowledge_query_node", "supervisor_node")
-builder.add_edge("report_generation_node", "supervisor_node")
-builder.add_edge("other_node", "supervisor_node")
-
-# 编译图
-checkpointer = InMemorySaver()
-
-graph = builder.compile(checkpointer=checkpointer)
+def _node(func, afunc):
+    """同时登记同步/异步实现，invoke 与 ainvoke 各自走原生路径；两者均经过耗时埋点"""
+    try:
+        from langgraph._internal._runnable import RunnableCallable
+    except ImportError:  # langgraph < 0.6
+        from langgraph.utils.runnable import RunnableCallable
+    wrapped, awrapped = instrument_node(func, afunc, logger)
+    return RunnableCallable(wrapped, awrapped, name=func.__name__)
+
+def create_builder():
+    """构建 supervisor 拓扑的 StateGraph（未编译）"""
+    from langgraph.graph import StateGraph
+    builder = StateGraph(DiagnosisState)
+
+    # 添加节点
+    builder.add_node("supervisor_node", _node(supervisor_node, asupervisor_node))
+    builder.add_node("grading_analysis_node", _node(grading_analysis_node, agrading_analysis_node))
+    builder.add_node("triage_policy_node", _node(triage_policy_node, atriage_policy_node))
+    builder.add_node("vision_analysis_node", _node(vision_analysis_node, avision_analysis_node))
+    builder.add_node("integration_node", _node(integration_node, aintegration_node))
+    builder.add_node("knowledge_query_node", _node(knowledge_query_node, aknowledge_query_node))
+    builder.add_node("report_generation_node", _node(report_generation_node, areport_generation_node))
+    builder.add_node("other_node", _node(other_node, aother_node))
+
+    # 添加边
+    builder.add_edge(START, "supervisor_node")
+    builder.add_conditional_edges("supervisor_node", diagnosis_routing_func)
+    builder.add_edge("grading_analysis_node", "supervisor_node")
+    builder.add_edge("triage_policy_node", "supervisor_node")
+    builder.add_edge("vision_analysis_node", "supervisor_node")
+    builder.add_edge("integration_node", "supervisor_node")
+    builder.add_edge("knowledge_query_node", "supervisor_node")
+    builder.add_edge("report_generation_node", "supervisor_node")
+    builder.add_edge("other_node", "supervisor_node")
+    return builder
+
+def get_checkpointer():
+    """检查点按线程 LRU/TTL 淘汰，长时间运行内存不再随诊断次数增长"""
+    global _checkpointer
+    if _checkpointer is None:
+        with _init_lock:
+            if _checkpointer is None:
+                from DR_Checkpoint import BoundedMemorySaver
+                _checkpointer = BoundedMemorySaver(
+                    max_threads=int(os.environ.get("DR_CHECKPOINT_MAX_THREADS", 1000)),
+                    ttl=float(os.environ.get("DR_CHECKPOINT_TTL", 3600)),
+                    max_bytes=int(os.environ.get("DR_CHECKPOINT_MAX_BYTES", 256 * 1024 * 1024)),
+                    latest_only=os.environ.get("DR_CHECKPOINT_LATEST_ONLY", "0") == "1"
+                )
+    return _checkpointer
+
+def get_graph(config=None):
+    """
+    获取编译后的诊断图，按配置缓存，首次调用时编译。
+    config: {"checkpointing": True/False, "topology": "supervisor"/"dag"}，默认带检查点的 supervisor 拓扑；
+    不写检查点的一次性模式适用于不回读线程状态的单次诊断。
+    """
+    config = config or {}
+    key = (config.get("checkpointing", True), config.get("topology", "supervisor"))
+    compiled = _graphs.get(key)
+    if compiled is None:
+        with _init_lock:
+            compiled = _graphs.get(key)
+            if compiled is None:
+                checkpointing, topology = key
+                checkpointer = get_checkpointer() if checkpointing else None
+                if topology == "dag":
+                    compiled = build_dag_graph(checkpointer)
+                else:
+                    compiled = create_builder().compile(checkpointer=checkpointer)
+                _graphs[key] = compiled
+    return compiled
+
+def _component_stats():
+    """导出视觉缓存与检查点的统计到 /metrics"""
+    stats = []
+    if _vision_cache is not None:
+        cache = _vision_cache.stats()
+        stats.extend([
+            ("dr_vision_cache_hits_total", "counter", "视觉结果缓存命中次数", cache["hits"]),
+            ("dr_vision_cache_misses_total", "counter", "视觉结果缓存未命中次数", cache["misses"]),
+            ("dr_vision_cache_evictions_total", "counter", "视觉结果缓存淘汰次数", cache["evictions"]),
+            ("dr_vision_cache_entries", "gauge", "视觉结果缓存内存层条目数", cache["size"]),
+        ])
+    if _checkpointer is not None:
+        saver = _checkpointer.stats()
+        stats.extend([
+            ("dr_checkpoint_threads", "gauge", "检查点保留的线程数", saver["threads"]),
+            ("dr_checkpoint_bytes", "gauge", "检查点序列化数据总字节数", saver["bytes"]),
+            ("dr_checkpoint_evictions_total", "counter", "检查点线程淘汰次数", saver["evictions"]),
+        ])
+    if _image_store is not None:
+        images = _image_store.stats()
+        stats.extend([
+            ("dr_image_ingested_total", "counter", "摄取的图像数", images["ingested"]),
+            ("dr_image_processed_total", "counter", "实际解码与预处理的图像数", images["processed"]),
+            ("dr_image_dedup_hits_total", "counter", "按内容哈希命中预处理缓存的次数", images["dedup_hits"]),
+            ("dr_image_errors_total", "counter", "图像无法读取或解码的次数", images["errors"]),
+            ("dr_image_timeouts_total", "counter", "等待图像预处理超时的次数", images["timeouts"]),
+            ("dr_image_evictions_total", "counter", "超出容量被删除的预处理缓存文件数", images["evictions"]),
+            ("dr_image_cache_bytes", "gauge", "预处理缓存目录占用字节数", images["bytes"]),
+        ])
+    if _grader is not None:
+        grading = _grader.stats()
+        stats.extend([
+            ("dr_grading_requests_total", "counter", "提交给分级模型的图像数", grading["requests"]),
+            ("dr_grading_batches_total", "counter", "分级模型推理批次数", grading["batches"]),
+            ("dr_grading_errors_total", "counter", "分级模型推理失败的批次数", grading["errors"]),
+            ("dr_grading_queued", "gauge", "等待组批的分级请求数", grading["queued"]),
+        ])
+    if _result_store is not None:
+        store = _result_store.stats()
+        stats.extend([
+            ("dr_store_written_total", "counter", "写入结果库的诊断数", store["written"]),
+            ("dr_store_batches_total", "counter", "结果库写入事务数", store["batches"]),
+            ("dr_store_dropped_total", "counter", "写队列已满被丢弃的诊断数", store["dropped"]),
+            ("dr_store_errors_total", "counter", "结果库写入失败的批次数", store["errors"]),
+            ("dr_store_pending", "gauge", "等待落库的诊断数", store["pending"]),
+        ])
+    if _knowledge is not None:
+        knowledge = _knowledge.stats()
+        stats.extend([
+            ("dr_knowledge_entries", "gauge", "知识库预生成的建议条目数", knowledge["entries"]),
+            ("dr_knowledge_reloads_total", "counter", "知识库热更新次数", knowledge["reloads"]),
+            ("dr_knowledge_reload_errors_total", "counter", "知识文件无效而未更新的次数", knowledge["reload_errors"]),
+        ])
+    if _single_flight is not None:
+        flights = _single_flight.stats()
+        stats.extend([
+            ("dr_singleflight_in_flight", "gauge", "正在执行、可供合并的诊断数", flights["in_flight"]),
+            ("dr_singleflight_cached_results", "gauge", "可直接复用的近期诊断结果数", flights["cached_results"]),
+        ])
+    if _shard_pool is not None:
+        shards = _shard_pool.stats()
+        stats.extend([
+            ("dr_shards_alive", "gauge", "存活的分片工作进程数", shards["alive"]),
+            ("dr_shard_inflight", "gauge", "各分片在途请求总数", sum(shards["inflight"])),
+        ])
+    if _job_queue is not None:
+        jobs = _job_queue.stats()
+        stats.extend([
+            ("dr_jobs_queued", "gauge", "等待领取的异步诊断任务数", jobs["queued"]),
+            ("dr_jobs_running", "gauge", "执行中的异步诊断任务数", jobs["running"]),
+        ])
+    if hasattr(_llm, "stats"):
+        client = _llm.stats()
+        stats.extend([
+            ("dr_llm_calls_total", "counter", "大模型逻辑调用次数", client["calls"]),
+            ("dr_llm_retries_total", "counter", "大模型重试次数", client["retries"]),
+            ("dr_llm_timeouts_total", "counter", "大模型超过截止时间次数", client["timeouts"]),
+            ("dr_llm_hedges_total", "counter", "发出的对冲请求数", client["hedges"]),
+            ("dr_llm_hedge_wins_total", "counter", "对冲请求先返回的次数", client["hedge_wins"]),
+            ("dr_llm_rejected_total", "counter", "熔断拒绝的调用次数", client["rejected"]),
+            ("dr_llm_abandoned_total", "counter", "超过截止时间后仍在执行的底层调用数", client["abandoned"]),
+            ("dr_llm_circuit_open", "gauge", "熔断器是否打开", int(client["breaker_state"] == "open")),
+        ])
+    return stats
+
+registry.register_collector(_component_stats)
+
+def new_request_id():
+    """生成不会碰撞的请求/线程 ID"""
+    return f"dr_{uuid.uuid4().hex}"
+
+def _coalesced_call(diagnosis_input, config, graph_config):
+    """返回 (合并键, 图输入, 配置)；diagnosis_input 为 dict 或 JSON 字符串，不同图配置不合并"""
+    from DR_SingleFlight import fingerprint
+    message = diagnosis_input if isinstance(diagnosis_input, str) else json.dumps(diagnosis_input, ensure_ascii=False)
+    key = fingerprint(message) + (f":{fingerprint(graph_config)}" if graph_config else "")
+    return key, {"messages": [message]}, config or {"configurable": {"thread_id": new_request_id()}}
+
+def diagnose(diagnosis_input, config=None, graph_config=None):
+    """
+    对外诊断入口：相同输入（忽略 timestamp 等易变字段）的并发请求只执行一次诊断图，
+    其余请求等待同一结果，完成后短时复用。返回最终状态，合并的调用方共享同一对象，只读。
+    """
+    key, graph_input, config = _coalesced_call(diagnosis_input, config, graph_config)
+    return get_single_flight().do(key, lambda: get_graph(graph_config).invoke(graph_input, config))
+
+async def adiagnose(diagnosis_input, config=None, graph_config=None):
+    """diagnose 的异步版本"""
+    key, graph_input, config = _coalesced_call(diagnosis_input, config, graph_config)
+    return await get_single_flight().ado(key, lambda: get_graph(graph_config).ainvoke(graph_input, config))
+
+async def astream_diagnosis(diagnosis_input, emit, graph_config=None, config=None):
+    """
+    流式执行一次诊断：节点进度以 emit("step", 文本)、视觉模型 token 以 emit("token", 文本) 推送，
+    返回完整诊断报告（未生成时为 None）。服务端进程内模式与分片工作进程共用。
+    """
+    state = {}
+    # custom 为各节点进度，messages 为视觉模型 token，values 为最新状态
+    async for mode, chunk in get_graph(graph_config).astream(
+        {"messages": [json.dumps(diagnosis_input, ensure_ascii=False)]},
+        config or {"configurable": {"thread_id": new_request_id()}},
+        stream_mode=["custom", "messages", "values"]
+    ):
+        if mode == "values":
+            state = chunk
+        elif mode == "custom":
+            for value in chunk.values():
+                emit("step", str(value))
+        else:
+            message, metadata = chunk
+            if metadata.get("langgraph_node") == "vision_analysis_node" and isinstance(message, AIMessageChunk):
+                if isinstance(message.content, str):
+                    emit("token", message.content)
+    # 状态中只存紧凑记录，可读报告在出口处生成
+    return report_from_state(state)
+
+def run_diagnosis_job(payload):
+    """任务队列的执行函数：payload 为诊断输入，返回完整报告与可读文本（队列任务不回读线程状态，不写检查点）"""
+    state = diagnose(payload, graph_config={
+        "checkpointing": False,
+        "topology": os.environ.get("DR_GRAPH_TOPOLOGY", "supervisor")
+    })
+    report = report_from_state(state)
+    return {"report": report, "report_text": format_report_for_display(report) if report else ""}
+
+# DAG 拓扑：各阶段直接相连，不再每步回到 supervisor_node；
+# 知识查询与报告生成只依赖 integrated_result/patient_data，在集成之后并行执行再汇合。
+def _without_step(update):
+    """并行分支同一超步写 current_step 会冲突，改由汇合节点统一设置"""
+    update = dict(update)
+    update.pop("current_step", None)
+    return update
+
+def dag_knowledge_query_node(state: DiagnosisState):
+    return _without_step(knowledge_query_node(state))
+
+async def adag_knowledge_query_node(state: DiagnosisState):
+    return _without_step(await aknowledge_query_node(state))
+
+def dag_report_generation_node(state: DiagnosisState):
+    return _without_step(report_generation_node(state))
+
+async def adag_report_generation_node(state: DiagnosisState):
+    return _without_step(await areport_generation_node(state))
+
+def dag_join_node(state: DiagnosisState):
+    return {"current_step": END}
+
+async def adag_join_node(state: DiagnosisState):
+    return dag_join_node(state)
+
+def triage_routing_func(state: DiagnosisState):
+    return "integration_node" if state.get("route") == "grading_only" else "vision_analysis_node"
+
+def build_dag_graph(checkpointer=None):
+    """构建 DAG 拓扑的诊断图，final_report 与 messages 与 supervisor 拓扑一致"""
+    from langgraph.graph import StateGraph
+    dag_builder = StateGraph(DiagnosisState)
+    dag_builder.add_node("grading_analysis_node", _node(grading_analysis_node, agrading_analysis_node))
+    dag_builder.add_node("triage_policy_node", _node(triage_policy_node, atriage_policy_node))
+    dag_builder.add_node("vision_analysis_node", _node(vision_analysis_node, avision_analysis_node))
+    dag_builder.add_node("integration_node", _node(integration_node, aintegration_node))
+    dag_builder.add_node("knowledge_query_node", _node(dag_knowledge_query_node, adag_knowledge_query_node))
+    dag_builder.add_node("report_generation_node", _node(dag_report_generation_node, adag_report_generation_node))
+    dag_builder.add_node("join_node", _node(dag_join_node, adag_join_node))
+
+    dag_builder.add_edge(START, "grading_analysis_node")
+    dag_builder.add_edge("grading_analysis_node", "triage_policy_node")
+    dag_builder.add_conditional_edges("triage_policy_node", triage_routing_func, ["vision_analysis_node", "integration_node"])
+    dag_builder.add_edge("vision_analysis_node", "integration_node")
+    dag_builder.add_edge("integration_node", "knowledge_query_node")
+    dag_builder.add_edge("integration_node", "report_generation_node")
+    dag_builder.add_edge(["knowledge_query_node", "report_generation_node"], "join_node")
+    dag_builder.add_edge("join_node", END)
+    return dag_builder.compile(checkpointer=checkpointer)
+
+class _WarmupLLM:
+    """预热用的本地模型，不发起网络请求"""
+    model_name = "__warmup__"
+
+    def _reply(self):
+        return AIMessage(content=json.dumps({"predicted_grade": 0, "confidence": 1.0, "key_findings": [], "rationale": ""}))
+
+    def invoke(self, messages, config=None, **kwargs):
+        return self._reply()
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        return self._reply()
+
+def warm_up(graph_configs=None, ping_llm=False):
+    """
+    预热：创建大模型客户端并编译图，用本地模型跑一遍诊断以加载各节点的惰性依赖；
+    ping_llm=True 时再向服务商发一次极短请求，提前建立连接。
+    """
+    get_llm()
+    get_dr_system()
+    get_vision_cache()
+    # 置信度 0 与 100 分别走视觉分析与仅分级两条分诊路径
+    samples = [
+        json.dumps({"model_grade": 0, "confidence": confidence, "image_path": "", "patient_info": {}})
+        for confidence in (0, 100)
+    ]
+    for graph_config in graph_configs or [{"checkpointing": False}]:
+        for sample in samples:
+            get_graph(graph_config).invoke(
+                {"messages": [sample]},
+                {"configurable": {"thread_id": new_request_id(), "llm": _WarmupLLM()}}
+            )
+    if ping_llm:
+        try:
+            get_llm().invoke([{"role": "user", "content": "ping"}], max_tokens=1)
+        except Exception as e:
+            log_event(logger, logging.WARNING, "warmup_ping_failed", error=str(e))
+    log_event(logger, logging.INFO, "warmup_done")
+
+# 兼容旧用法：DR_Test.llm / vision_cache / graph / stateless_graph / dag_graph / builder / checkpointer / dr_system
+def __getattr__(name):
+    if name == "llm":
+        return get_llm()
+    if name == "vision_cache":
+        return get_vision_cache()
+    if name == "graph":
+        return get_graph()
+    if name == "stateless_graph":
+        return get_graph({"checkpointing": False})
+    if name == "dag_graph":
+        return get_graph({"checkpointing": False, "topology": "dag"})
+    if name == "builder":
+        return create_builder()
+    if name == "checkpointer":
+        return get_checkpointer()
+    if name == "dr_system":
+        return get_dr_system()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
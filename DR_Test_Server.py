@@ -1,81 +1,200 @@
 # DR_Server.py - 简约版糖尿病视网膜病变诊断服务端
-from DR_Test import graph
+from DR_Test import (
+    astream_diagnosis, format_report_for_display, get_export_manager, get_grader, get_image_store, get_job_pool,
+    get_job_queue, get_shard_pool, get_single_flight, new_request_id, warm_up
+)
+from DR_JobQueue import JobQueueFull
+from DR_Shards import ShardBusy
+from DR_SingleFlight import fingerprint
+from DR_Metrics import log_event, start_metrics_server, stream_first_event
+from DR_PatientInfo import extract
+import asyncio
 import random
 import gradio as gr
-import json
+import logging
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 
-def process_dr_diagnosis(input_text, files):
+logger = logging.getLogger("DR.server")
+
+# 默认走无检查点的一次性模式；需要回读线程状态时设置 DR_SERVER_CHECKPOINTING=1，
+# DR_GRAPH_TOPOLOGY=dag 切换为无 supervisor 往返的 DAG 拓扑
+graph_config = {
+    "checkpointing": os.environ.get("DR_SERVER_CHECKPOINTING") == "1",
+    "topology": os.environ.get("DR_GRAPH_TOPOLOGY", "supervisor")
+}
+
+def _uploaded_path(files):
+    """gr.File 返回单个文件路径（或多文件时的列表），未上传时为 None"""
+    if isinstance(files, (list, tuple)):
+        files = files[0] if files else None
+    return getattr(files, "name", files) or ""
+
+def prefetch_upload(files):
     """
-    处理糖尿病视网膜病变诊断请求
+    上传后立即在后台解码与预处理，不必等到点击开始诊断。分片模式下图像在工作进程中处理；
+    未配置分级模型时没有阶段需要预处理后的数组，两者都跳过。
     """
-    config = {
-        "configurable": {
-            "thread_id": f"dr_{random.randint(1000, 9999)}"
-        }
+    if get_shard_pool() is not None or get_grader() is None:
+        return
+    get_image_store().prefetch(_uploaded_path(files))
+
+def _render_progress(progress, vision_tokens):
+    """渲染诊断进行中的输出：阶段进度 + 视觉模型实时输出"""
+    text = "⏳ 正在诊断...\n\n" + "\n".join(f"- {step}" for step in progress)
+    if vision_tokens:
+        text += f"\n\n**视觉模型输出**:\n{vision_tokens}"
+    return text
+
+def _build_input(input_text, files):
+    """由界面输入构建诊断输入"""
+    diagnosis_input = {
+        "patient_query": input_text,
+        "timestamp": datetime.now().isoformat()
     }
     
+    # 从输入文本单遍抽取患者信息与文中提及的分级，不调用大模型
+    patient_info = extract(input_text)
+    # 模拟分级模型结果；设置 DR_GRADING_MODEL 且上传了图像时，分级节点以本地模型推理结果覆盖
+    model_grade = patient_info.pop("dr_grade", None)
+    if model_grade is None:
+        model_grade = random.randint(0, 2)
+    
+    # 添加模拟的分级模型结果
+    diagnosis_input.update({
+        "model_grade": model_grade,
+        "confidence": random.randint(75, 95),
+        "image_path": _uploaded_path(files),
+        "patient_info": patient_info
+    })
+    return diagnosis_input
+
+async def _run_diagnosis(input_text, files, emit):
+    """执行一次诊断，阶段进度经 emit 推送，返回可显示的报告文本；异常向上抛出"""
+    progress = []
+    vision_tokens = []
+    
+    def on_event(kind, text):
+        (progress if kind == "step" else vision_tokens).append(text)
+        emit(_render_progress(progress, "".join(vision_tokens)))
+    
+    diagnosis_input = _build_input(input_text, files)
+    thread_id = new_request_id()
+    shards = get_shard_pool()
+    if shards is not None:
+        # 分片模式：按线程 ID 路由到工作进程执行，报告文本也在工作进程中生成
+        report_text = await shards.run(diagnosis_input, on_event, thread_id)
+    else:
+        report = await astream_diagnosis(diagnosis_input, on_event, graph_config, {"configurable": {"thread_id": thread_id}})
+        report_text = format_report_for_display(report) if report else None
+    return report_text or _render_progress(progress, "".join(vision_tokens))
+
+async def process_dr_diagnosis(input_text, files):
+    """
+    处理糖尿病视网膜病变诊断请求，流式推送阶段进度与视觉模型输出；
+    相同的文本与图像在途或刚完成时（连点、重试）并入同一次诊断
+    """
+    started = time.perf_counter()
+    flights = get_single_flight()
+    # 分级与置信度为界面模拟值，每次提交都不同，按用户实际输入（文本 + 图像）去重
+    key = fingerprint({"patient_query": input_text, "image_path": _uploaded_path(files)})
+    # 先立即返回占位内容，首字节不等待诊断图执行；占位内容不计入首个事件耗时
+    if flights.in_flight(key):
+        yield "⏳ 相同的诊断请求正在进行，等待其结果..."
+    else:
+        yield _render_progress([], "")
+    
+    frames = asyncio.Queue()
+    result = asyncio.ensure_future(flights.ado(key, lambda: _run_diagnosis(input_text, files, frames.put_nowait)))
+    frame = None
+    first_event = True
     try:
-        # 构建诊断输入
-        diagnosis_input = {
-            "patient_query": input_text,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        # 模拟分级模型结果
-        if "轻度" in input_text or "1级" in input_text:
-            model_grade = 1
-        elif "中度" in input_text or "2级" in input_text:
-            model_grade = 2
-        elif "重度" in input_text or "3级" in input_text:
-            model_grade = 3
-        elif "增殖" in input_text or "4级" in input_text:
-            model_grade = 4
-        else:
-            model_grade = random.randint(0, 2)
-        
-        # 添加模拟的分级模型结果
-        diagnosis_input.update({
-            "model_grade": model_grade,
-            "confidence": random.randint(75, 95),
-            "image_path": "/data/retina_images/sample.jpg",
-            "patient_info": {
-                "age": 58,
-                "diabetes_type": "2型", 
-                "diabetes_duration": 10,
-                "hbA1c": 7.5,
-                "other_conditions": []
-            }
-        })
-        
-        # 调用诊断图
-        result = graph.invoke(
-            {"messages": [json.dumps(diagnosis_input, ensure_ascii=False)]}, 
-            config
-        )
-        
-        return result["messages"][-1].content
+        # 本请求实际执行时转发进度；并入在途请求时只等待最终结果
+        while not result.done():
+            frame = asyncio.ensure_future(frames.get())
+            await asyncio.wait({frame, result}, return_when=asyncio.FIRST_COMPLETED)
+            if frame.done():
+                if first_event:
+                    stream_first_event.observe(time.perf_counter() - started)
+                    first_event = False
+                yield frame.result()
+        if first_event:
+            stream_first_event.observe(time.perf_counter() - started)
+        yield result.result()
         
+    except ShardBusy:
+        yield "⚠️ 服务繁忙，当前诊断请求已满，请稍后重试"
     except Exception as e:
-        return f"诊断处理错误: {str(e)}"
+        yield f"诊断处理错误: {str(e)}"
+    finally:
+        for task in (frame, result):
+            if task is not None and not task.done():
+                task.cancel()
 
-def generate_dr_report():
-    """生成诊断报告文件"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"dr_diagnosis_report_{timestamp}.json"
-    
-    sample_report = {
-        "report_type": "糖尿病视网膜病变诊断报告",
-        "generated_at": datetime.now().isoformat(),
-        "note": "实际报告将包含完整的诊断数据"
-    }
+def submit_diagnosis_job(input_text, files):
+    """异步提交：诊断输入写入任务队列立即返回任务 ID，不占用请求等待诊断完成"""
+    jobs = get_job_queue()
+    if jobs is None:
+        return "", "未启用任务队列（设置 DR_JOB_DB）"
+    get_job_pool()
+    try:
+        job_id = jobs.submit(_build_input(input_text, files))
+    except JobQueueFull as e:
+        return "", f"⚠️ {e}，请稍后重试"
+    return job_id, f"已提交任务 `{job_id}`，可稍后查询结果"
+
+def poll_diagnosis_job(job_id):
+    """查询异步任务，完成时返回可读报告"""
+    jobs = get_job_queue()
+    if jobs is None:
+        return "未启用任务队列（设置 DR_JOB_DB）"
+    info = jobs.status((job_id or "").strip())
+    if info is None:
+        return "未找到该任务"
+    if info["status"] == "queued":
+        return f"⏳ 排队中，前面还有 {info['ahead']} 个任务"
+    if info["status"] == "running":
+        return f"⏳ 正在诊断（第 {info['attempts']} 次执行）"
+    if info["status"] == "failed":
+        return f"诊断处理错误: {info['error']}"
+    return jobs.result(info["job_id"])["report_text"]
+
+def _export_filters(start_date, end_date, min_grade):
+    """界面输入转换为结果库查询条件；日期为 YYYY-MM-DD，结束日期当天包含在内"""
+    filters = {}
+    if start_date:
+        filters["since"] = datetime.strptime(start_date.strip(), "%Y-%m-%d").timestamp()
+    if end_date:
+        filters["until"] = (datetime.strptime(end_date.strip(), "%Y-%m-%d") + timedelta(days=1)).timestamp()
+    if min_grade not in (None, "", "全部"):
+        filters["min_grade"] = int(min_grade)
+    return filters
+
+async def generate_dr_report(start_date, end_date, min_grade, export_format):
+    """
+    批量导出诊断报告：提交后台导出任务后轮询进度，完成时返回 gzip 文件供下载
+    """
+    manager = get_export_manager()
+    if manager is None:
+        yield "未启用结果库（设置 DR_RESULT_DB 后诊断结果才会持久化），无法导出", None
+        return
+    try:
+        job = manager.submit(export_format, **_export_filters(start_date, end_date, min_grade))
+    except ValueError as e:
+        yield f"导出参数错误: {e}", None
+        return
     
-    temp_path = f"/tmp/{filename}"
-    with open(temp_path, 'w', encoding='utf-8') as f:
-        json.dump(sample_report, f, ensure_ascii=False, indent=2)
+    while not job.finished:
+        yield f"⏳ 正在导出 {job.exported}/{job.total} 份报告（{job.progress:.0%}）", None
+        await asyncio.sleep(0.5)
     
-    return temp_path
+    if job.status == "done":
+        yield (f"✅ 已导出 {job.exported} 份报告，压缩后 {job.compressed_bytes / 1e6:.1f} MB"
+               f"（原始 {job.raw_bytes / 1e6:.1f} MB）"), job.path
+    else:
+        yield f"导出失败: {job.error or job.status}", None
 
 def clear_all():
     return "", "", None
@@ -219,6 +338,13 @@ with gr.Blocks(css=simple_css, theme=gr.themes.Soft()) as demo:
                 elem_classes="textbox"
             )
 
+            gr.Markdown("### 眼底图像", elem_classes="section-title")
+            inputs_image = gr.File(
+                label="",
+                file_types=["image"],
+                type="filepath"
+            )
+
             # 警示信息
             with gr.Column(elem_classes="medical-alert"):
                 gr.Markdown("**提示**: 本系统为AI辅助诊断工具，结果仅供参考。")
@@ -255,6 +381,24 @@ with gr.Blocks(css=simple_css, theme=gr.themes.Soft()) as demo:
             with gr.Row():
                 btn_download = gr.Button("导出报告", variant="secondary", elem_classes="btn-secondary")
                 btn_new = gr.Button("新建诊断", variant="secondary", elem_classes="btn-secondary")
+            
+            with gr.Accordion("批量导出条件", open=False):
+                with gr.Row():
+                    export_start = gr.Textbox(label="开始日期", placeholder="YYYY-MM-DD，留空不限")
+                    export_end = gr.Textbox(label="结束日期", placeholder="YYYY-MM-DD，留空不限")
+                with gr.Row():
+                    export_grade = gr.Dropdown(["全部", "1", "2", "3", "4"], value="全部", label="最低分级")
+                    export_format = gr.Radio(["jsonl", "csv"], value="jsonl", label="格式（gzip 压缩）")
+            export_status = gr.Markdown()
+            export_file = gr.File(label="下载报告")
+            
+            with gr.Accordion("异步提交（排队诊断，稍后查询）", open=False):
+                with gr.Row():
+                    job_id_text = gr.Textbox(label="任务 ID", placeholder="提交后自动填入，也可粘贴查询")
+                with gr.Row():
+                    btn_submit_job = gr.Button("提交到队列", variant="secondary", elem_classes="btn-secondary")
+                    btn_poll_job = gr.Button("查询结果", variant="secondary", elem_classes="btn-secondary")
+                job_status = gr.Markdown()
 
     # 底部
     with gr.Column(elem_classes="footer"):
@@ -263,14 +407,33 @@ with gr.Blocks(css=simple_css, theme=gr.themes.Soft()) as demo:
     # 事件处理
     btn_start.click(
         fn=process_dr_diagnosis,
-        inputs=[inputs_text, gr.File(visible=False)],
-        outputs=[outputs_text]
+        inputs=[inputs_text, inputs_image],
+        outputs=[outputs_text],
+        # 异步处理函数在同一事件循环上并发，放开默认的单并发限制；超出的请求在 Gradio 队列中等待
+        concurrency_limit=int(os.environ.get("DR_SERVER_CONCURRENCY", 200))
+    )
+    
+    # 提交与查询都立即返回，也可经 API（/submit_job、/poll_job）调用
+    btn_submit_job.click(
+        fn=submit_diagnosis_job,
+        inputs=[inputs_text, inputs_image],
+        outputs=[job_id_text, job_status],
+        api_name="submit_job"
     )
     
+    btn_poll_job.click(
+        fn=poll_diagnosis_job,
+        inputs=[job_id_text],
+        outputs=[outputs_text],
+        api_name="poll_job"
+    )
+    
+    inputs_image.upload(fn=prefetch_upload, inputs=[inputs_image], outputs=[])
+    
     btn_download.click(
         fn=generate_dr_report,
-        inputs=[],
-        outputs=[gr.File(label="下载报告")]
+        inputs=[export_start, export_end, export_grade, export_format],
+        outputs=[export_status, export_file]
     )
     
     def clear_input():
@@ -285,10 +448,34 @@ with gr.Blocks(css=simple_css, theme=gr.themes.Soft()) as demo:
     btn_new.click(
         fn=clear_all,
         inputs=[],
-        outputs=[inputs_text, outputs_text, gr.File(visible=False)]
+        outputs=[inputs_text, outputs_text, inputs_image]
     )
 
+def _warm_up():
+    """后台预热：编译图并跑一遍本地诊断，DR_WARMUP_PING=1 时提前建立大模型连接"""
+    try:
+        warm_up([graph_config], ping_llm=os.environ.get("DR_WARMUP_PING") == "1")
+    except Exception as e:
+        log_event(logger, logging.WARNING, "warmup_failed", error=str(e))
+
 if __name__ == "__main__":
+    # 分片模式（DR_SHARDS=N）：工作进程以 fork 启动，必须先于指标端点、预热等线程创建
+    shards = get_shard_pool(graph_config)
+    
+    # 本地 Prometheus 指标端点（DR_METRICS_PORT=0 关闭）
+    metrics_port = int(os.environ.get("DR_METRICS_PORT", 9464))
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    
+    # 分片模式下各工作进程启动时已预热
+    if shards is None:
+        threading.Thread(target=_warm_up, name="dr-warmup", daemon=True).start()
+    
+    # 启用任务队列时立即启动工作者，重启前未完成的任务继续执行
+    get_job_pool()
+    
+    # Gradio 排队上限：排队请求超过 DR_SERVER_QUEUE_MAX 时直接拒绝（队列已满），不无限排队（0 不限）
+    demo.queue(max_size=int(os.environ.get("DR_SERVER_QUEUE_MAX", 100)) or None)
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
@@ -0,0 +1,130 @@
+# DR_Voting.py - 视觉分级的并发自洽投票
+#
+# 同时发出 N 个采样，按完成顺序计票；按规则判定胜出等级已不可能被剩余采样改变时，立即取消其余在途调用。
+#   majority   某一等级得票超过 N 的一半（达不到时等全部完成后取相对多数）
+#   plurality  领先票数 - 第二名票数 > 剩余在途采样数
+#   all        等待全部采样
+# 平票时取较高等级，避免漏诊。胜出票数 / 采样总数作为视觉大模型在集成中的置信度：
+# 提前结束时未返回、以及无法解析的采样都按不一致计，5 个采样中 3 票一致为 0.6 而不是 1.0。
+# 采样返回 (等级, 附带结果) 或 None；计票只在投票循环中进行，判定时的有效票连同附带结果以元组快照返回，
+# 判定后才完成的采样不会再进入结果。
+import asyncio
+import contextvars
+import threading
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+VOTE_RULES = ("majority", "plurality", "all")
+
+_executor = None
+
+
+def is_decided(votes, samples, pending, rule):
+    """给定当前票数、采样总数与剩余在途数，判断胜出等级是否已确定"""
+    if not votes:
+        return False
+    ranked = votes.most_common(2)
+    leader = ranked[0][1]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    if rule == "majority":
+        return leader * 2 > samples
+    if rule == "plurality":
+        return leader - runner_up > pending
+    return pending == 0
+
+
+def _summary(votes, samples, counted, failed, cancelled, rule, errors, ballots):
+    """汇总投票；没有任何有效票时 grade 为 None，若全部采样都抛出异常则抛出第一个异常"""
+    if not votes and errors and failed == len(errors):
+        raise errors[0]
+    summary = {
+        "grade": None,
+        "share": 0.0,
+        "votes": {str(grade): count for grade, count in sorted(votes.items())},
+        "samples": samples,
+        "counted": counted,
+        "failed": failed,
+        "cancelled": cancelled,
+        "rule": rule,
+        "early_stopped": cancelled > 0,
+        "ballots": tuple(sorted(ballots, key=lambda ballot: ballot[0]))
+    }
+    if votes:
+        top = max(votes.values())
+        summary["grade"] = max(grade for grade, count in votes.items() if count == top)
+        summary["share"] = top / samples
+    return summary
+
+
+async def avote(sample, samples, rule="majority"):
+    """
+    并发投票。sample(i) 为协程函数，返回 (等级, 附带结果) 或 None（输出无法解析）；
+    返回 {"grade", "share", "votes", "samples", "counted", "failed", "cancelled", "rule", "early_stopped", "ballots"}，
+    ballots 为按采样序号排列的 (序号, 等级, 附带结果) 元组。
+    """
+    tasks = {asyncio.ensure_future(sample(i)): i for i in range(samples)}
+    pending = set(tasks)
+    votes = Counter()
+    counted = failed = 0
+    errors = []
+    ballots = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is not None:
+                    errors.append(error)
+                    failed += 1
+                elif task.result() is None:
+                    failed += 1
+                else:
+                    grade, payload = task.result()
+                    votes[grade] += 1
+                    counted += 1
+                    ballots.append((tasks[task], grade, payload))
+            if pending and is_decided(votes, samples, len(pending), rule):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+    return _summary(votes, samples, counted, failed, len(pending), rule, errors, ballots)
+
+
+def vote(sample, samples, rule="majority"):
+    """
+    同步投票，sample(i, cancelled) 为普通函数，返回值同 avote。线程无法从外部中断：
+    判定后设置 cancelled（threading.Event），在途采样应在调用大模型前、读取流式输出时检查并尽快返回。
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="dr-vote")
+    cancelled = threading.Event()
+    futures = {_executor.submit(contextvars.copy_context().run, sample, i, cancelled): i for i in range(samples)}
+    pending = set(futures)
+    votes = Counter()
+    counted = failed = 0
+    errors = []
+    ballots = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                errors.append(error)
+                failed += 1
+            elif future.result() is None:
+                failed += 1
+            else:
+                grade, payload = future.result()
+                votes[grade] += 1
+                counted += 1
+                ballots.append((futures[future], grade, payload))
+        if pending and is_decided(votes, samples, len(pending), rule):
+            break
+    cancelled.set()
+    for future in pending:
+        future.cancel()
+    return _summary(votes, samples, counted, failed, len(pending), rule, errors, ballots)
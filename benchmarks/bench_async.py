@@ -0,0 +1,57 @@
+# bench_async.py - 同步与异步诊断路径的并发吞吐对比
+#
+# 用法: python benchmarks/bench_async.py --latency 0.5 --workers 8
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import StubLLM, load_dr_test, make_input, quiet
+
+
+def run_sync(graph, concurrency, total, workers):
+    """模拟 Gradio 线程池：并发请求受工作线程数限制"""
+    def one(i):
+        graph.invoke(make_input(), {"configurable": {"thread_id": f"sync_{concurrency}_{i}"}})
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(concurrency, workers)) as pool:
+        list(pool.map(one, range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def run_async(graph, concurrency, total):
+    """同一事件循环上最多 concurrency 个请求同时在途"""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await graph.ainvoke(make_input(), {"configurable": {"thread_id": f"async_{concurrency}_{i}"}})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同步与异步诊断路径的并发吞吐对比")
+    parser.add_argument("--latency", type=float, default=0.5, help="桩模型单次调用延迟（秒）")
+    parser.add_argument("--workers", type=int, default=8, help="同步路径的工作线程数")
+    parser.add_argument("--rounds", type=int, default=2, help="每档并发发送 concurrency*rounds 个请求")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+
+    dr = load_dr_test(StubLLM(latency=args.latency))
+
+    print(f"stub latency={args.latency}s  sync workers={args.workers}")
+    print(f"{'concurrency':>12} {'sync req/s':>12} {'async req/s':>12} {'speedup':>8}")
+    for level in args.levels:
+        total = level * args.rounds
+        with quiet():
+            sync_rps = run_sync(dr.graph, level, total, args.workers)
+            async_rps = asyncio.run(run_async(dr.graph, level, total))
+        print(f"{level:>12} {sync_rps:>12.1f} {async_rps:>12.1f} {async_rps / sync_rps:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
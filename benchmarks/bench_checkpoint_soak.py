@@ -0,0 +1,58 @@
+# bench_checkpoint_soak.py - 检查点内存浸泡测试：连续诊断下常驻内存是否保持平稳
+#
+# 用法: python benchmarks/bench_checkpoint_soak.py [--count 5000] [--unbounded]
+#       python benchmarks/bench_checkpoint_soak.py --count 100000    # 完整浸泡，约 30 分钟
+import argparse
+import gc
+import os
+import time
+import uuid
+
+from common import StubLLM, load_dr_test, make_input, quiet
+
+
+def rss_mb():
+    """当前常驻内存（MB），读取 /proc/self/statm"""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查点内存浸泡测试")
+    parser.add_argument("--count", type=int, default=5000, help="诊断次数（默认为 --max-threads 的 5 倍，约 1-2 分钟）")
+    parser.add_argument("--samples", type=int, default=20, help="内存采样点数")
+    parser.add_argument("--max-threads", type=int, default=1000)
+    parser.add_argument("--latest-only", action="store_true")
+    parser.add_argument("--unbounded", action="store_true", help="对照组：使用原始 InMemorySaver")
+    args = parser.parse_args()
+
+    dr = load_dr_test(StubLLM(latency=0.0))
+    if args.unbounded:
+        from langgraph.checkpoint.memory import InMemorySaver
+        checkpointer = InMemorySaver()
+    else:
+        from DR_Checkpoint import BoundedMemorySaver
+        checkpointer = BoundedMemorySaver(max_threads=args.max_threads, latest_only=args.latest_only)
+    graph = dr.builder.compile(checkpointer=checkpointer)
+
+    step = max(1, args.count // args.samples)
+    print(f"{'diagnoses':>10} {'rss MB':>8} {'diag/s':>8}  checkpointer")
+    start = last = time.perf_counter()
+    baseline = None
+    for i in range(1, args.count + 1):
+        with quiet():
+            graph.invoke(make_input(model_grade=i % 5), {"configurable": {"thread_id": uuid.uuid4().hex}})
+        if i % step == 0:
+            gc.collect()
+            now = time.perf_counter()
+            rss = rss_mb()
+            baseline = baseline or rss
+            stats = checkpointer.stats() if hasattr(checkpointer, "stats") else {"threads": len(checkpointer.storage)}
+            print(f"{i:>10} {rss:>8.1f} {step / (now - last):>8.1f}  {stats}")
+            last = now
+    print(f"总耗时 {time.perf_counter() - start:.1f}s，内存增长 {rss_mb() - baseline:+.1f} MB（相对首个采样点）")
+
+
+if __name__ == "__main__":
+    main()
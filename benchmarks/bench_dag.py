@@ -0,0 +1,55 @@
+# bench_dag.py - supervisor 拓扑与 DAG 拓扑的单次诊断延迟对比
+#
+# 用法: python benchmarks/bench_dag.py --requests 300 --latency 0.0
+import argparse
+import asyncio
+import statistics
+import time
+
+from common import StubLLM, load_dr_test, make_input, quiet
+
+
+async def measure(graph, requests, new_id):
+    timings = []
+    with quiet():
+        for i in range(requests):
+            start = time.perf_counter()
+            await graph.ainvoke(make_input(model_grade=i % 5), {"configurable": {"thread_id": new_id()}})
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.mean(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.99) - 1]
+
+
+def check_equivalence(dr):
+    """两种拓扑对同一输入应得到相同的 final_report 与 messages"""
+    for grade in range(5):
+        with quiet():
+            a = dr.stateless_graph.invoke(make_input(model_grade=grade), {"configurable": {"thread_id": "a"}})
+            b = dr.dag_graph.invoke(make_input(model_grade=grade), {"configurable": {"thread_id": "b"}})
+        assert dr.report_from_state(a) == dr.report_from_state(b), f"final_report 不一致（等级{grade}）"
+        assert [getattr(m, "content", m) for m in a["messages"]] == [getattr(m, "content", m) for m in b["messages"]], f"messages 不一致（等级{grade}）"
+        assert a["current_step"] == b["current_step"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="supervisor 与 DAG 拓扑延迟对比")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.0, help="桩模型单次调用延迟（秒）")
+    args = parser.parse_args()
+
+    dr = load_dr_test(StubLLM(latency=args.latency))
+    check_equivalence(dr)
+    print("输出一致性检查通过")
+
+    variants = [("supervisor", dr.stateless_graph), ("dag", dr.dag_graph)]
+    for _, graph in variants:
+        asyncio.run(measure(graph, 20, dr.new_request_id))
+
+    print(f"{'topology':>12} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, graph in variants:
+        mean, p50, p99 = asyncio.run(measure(graph, args.requests, dr.new_request_id))
+        print(f"{name:>12} {mean:>9.2f} {p50:>9.2f} {p99:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# bench_export.py - 批量报告导出：流式 gzip JSONL/CSV 的吞吐（MB/s）与峰值内存，对照一次性读入内存再写出
+#
+# 用法: python benchmarks/bench_export.py --reports 100000
+#
+# 结果库在子进程中生成，主进程的峰值 RSS 只反映导出本身。
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import common  # noqa: F401  将仓库根目录加入 sys.path
+
+
+def populate(db_path, count, seed=0):
+    """用 DRDiagnosisSystem 生成真实结构的报告写入结果库（在子进程执行）"""
+    from common import load_dr_test
+    from DR_Store import DiagnosisStore
+
+    DR_Test = load_dr_test()
+    system = DR_Test.get_dr_system()
+    rng = random.Random(seed)
+    store = DiagnosisStore(db_path)
+    now = time.time()
+    for i in range(count):
+        grade = rng.choices(range(5), weights=[70, 12, 10, 5, 3])[0]
+        integrated = system.integrate_predictions(
+            {"grade": grade, "confidence": rng.randint(60, 99)},
+            {"predicted_grade": max(0, min(4, grade + rng.choice((-1, 0, 0, 0, 1)))), "confidence": 0.85}
+        )
+        patient = {"age": rng.randint(30, 85), "sex": rng.choice("男女"), "diabetes_type": "2型",
+                   "diabetes_duration": rng.randint(1, 30), "hbA1c": round(rng.uniform(5.5, 11), 1),
+                   "other_conditions": rng.sample(["高血压", "高脂血症", "冠心病"], rng.randint(0, 2))}
+        report = system.generate_diagnosis_report(integrated, patient)
+        while not store.put(f"req-{i}", report, f"patient-{rng.randrange(count // 3 + 1)}", now - i * 30):
+            time.sleep(0.001)
+    store.close()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="报告批量导出的吞吐与峰值内存")
+    parser.add_argument("--reports", type=int, default=100000)
+    parser.add_argument("--level", type=int, default=6, help="gzip 压缩级别")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dr_bench_export_")
+    db_path = os.path.join(workdir, "results.db")
+    start = time.perf_counter()
+    process = multiprocessing.Process(target=populate, args=(db_path, args.reports))
+    process.start()
+    process.join()
+    print(f"生成 {args.reports:,} 份报告（{os.path.getsize(db_path) / 1e6:.0f} MB）用时 {time.perf_counter() - start:.1f}s")
+
+    from common import load_dr_test
+    from DR_Export import ExportManager
+    from DR_Store import DiagnosisStore
+
+    DR_Test = load_dr_test()
+    store = DiagnosisStore(db_path)
+    store.count()
+    print(f"导出前峰值 RSS {peak_rss_mb():.0f} MB")
+    print(f"{'方式':<28} {'秒':>6} {'报告/s':>9} {'原始 MB':>8} {'MB/s':>7} {'gzip MB':>8} {'峰值 RSS MB':>11}")
+
+    for name, fmt, formatter in (
+        ("jsonl（报告原文拼接）", "jsonl", None),
+        ("jsonl + report_text", "jsonl", DR_Test.format_report_for_display),
+        ("csv", "csv", None),
+        ("csv + report_text", "csv", DR_Test.format_report_for_display),
+    ):
+        manager = ExportManager(store, os.path.join(workdir, "exports"), formatter, compresslevel=args.level)
+        start = time.perf_counter()
+        job = manager.submit(fmt)
+        while not job.finished:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        assert job.status == "done", job.error
+        print(f"{name:<28} {elapsed:>6.1f} {job.exported / elapsed:>9,.0f} {job.raw_bytes / 1e6:>8.1f} "
+              f"{job.raw_bytes / 1e6 / elapsed:>7.1f} {job.compressed_bytes / 1e6:>8.1f} {peak_rss_mb():>11.0f}")
+        os.remove(job.path)
+
+    # 对照：一次性读出全部报告、在内存中拼好整个文件再压缩写出
+    start = time.perf_counter()
+    rows = store._reader().execute("SELECT request_id, patient_id, created_at, report FROM diagnoses").fetchall()
+    payload = "".join(
+        json.dumps({"request_id": r[0], "patient_id": r[1], "created_at": r[2], "report": json.loads(r[3]),
+                    "report_text": DR_Test.format_report_for_display(json.loads(r[3]))}, ensure_ascii=False) + "\n"
+        for r in rows
+    ).encode("utf-8")
+    with gzip.open(os.path.join(workdir, "naive.jsonl.gz"), "wb", compresslevel=args.level) as f:
+        f.write(payload)
+    elapsed = time.perf_counter() - start
+    print(f"{'对照：全部读入内存再写出':<28} {elapsed:>6.1f} {len(rows) / elapsed:>9,.0f} {len(payload) / 1e6:>8.1f} "
+          f"{len(payload) / 1e6 / elapsed:>7.1f} {'':>8} {peak_rss_mb():>11.0f}")
+
+    store.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# bench_grading.py - 分级模型微批推理：扫描最大批大小与最长等待时间，给出吞吐/延迟权衡曲线
+#
+# 用法: python benchmarks/bench_grading.py --model synthetic --concurrency 4,64 --batch-sizes 1,4,8,16,32 --waits-ms 0,2,5,10
+#       python benchmarks/bench_grading.py --model numpy --size 512   # 随机权重的 NumpyGradingModel
+#
+# synthetic 模型每批耗时 = 固定开销 + 单张开销 × 批大小（sleep 模拟，释放 GIL），对应 ONNX/BLAS 推理中
+# 权重读取、算子调度等与批大小无关的成本；批越大，固定开销被摊得越薄。
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+import common  # noqa: F401  将仓库根目录加入 sys.path
+from DR_Grading import NUM_GRADES, MicroBatcher, NumpyGradingModel
+
+
+class SyntheticGradingModel:
+    """每批耗时 fixed + per_item × N，返回随机概率"""
+
+    def __init__(self, fixed, per_item):
+        self.fixed = fixed
+        self.per_item = per_item
+        self._rng = np.random.default_rng(0)
+
+    def predict(self, batch):
+        time.sleep(self.fixed + self.per_item * len(batch))
+        logits = self._rng.standard_normal((len(batch), NUM_GRADES))
+        return np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+
+
+async def load(batcher, image, concurrency, duration):
+    """闭环压测：concurrency 个客户端各自连续提交，返回 (完成数, 各请求延迟)"""
+    latencies = []
+    stop_at = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            await batcher.apredict(image)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return len(latencies), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分级模型动态微批的吞吐与延迟扫描")
+    parser.add_argument("--model", default="synthetic", choices=["synthetic", "numpy"])
+    parser.add_argument("--fixed-ms", type=float, default=8.0, help="synthetic 模型每批固定开销（毫秒）")
+    parser.add_argument("--per-item-ms", type=float, default=0.5, help="synthetic 模型每张图像开销（毫秒）")
+    parser.add_argument("--size", type=int, default=512, help="输入图像边长")
+    parser.add_argument("--concurrency", default="4,64", help="并发客户端数，逗号分隔；低并发时等待时间主导延迟，高并发时批大小主导吞吐")
+    parser.add_argument("--batch-sizes", default="1,4,8,16,32")
+    parser.add_argument("--waits-ms", default="0,2,5,10")
+    parser.add_argument("--workers", type=int, default=1, help="推理线程数")
+    parser.add_argument("--duration", type=float, default=2.0, help="每组配置压测时长（秒）")
+    args = parser.parse_args()
+
+    if args.model == "synthetic":
+        model = SyntheticGradingModel(args.fixed_ms / 1000, args.per_item_ms / 1000)
+    else:
+        model = NumpyGradingModel.random()
+    image = np.random.default_rng(0).standard_normal((args.size, args.size, 3)).astype(np.float16)
+
+    print(f"模型 {args.model}，{args.workers} 个推理线程，每组 {args.duration:.0f} 秒")
+    print(f"{'并发':>4} {'批大小':>6} {'等待 ms':>7} {'吞吐 req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'平均批':>6}")
+    for concurrency in [int(v) for v in args.concurrency.split(",")]:
+        for max_batch_size in [int(v) for v in args.batch_sizes.split(",")]:
+            for wait_ms in [float(v) for v in args.waits_ms.split(",")]:
+                batcher = MicroBatcher(model, max_batch_size, wait_ms / 1000, workers=args.workers)
+                asyncio.run(load(batcher, image, concurrency, 0.2))
+                before = batcher.stats()
+                done, latencies = asyncio.run(load(batcher, image, concurrency, args.duration))
+                after = batcher.stats()
+                batcher.close()
+                p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+                mean_batch = (after["items"] - before["items"]) / max(after["batches"] - before["batches"], 1)
+                print(f"{concurrency:>4} {max_batch_size:>6} {wait_ms:>7.0f} {done / args.duration:>10.1f} "
+                      f"{p50:>8.1f} {p99:>8.1f} {mean_batch:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# bench_image.py - 眼底图像摄取吞吐：冷缓存（解码+预处理）、温缓存（新进程，仅读取与哈希）、热缓存（路径命中），
+#                  以及缓存目录超出容量上限时的淘汰
+#
+# 用法: python benchmarks/bench_image.py --images 40 --duplicates 10 --width 2048 --height 1536
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import common  # noqa: F401  将仓库根目录加入 sys.path
+from DR_Image import FundusImageStore
+
+
+def make_fundus_jpeg(path, width, height, seed):
+    """黑色背景上的圆形视网膜区域，叠加随机血管状条纹与噪声"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(image)
+    radius = int(min(width, height) * 0.45)
+    cx, cy = width // 2 + rng.randint(-40, 40), height // 2 + rng.randint(-40, 40)
+    draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=(180, 70 + rng.randint(0, 30), 40))
+    for _ in range(30):
+        x0, y0 = cx + rng.randint(-radius, radius) // 2, cy + rng.randint(-radius, radius) // 2
+        draw.line((cx, cy, x0 * 2 - cx, y0 * 2 - cy), fill=(120, 20, 20), width=rng.randint(2, 8))
+    noise = np.random.default_rng(seed).integers(0, 12, (height, width, 3), dtype=np.uint8)
+    image = Image.fromarray(np.clip(np.asarray(image, dtype=np.int16) + noise, 0, 255).astype(np.uint8))
+    image.save(path, quality=92)
+
+
+def run(store, paths):
+    """全部预取后逐一等待，返回 (耗时, 结果列表)"""
+    start = time.perf_counter()
+    for path in paths:
+        store.prefetch(path)
+    images = [store.get(path) for path in paths]
+    return time.perf_counter() - start, images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="眼底图像摄取与预处理缓存吞吐")
+    parser.add_argument("--images", type=int, default=40, help="不同内容的图像数")
+    parser.add_argument("--duplicates", type=int, default=10, help="额外的重复上传（内容相同、路径不同）")
+    parser.add_argument("--width", type=int, default=2048)
+    parser.add_argument("--height", type=int, default=1536)
+    parser.add_argument("--size", type=int, default=512, help="预处理输出边长")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-mb", type=float, default=None, help="淘汰测试的缓存容量上限（默认为全部缓存的一半）")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dr_bench_image_")
+    try:
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(workdir, f"fundus_{i}.jpg")
+            make_fundus_jpeg(path, args.width, args.height, i)
+            paths.append(path)
+        for i in range(args.duplicates):
+            path = os.path.join(workdir, f"upload_{i}.jpg")
+            shutil.copyfile(paths[i % args.images], path)
+            paths.append(path)
+        total_mb = sum(os.path.getsize(p) for p in paths) / 1e6
+        print(f"{len(paths)} 张 {args.width}x{args.height} JPEG（{args.duplicates} 张重复），共 {total_mb:.1f} MB，"
+              f"输出 {args.size}x{args.size}，{args.workers} 个工作线程")
+
+        cache_dir = os.path.join(workdir, "cache")
+        store = FundusImageStore(cache_dir, size=args.size, workers=args.workers)
+        cold, images = run(store, paths)
+        cold_stats = store.stats()
+        hot, _ = run(store, paths)
+        warm_store = FundusImageStore(cache_dir, size=args.size, workers=args.workers)
+        warm, _ = run(warm_store, paths)
+
+        print(f"{'缓存':<6} {'images/s':>10} {'耗时 ms':>9}")
+        for name, seconds in (("冷", cold), ("温", warm), ("热", hot)):
+            print(f"{name:<6} {len(paths) / seconds:>10.1f} {seconds * 1000:>9.1f}")
+        print(f"冷缓存实际预处理 {cold_stats['processed']} 张，按内容去重 {cold_stats['dedup_hits']} 张")
+
+        start = time.perf_counter()
+        checksum = sum(float(image.array[::64, ::64].mean()) for image in images)
+        elapsed = time.perf_counter() - start
+        array = images[0].array
+        print(f"内存映射读取: {len(images) / elapsed:.0f} images/s，数组 {array.shape} {array.dtype}，"
+              f"只读映射 {isinstance(array, np.memmap)}（校验和 {checksum:.2f}）")
+
+        # 容量上限：重新打开同一目录时先按 mtime 淘汰到上限以内，之后每写入一个新文件淘汰最久未用的
+        full = store.stats()["bytes"]
+        max_bytes = int(args.max_mb * 1e6) if args.max_mb else full // 2
+        capped = FundusImageStore(cache_dir, size=args.size, workers=args.workers, max_bytes=max_bytes)
+        opened = capped.stats()
+        run(capped, paths)
+        stats = capped.stats()
+        print(f"容量上限 {max_bytes / 1e6:.1f} MB（全部缓存 {full / 1e6:.1f} MB）：打开时淘汰 {opened['evictions']} 个，"
+              f"摄取后共淘汰 {stats['evictions']} 个，留存 {stats['files']} 个 {stats['bytes'] / 1e6:.1f} MB，"
+              f"重新预处理 {stats['processed']} 张")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# bench_jobqueue.py - 异步诊断任务队列：持久化/优先级/背压/租约重投验证，以及吞吐随工作者数的变化
+#
+# 用法: python benchmarks/bench_jobqueue.py --jobs 100 --latency 0.2 --workers 1,4,16,32 [--mode process]
+#
+# 先逐项验证（断言失败即退出）：重新打开库文件后任务仍在；疑似 PDR 先于普通任务领取；
+# 未完成任务达上限时拒绝提交；租约过期后任务被重新领取，旧租约的迟到结果被丢弃；领取满 max_attempts 次后标记失败。
+# 然后用桩大模型（固定延迟）跑完整诊断图，比较不同工作者数下从提交到全部完成的吞吐。
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from common import StubLLM, load_dr_test, make_input, quiet
+from DR_JobQueue import PRIORITY_NORMAL, PRIORITY_URGENT, JobQueue, JobQueueFull, JobWorkerPool
+
+_DR_Test = None
+
+
+def stub_handler(payload):
+    """模块级执行函数，进程模式下在各工作进程中按 DR_BENCH_LLM_LATENCY 注入桩模型"""
+    global _DR_Test
+    if _DR_Test is None:
+        if multiprocessing.parent_process() is not None:
+            # 工作进程屏蔽节点调试输出；redirect_stdout 替换的是全局 sys.stdout，不能在并发线程里各自进出
+            sys.stdout = open(os.devnull, "w")
+        _DR_Test = load_dr_test(StubLLM(latency=float(os.environ.get("DR_BENCH_LLM_LATENCY", 0.2))))
+    return _DR_Test.run_diagnosis_job(payload)
+
+
+def payload(i, grade=None):
+    """每个任务的患者描述不同，避免被请求合并层去重"""
+    data = json.loads(make_input(model_grade=i % 3 if grade is None else grade)["messages"][0])
+    data["patient_query"] = f"病例 {i}：{data['patient_query']}"
+    return data
+
+
+def check_semantics(tmp):
+    path = os.path.join(tmp, "semantics.db")
+
+    # 持久化：关闭后重新打开，未完成任务仍可领取
+    JobQueue(path).submit(payload(0))
+    jobs = JobQueue(path, max_pending=25, visibility_timeout=0.2, max_attempts=2)
+    assert jobs.stats()["queued"] == 1, "重新打开后应保留未完成任务"
+    jobs.complete(jobs.claim(), {"ok": True})
+
+    # 优先级：先提交普通任务，后提交的疑似 PDR 先被领取；排队位置反映优先级
+    normal = [jobs.submit(payload(i)) for i in range(1, 21)]
+    urgent = jobs.submit(payload(99, grade=4))
+    assert jobs.status(urgent)["priority"] == PRIORITY_URGENT and jobs.status(urgent)["ahead"] == 0
+    assert jobs.status(normal[-1])["ahead"] == 20
+    first = jobs.claim()
+    assert first.job_id == urgent, "疑似 PDR 应最先领取"
+    jobs.complete(first, {"ok": True})
+
+    # 背压：未完成任务达到上限后拒绝
+    accepted = 0
+    try:
+        for i in range(100, 110):
+            jobs.submit(payload(i), priority=PRIORITY_NORMAL)
+            accepted += 1
+    except JobQueueFull:
+        pass
+    assert accepted == 5 and sum(jobs.stats().values()) == 25, "未完成任务达到 max_pending 后应拒绝提交"
+    # 已存在的 job_id 不重复入队
+    assert jobs.submit(payload(1), job_id=normal[0]) == normal[0]
+
+    # 租约过期重投：领取后不提交结果，过期后被再次领取，旧结果丢弃
+    while jobs.claim() is not None:
+        pass
+    time.sleep(0.25)
+    redelivered = jobs.claim()
+    assert redelivered is not None and redelivered.attempt == 2, "租约过期后应重新领取"
+    assert not jobs.complete(redelivered._replace(attempt=1), {"stale": True}), "旧租约的结果应被丢弃"
+    assert jobs.complete(redelivered, {"ok": True})
+    assert jobs.result(redelivered.job_id) == {"ok": True}
+
+    # 领取满 max_attempts 次后标记失败
+    while jobs.claim() is not None:
+        pass
+    time.sleep(0.25)
+    assert jobs.claim() is None
+    failed = jobs.status(normal[1])
+    assert failed["status"] == "failed" and failed["attempts"] == 2, failed
+    print("语义验证通过：持久化、优先级、背压、幂等提交、租约重投、最大执行次数")
+
+
+def run_throughput(path, jobs_count, workers, mode):
+    jobs = JobQueue(path, max_pending=jobs_count)
+    ids = [jobs.submit(payload(i)) for i in range(jobs_count)]
+    start = time.perf_counter()
+    pool = JobWorkerPool(jobs, stub_handler, workers=workers, mode=mode, poll_interval=0.05).start()
+    for job_id in ids:
+        info = jobs.wait(job_id, poll_interval=0.05)
+        assert info["status"] == "done", info
+    elapsed = time.perf_counter() - start
+    pool.stop()
+    assert jobs.result(ids[0])["report_text"].startswith("## 🩺")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="异步诊断任务队列验证与吞吐")
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2, help="桩模型单次调用延迟（秒）")
+    parser.add_argument("--workers", default="1,4,16,32", help="逗号分隔的工作者数")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    args = parser.parse_args()
+
+    os.environ["DR_BENCH_LLM_LATENCY"] = str(args.latency)
+    # 吞吐测量关闭结果复用，只保留在途合并
+    os.environ["DR_COALESCE_TTL"] = "0"
+    with quiet():
+        stub_handler(payload(0))  # 预热：编译诊断图
+
+    with tempfile.TemporaryDirectory() as tmp:
+        check_semantics(tmp)
+        print(f"\n{args.jobs} 个任务，桩模型延迟 {args.latency}s，{args.mode} 工作者")
+        print(f"{'工作者':>6} {'耗时 s':>8} {'任务/s':>8} {'加速比':>7}")
+        baseline = None
+        for workers in (int(value) for value in args.workers.split(",")):
+            with quiet():
+                elapsed = run_throughput(os.path.join(tmp, f"throughput_{workers}.db"), args.jobs, workers, args.mode)
+            baseline = baseline or elapsed
+            print(f"{workers:>6} {elapsed:>8.2f} {args.jobs / elapsed:>8.1f} {baseline / elapsed:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# bench_knowledge.py - 临床知识库：建议查询与报告生成的单次耗时，对照逐次构造建议字典的旧实现
+#
+# 用法: python benchmarks/bench_knowledge.py --iterations 200000
+import argparse
+import random
+import time
+
+import common  # noqa: F401  将仓库根目录加入 sys.path
+from DR_Knowledge import KnowledgeBase
+
+
+def legacy_recommendations(grade, patient_info):
+    """对照：原 _get_treatment_recommendations，每次调用重新构造整个嵌套字典，不看患者信息"""
+    recommendations = {
+        "treatment_recommendations": {"medication": [], "procedures": [], "lifestyle": []},
+        "followup_plan": {"interval": "", "next_exams": ["视力检查", "眼底照相", "OCT检查"]},
+        "targets": {"hba1c": "<7.0%", "blood_pressure": "<130/80mmHg"},
+        "patient_education": [],
+        "warning_signs": ["视力突然下降", "视物变形", "眼前黑影"]
+    }
+    if grade == 0:
+        recommendations["treatment_recommendations"]["lifestyle"] = ["严格控制血糖", "健康饮食", "适量运动"]
+        recommendations["followup_plan"]["interval"] = "12个月"
+        recommendations["patient_education"] = ["定期眼科检查", "控制血糖血压"]
+    elif grade == 1:
+        recommendations["treatment_recommendations"]["medication"] = ["羟苯磺酸钙"]
+        recommendations["treatment_recommendations"]["lifestyle"] = ["严格血糖控制", "控制血压血脂"]
+        recommendations["followup_plan"]["interval"] = "6-12个月"
+    elif grade == 2:
+        recommendations["treatment_recommendations"]["medication"] = ["羟苯磺酸钙", "改善微循环药物"]
+        recommendations["treatment_recommendations"]["procedures"] = ["评估激光治疗必要性"]
+        recommendations["followup_plan"]["interval"] = "4-6个月"
+    elif grade == 3:
+        recommendations["treatment_recommendations"]["procedures"] = ["全视网膜光凝治疗", "评估抗VEGF治疗"]
+        recommendations["followup_plan"]["interval"] = "3-4个月"
+        recommendations["patient_education"] = ["高危状态，需要及时干预"]
+    elif grade == 4:
+        recommendations["treatment_recommendations"]["procedures"] = ["紧急全视网膜光凝", "评估玻璃体手术"]
+        recommendations["followup_plan"]["interval"] = "1个月或立即随访"
+        recommendations["patient_education"] = ["急诊状态，有失明风险"]
+    return recommendations
+
+
+def make_cases(count, seed=0):
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        patient = {"age": rng.randint(30, 85), "diabetes_type": "2型"}
+        if rng.random() < 0.8:
+            patient["hbA1c"] = round(rng.uniform(5.5, 11), 1)
+        if rng.random() < 0.7:
+            patient["diabetes_duration"] = rng.randint(1, 30)
+        patient["other_conditions"] = rng.sample(["高血压", "高脂血症", "冠心病"], rng.randint(0, 2))
+        if rng.random() < 0.3:
+            patient["blood_pressure"] = {"systolic": rng.randint(110, 170), "diastolic": rng.randint(65, 100)}
+        cases.append((rng.choices(range(5), weights=[70, 12, 10, 5, 3])[0], patient))
+    return cases
+
+
+def per_call_us(fn, cases, iterations, repeat=5):
+    """多轮取最快一轮，减少单核机器上的调度噪声"""
+    calls = [cases[i % len(cases)] for i in range(iterations)]
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for grade, patient in calls:
+            fn(grade, patient)
+        best = min(best, time.perf_counter() - start)
+    return best / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库查询与报告生成耗时")
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+
+    from common import load_dr_test
+    DR_Test = load_dr_test()
+    system = DR_Test.get_dr_system()
+    start = time.perf_counter()
+    knowledge = KnowledgeBase()
+    print(f"载入知识库 {knowledge.version}：{knowledge.stats()['entries']} 条预生成建议，{(time.perf_counter() - start) * 1000:.2f} ms")
+
+    cases = make_cases(1000)
+    integrated = {grade: system.integrate_predictions({"grade": grade, "confidence": 90}, {"predicted_grade": grade})
+                  for grade in range(5)}
+
+    def legacy_report(grade, patient):
+        # 旧流程：知识查询节点构造一次，报告生成时再构造一次
+        legacy_recommendations(grade, patient)
+        report = system.generate_diagnosis_report(integrated[grade], patient, legacy_recommendations(grade, patient))
+        return DR_Test.format_report_for_display(report)
+
+    def new_report(grade, patient):
+        recommendations = system._get_treatment_recommendations(grade, patient)
+        report = system.generate_diagnosis_report(integrated[grade], patient, recommendations)
+        return DR_Test.format_report_for_display(report)
+
+    rows = [
+        ("建议：逐次构造（旧）", per_call_us(legacy_recommendations, cases, args.iterations)),
+        ("建议：知识库查询（无患者信息）", per_call_us(lambda grade, patient: knowledge.lookup(grade), cases, args.iterations)),
+        ("建议：知识库查询（含风险分档）", per_call_us(knowledge.lookup, cases, args.iterations)),
+        ("知识查询 + 报告 + 文本（旧，构造两次）", per_call_us(legacy_report, cases, args.iterations)),
+        ("知识查询 + 报告 + 文本（复用）", per_call_us(new_report, cases, args.iterations)),
+    ]
+    print(f"{'操作':<30} {'µs/次':>8}")
+    for name, elapsed in rows:
+        print(f"{name:<30} {elapsed:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
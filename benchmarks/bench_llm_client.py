@@ -0,0 +1,92 @@
+# bench_llm_client.py - 大模型客户端的尾延迟：裸连接池客户端 / 截止时间+重试 / 再加对冲请求，以及故障时的熔断
+#
+# 用法: python benchmarks/bench_llm_client.py --latency 0.1 --tail-prob 0.05 --tail-latency 2 --requests 400
+import argparse
+import asyncio
+import time
+
+import common  # noqa: F401  将仓库根目录加入 sys.path
+from DR_FakeLLMServer import FakeLLMConfig, start_fake_llm_server
+from DR_LLMClient import OpenAICompatibleChatClient, ResilientLLM
+
+PROMPT = [{"role": "user", "content": "当前分级模型结果: 等级2"}]
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def run(client, total, concurrency):
+    """返回 (每次调用耗时列表, 失败次数, 总耗时)"""
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one():
+        nonlocal failures
+        async with sem:
+            start = time.perf_counter()
+            try:
+                await client.ainvoke(PROMPT)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies, failures, time.perf_counter() - start
+
+
+def report(name, latencies, failures, elapsed):
+    print(f"{name:<22} p50={percentile(latencies, 0.5) * 1000:7.1f}ms  p95={percentile(latencies, 0.95) * 1000:7.1f}ms  "
+          f"p99={percentile(latencies, 0.99) * 1000:7.1f}ms  max={max(latencies) * 1000:7.1f}ms  "
+          f"失败={failures:<4d} 吞吐={len(latencies) / elapsed:6.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大模型客户端尾延迟与熔断对比（本地假服务）")
+    parser.add_argument("--latency", type=float, default=0.1, help="假服务基础延迟（秒）")
+    parser.add_argument("--tail-prob", type=float, default=0.05, help="长尾请求概率")
+    parser.add_argument("--tail-latency", type=float, default=2.0, help="长尾请求延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="假服务 500 概率")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=1.0, help="包装客户端的单次调用截止时间（秒）")
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(args.latency, 0.2, args.tail_prob, args.tail_latency, args.error_rate, seed=7)
+    server = start_fake_llm_server(config=config)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    print(f"假服务: 基础延迟 {args.latency}s，{args.tail_prob:.0%} 长尾 {args.tail_latency}s，{args.error_rate:.0%} 错误")
+
+    raw = OpenAICompatibleChatClient(base_url, "fake", pool_size=args.concurrency)
+    latencies, failures, elapsed = asyncio.run(run(raw, args.requests, args.concurrency))
+    report("连接池客户端", latencies, failures, elapsed)
+
+    for name, hedge in (("截止时间+重试", False), ("截止时间+重试+对冲", True)):
+        client = ResilientLLM(
+            OpenAICompatibleChatClient(base_url, "fake", pool_size=args.concurrency * 2),
+            max_concurrency=args.concurrency, timeout=args.timeout, max_retries=2, backoff=0.05, hedge=hedge
+        )
+        latencies, failures, elapsed = asyncio.run(run(client, args.requests, args.concurrency))
+        report(name, latencies, failures, elapsed)
+        stats = client.stats()
+        print(f"{'':<22} 重试={stats['retries']} 超时={stats['timeouts']} 对冲={stats['hedges']} "
+              f"对冲胜出={stats['hedge_wins']}")
+
+    # 故障注入：服务全部返回 500，熔断打开后调用立即被拒绝（节点回退到默认 vision_result）
+    config.error_rate = 1.0
+    client = ResilientLLM(
+        OpenAICompatibleChatClient(base_url, "fake"), max_concurrency=args.concurrency,
+        timeout=args.timeout, max_retries=1, backoff=0.01
+    )
+    latencies, failures, elapsed = asyncio.run(run(client, 200, args.concurrency))
+    stats = client.stats()
+    report("服务故障（熔断）", latencies, failures, elapsed)
+    print(f"{'':<22} 放行调用={stats['calls']} 熔断拒绝={stats['rejected']} 熔断状态={stats['breaker_state']}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
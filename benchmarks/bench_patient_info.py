@@ -0,0 +1,73 @@
+# bench_patient_info.py - 患者信息抽取：标注语料上的逐字段准确率与批量吞吐
+#
+# 用法: python benchmarks/bench_patient_info.py --corpus benchmarks/data/patient_notes.jsonl --notes 50000
+#
+# 语料每行 {"text": 病历文本, "expected": 期望抽取结果}，expected 与 DR_PatientInfo.extract 的输出结构一致。
+import argparse
+import json
+import os
+import time
+
+import common  # noqa: F401  将仓库根目录加入 sys.path
+from DR_PatientInfo import extract, extract_many
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "patient_notes.jsonl")
+FIELDS = ("age", "sex", "diabetes_type", "diabetes_duration", "hbA1c", "blood_pressure", "other_conditions", "dr_grade")
+
+
+def score(cases):
+    """逐字段统计：期望有值的字段中抽对的比例（召回），抽出值的字段中正确的比例（精确）"""
+    stats = {field: [0, 0, 0] for field in FIELDS}  # 正确, 期望有值, 抽出有值
+    exact = 0
+    mismatches = []
+    for case in cases:
+        expected, got = case["expected"], extract(case["text"])
+        exact += got == expected
+        for field in FIELDS:
+            want, have = expected.get(field), got.get(field)
+            if field == "other_conditions":
+                want, have = set(want or ()), set(have or ())
+                stats[field][0] += len(want & have)
+                stats[field][1] += len(want)
+                stats[field][2] += len(have)
+                continue
+            stats[field][0] += want is not None and want == have
+            stats[field][1] += want is not None
+            stats[field][2] += have is not None
+            if want != have:
+                mismatches.append((case["text"], field, want, have))
+    return stats, exact, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="患者信息抽取的准确率与吞吐")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="标注语料 JSONL")
+    parser.add_argument("--notes", type=int, default=50000, help="吞吐测试的病历条数（语料循环重复）")
+    parser.add_argument("--show-errors", action="store_true", help="打印抽取错误的病例")
+    args = parser.parse_args()
+
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    stats, exact, mismatches = score(cases)
+    print(f"语料 {len(cases)} 条，整条完全正确 {exact} 条 ({exact / len(cases):.1%})")
+    print(f"{'字段':<18} {'召回':>7} {'精确':>7} {'期望':>5}")
+    for field, (correct, expected, extracted) in stats.items():
+        recall = correct / expected if expected else 1.0
+        precision = correct / extracted if extracted else 1.0
+        print(f"{field:<18} {recall:>7.1%} {precision:>7.1%} {expected:>5}")
+    if args.show_errors:
+        for text, field, want, have in mismatches:
+            print(f"  {field}: 期望 {want} 实际 {have} | {text}")
+
+    texts = [cases[i % len(cases)]["text"] for i in range(args.notes)]
+    average_chars = sum(len(text) for text in texts) / len(texts)
+    start = time.perf_counter()
+    extract_many(texts)
+    elapsed = time.perf_counter() - start
+    print(f"批量抽取 {args.notes} 条（平均 {average_chars:.0f} 字符）: {args.notes / elapsed:,.0f} 条/秒，"
+          f"{elapsed / args.notes * 1e6:.1f} µs/条")
+
+
+if __name__ == "__main__":
+    main()
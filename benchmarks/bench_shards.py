@@ -0,0 +1,139 @@
+# bench_shards.py - 多进程分片服务压测：桩大模型下吞吐随分片（工作进程）数的变化，以及满载时的拒绝
+#
+# 用法: python benchmarks/bench_shards.py --shards 1,2,4 --requests 400 --concurrency 64 --cpu-ms 5
+#
+# 桩模型在固定延迟外可额外占用 --cpu-ms 毫秒 CPU，模拟图像预处理、分级推理等持有 GIL 的工作；
+# --cpu-ms 0 时只剩诊断图本身的 CPU 开销（状态合并、JSON 解析、报告格式化）。
+# 吞吐只在多核机器上随分片数增长，单核机器上分片数增加只带来进程间通信开销。
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from common import StubLLM, load_dr_test, make_input, quiet
+from DR_Shards import ShardBusy, ShardPool
+
+
+class CpuStubLLM(StubLLM):
+    """固定延迟之外同步占用 cpu_ms 毫秒 CPU 的桩模型"""
+
+    def __init__(self, latency=0.05, cpu_ms=0.0):
+        super().__init__(latency)
+        self.cpu_ms = cpu_ms
+
+    def _burn(self):
+        deadline = time.perf_counter() + self.cpu_ms / 1000
+        while time.perf_counter() < deadline:
+            pass
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        self._burn()
+        return await super().ainvoke(messages, config, **kwargs)
+
+
+def init_stub(latency, cpu_ms):
+    """工作进程初始化：注入桩模型并屏蔽节点调试输出"""
+    import sys
+    sys.stdout = open(os.devnull, "w")
+    load_dr_test(CpuStubLLM(latency, cpu_ms))
+
+
+def requests(count):
+    items = []
+    for i in range(count):
+        data = json.loads(make_input(model_grade=i % 5, confidence=60)["messages"][0])
+        data["patient_query"] = f"病例 {i}：{data['patient_query']}"
+        items.append(data)
+    return items
+
+
+async def drive(run, items, concurrency):
+    """以固定并发数发出全部请求，返回 (总耗时, 各请求延迟, 被拒绝数)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    busy = 0
+
+    async def one(i, item):
+        nonlocal busy
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                text = await run(item, f"bench_{i}")
+            except ShardBusy:
+                busy += 1
+                return
+            assert text and text.startswith("## 🩺"), text
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i, item) for i, item in enumerate(items)))
+    return time.perf_counter() - start, sorted(latencies), busy
+
+
+def report_row(name, elapsed, latencies, baseline):
+    rate = len(latencies) / elapsed
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    print(f"{name:<10} {rate:>8.1f} {p50:>9.1f} {p95:>9.1f} {rate / (baseline or rate):>7.2f}")
+    return rate
+
+
+def check_shedding(latency, cpu_ms):
+    """单分片 max_inflight=8，同时发出 40 个请求：8 个执行，其余立即返回繁忙"""
+    pool = ShardPool(1, max_inflight=8, initializer=init_stub, initargs=(latency, cpu_ms)).start()
+    try:
+        async def burst():
+            return await drive(lambda item, rid: pool.run(item, request_id=rid), requests(40), 40)
+        elapsed, latencies, busy = asyncio.run(burst())
+    finally:
+        pool.stop()
+    assert len(latencies) == 8 and busy == 32, (len(latencies), busy)
+    print(f"满载拒绝：40 个并发请求，8 个完成，{busy} 个立即返回繁忙（{elapsed * 1000:.0f} ms 内全部返回）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程分片服务吞吐")
+    parser.add_argument("--shards", default="1,2,4", help="逗号分隔的分片数")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.05, help="桩模型等待延迟（秒，不占 CPU）")
+    parser.add_argument("--cpu-ms", type=float, default=5.0, help="桩模型每次调用占用的 CPU 毫秒数")
+    args = parser.parse_args()
+
+    print(f"CPU 核数 {os.cpu_count()}，{args.requests} 个请求，并发 {args.concurrency}，"
+          f"桩模型延迟 {args.latency}s + CPU {args.cpu_ms} ms")
+    items = requests(args.requests)
+    # 桩模型也在服务进程注入：fork 启动的分片直接继承，进程内对照组同样使用
+    DR_Test = load_dr_test(CpuStubLLM(args.latency, args.cpu_ms))
+
+    # 先跑分片组：工作进程以 fork 启动，服务进程此时还没有事件循环的执行器线程
+    rows = []
+    for shards in (int(value) for value in args.shards.split(",")):
+        pool = ShardPool(shards, max_inflight=args.concurrency, initializer=init_stub,
+                         initargs=(args.latency, args.cpu_ms)).start()
+        try:
+            async def sharded(pool=pool):
+                return await drive(lambda item, rid: pool.run(item, request_id=rid), items, args.concurrency)
+            rows.append((f"{shards} 分片", *asyncio.run(sharded())[:2]))
+        finally:
+            pool.stop()
+
+    async def in_process(item, thread_id):
+        report = await DR_Test.astream_diagnosis(item, lambda kind, text: None, {"checkpointing": False},
+                                                 {"configurable": {"thread_id": thread_id}})
+        return DR_Test.format_report_for_display(report)
+
+    with quiet():
+        elapsed, latencies, _ = asyncio.run(drive(in_process, items, args.concurrency))
+
+    print(f"{'模式':<10} {'请求/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'相对单进程':>7}")
+    baseline = report_row("单进程", elapsed, latencies, None)
+    for name, elapsed, latencies in rows:
+        report_row(name, elapsed, latencies, baseline)
+
+    check_shedding(args.latency, args.cpu_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bench_singleflight.py - 重复诊断请求合并：各场景的大模型调用次数与耗时，对照关闭合并时的开销
+#
+# 用法: python benchmarks/bench_singleflight.py --concurrency 20 --latency 0.5
+#
+# 场景：adiagnose 并发 N 个相同输入（仅 timestamp 不同）；完成后立即重复提交；diagnose 以 N 个线程并发；
+# 患者描述不同；服务端 process_dr_diagnosis 并发 N 个相同文本；关闭合并（每个请求独立执行）。
+# "N 个相同请求只调用一次大模型" 的正确性由 tests/test_singleflight.py 检查，这里只报告次数与耗时。
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from common import StubLLM, load_dr_test, make_input, quiet
+
+
+def diagnosis_input(**extra):
+    return json.loads(make_input(**extra)["messages"][0])
+
+
+def calls_during(llm, fn):
+    """返回 (fn 期间的大模型调用次数, 耗时秒, fn 返回值)"""
+    before = llm.calls
+    start = time.perf_counter()
+    result = fn()
+    return llm.calls - before, time.perf_counter() - start, result
+
+
+async def concurrent_adiagnose(DR_Test, inputs):
+    return await asyncio.gather(*(DR_Test.adiagnose(item) for item in inputs))
+
+
+def threaded_diagnose(DR_Test, inputs):
+    results = [None] * len(inputs)
+
+    def run(i):
+        results[i] = DR_Test.diagnose(inputs[i])
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+async def concurrent_server(handler, text, count):
+    async def consume():
+        final = ""
+        async for output in handler(text, None):
+            final = output
+        return final
+    return await asyncio.gather(*(consume() for _ in range(count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重复诊断请求合并的并发验证")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="桩模型单次调用延迟（秒）")
+    args = parser.parse_args()
+    n = args.concurrency
+
+    llm = StubLLM(latency=args.latency)
+    DR_Test = load_dr_test(llm)
+    flights = DR_Test.get_single_flight()
+    rows = []
+
+    def check(name, expected, fn):
+        with quiet():
+            calls, elapsed, result = calls_during(llm, fn)
+        rows.append((name, calls, expected, elapsed))
+        return result
+
+    same = [diagnosis_input(model_grade=2, timestamp=f"2024-06-01T10:00:{i:02d}") for i in range(n)]
+    check(f"adiagnose × {n}（仅 timestamp 不同）", 1, lambda: asyncio.run(concurrent_adiagnose(DR_Test, same)))
+    check("完成后立即重复提交", 0, lambda: DR_Test.diagnose(same[0]))
+
+    threaded = [diagnosis_input(model_grade=3) for _ in range(n)]
+    check(f"diagnose × {n} 线程", 1, lambda: threaded_diagnose(DR_Test, threaded))
+
+    different = [diagnosis_input(model_grade=1, patient_query=f"患者 {i}，2型糖尿病") for i in range(3)]
+    check("患者描述不同 × 3", 3, lambda: asyncio.run(concurrent_adiagnose(DR_Test, different)))
+
+    with quiet():
+        import DR_Test_Server
+    check(f"服务端 process_dr_diagnosis × {n}", 1,
+          lambda: asyncio.run(concurrent_server(DR_Test_Server.process_dr_diagnosis, "62岁男性，中度病变", n)))
+
+    # 对照：关闭合并，每个请求独立执行诊断图
+    baseline = [diagnosis_input(model_grade=4, timestamp=f"2024-06-02T10:00:{i:02d}") for i in range(n)]
+
+    async def independent():
+        graph = DR_Test.get_graph()
+        return await asyncio.gather(*(graph.ainvoke({"messages": [json.dumps(item, ensure_ascii=False)]},
+                                                    {"configurable": {"thread_id": DR_Test.new_request_id()}})
+                                      for item in baseline))
+    check(f"对照：不合并 × {n}", n, lambda: asyncio.run(independent()))
+
+    print(f"{'场景':<36} {'大模型调用':>10} {'预期':>6} {'耗时 ms':>10}")
+    for name, calls, expected, elapsed in rows:
+        print(f"{name:<36} {calls:>10} {expected:>6} {elapsed * 1000:>10.1f}")
+    print("合并统计:", flights.stats())
+    from DR_Metrics import registry
+    print("\n".join(line for line in registry.render().splitlines() if "singleflight" in line and not line.startswith("#")))
+
+
+if __name__ == "__main__":
+    main()
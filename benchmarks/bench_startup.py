@@ -0,0 +1,101 @@
+# bench_startup.py - 冷启动导入耗时与首个请求延迟（有/无预热）
+#
+# 每项测量都在全新子进程中进行，避免模块缓存影响。
+# --baseline 指定改造前的提交（如 ee0ca1d^，导入时即创建客户端并编译全部图），用 git archive 导出到临时目录后
+# 同样测量，作为“改造前”一行；旧版没有 set_llm/warm_up，桩模型经 configurable.llm 注入。
+# 用法: python benchmarks/bench_startup.py --runs 5 [--baseline ee0ca1d^]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import DR_Test
+t1 = time.perf_counter()
+from common import StubLLM, make_input, quiet
+DR_Test.set_llm(StubLLM(latency=0.0))
+warm = sys.argv[1] == "warm"
+t2 = time.perf_counter()
+if warm:
+    with quiet():
+        DR_Test.warm_up()
+t3 = time.perf_counter()
+with quiet():
+    DR_Test.get_graph({"checkpointing": False}).invoke(make_input(), {"configurable": {"thread_id": "first"}})
+t4 = time.perf_counter()
+with quiet():
+    DR_Test.get_graph({"checkpointing": False}).invoke(make_input(), {"configurable": {"thread_id": "second"}})
+t5 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "warm_up": t3 - t2, "first": t4 - t3, "second": t5 - t4}))
+'''
+
+# 改造前的模块在导入时就已编译图，先于 common 导入，确保 DR_* 模块都来自旧版目录；
+# 旧版导入时即构造 ChatTongyi，没有 API key 会直接失败，这里给一个占位值（不发出请求）
+BASELINE_PROBE = r'''
+import json, os, sys, time
+os.environ.setdefault("DASHSCOPE_API_KEY", "placeholder")
+t0 = time.perf_counter()
+import DR_Test
+t1 = time.perf_counter()
+from common import StubLLM, make_input, quiet
+config = {"configurable": {"llm": StubLLM(latency=0.0)}}
+t3 = time.perf_counter()
+with quiet():
+    DR_Test.stateless_graph.invoke(make_input(), {"configurable": dict(config["configurable"], thread_id="first")})
+t4 = time.perf_counter()
+with quiet():
+    DR_Test.stateless_graph.invoke(make_input(), {"configurable": dict(config["configurable"], thread_id="second")})
+t5 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "warm_up": 0.0, "first": t4 - t3, "second": t5 - t4}))
+'''
+
+
+def probe(mode, root=None, script=PROBE):
+    root = root or os.path.dirname(HERE)
+    env = dict(os.environ, DR_LOG_LEVEL="OFF", PYTHONPATH=os.pathsep.join([root, HERE]))
+    output = subprocess.run(
+        [sys.executable, "-c", script, mode], env=env, cwd=root, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def export_revision(revision, target):
+    """把指定提交的代码树导出到 target"""
+    archive = os.path.join(target, "tree.tar")
+    subprocess.run(["git", "archive", "--format=tar", "-o", archive, revision],
+                   cwd=os.path.dirname(HERE), check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(target)
+    return target
+
+
+def report(mode, samples):
+    median = {key: statistics.median(s[key] for s in samples) * 1000 for key in samples[0]}
+    print(f"{mode:>6} {median['import']:>10.1f} {median['warm_up']:>11.1f} {median['first']:>13.1f} {median['second']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷启动与首个请求延迟")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--baseline", help="改造前的 git 提交（如 ee0ca1d^），额外测量其导入与首个请求耗时")
+    args = parser.parse_args()
+
+    print(f"{'mode':>6} {'import ms':>10} {'warm_up ms':>11} {'first req ms':>13} {'next req ms':>12}")
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = export_revision(args.baseline, tmp)
+            report("before", [probe("cold", root, BASELINE_PROBE) for _ in range(args.runs)])
+    for mode in ("cold", "warm"):
+        report(mode, [probe(mode) for _ in range(args.runs)])
+
+
+if __name__ == "__main__":
+    main()
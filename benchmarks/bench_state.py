@@ -0,0 +1,149 @@
+# bench_state.py - 诊断状态序列化体积：紧凑记录（DR_Records）与改动前的 dict 状态逐步对比
+#
+# 用法: python benchmarks/bench_state.py --requests 500 [--topology dag]
+#
+# 逐步捕获诊断图的状态更新，分别按两种结构序列化（检查点序列化器 JsonPlusSerializer）：
+#   新结构：节点实际写入的紧凑元组；
+#   改动前：同一更新还原成原来的 dict 结果，分级结果内嵌患者信息、集成结果带模型权重、
+#           knowledge_content 为完整建议、final_report 为完整报告，并向 messages 追加报告文本。
+# 每步计 写入（put_writes）+ 变更通道的新值（检查点 blob），与 InMemorySaver 的序列化内容对应。
+import argparse
+import random
+import time
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from common import StubLLM, load_dr_test, make_input, quiet
+from DR_Records import GradingRecord, IntegrationRecord, KnowledgeRecord, VisionRecord
+
+
+class CountingSerde(JsonPlusSerializer):
+    """统计序列化字节数与耗时的序列化器，用于实际检查点"""
+
+    def __init__(self):
+        super().__init__()
+        self.bytes = 0
+        self.calls = 0
+        self.seconds = 0.0
+
+    def dumps_typed(self, obj):
+        start = time.perf_counter()
+        result = super().dumps_typed(obj)
+        self.seconds += time.perf_counter() - start
+        self.bytes += len(result[1])
+        self.calls += 1
+        return result
+
+
+def legacy_update(DR_Test, update, state):
+    """把一步更新还原为改动前的状态结构；state 为该步之后的（新结构）状态"""
+    system = DR_Test.get_dr_system()
+    legacy = dict(update)
+    if "grading_result" in update:
+        grading = GradingRecord.of(update["grading_result"]).as_result()
+        grading["patient_info"] = state.get("patient_data", {})
+        legacy["grading_result"] = grading
+    if "vision_llm_result" in update:
+        legacy["vision_llm_result"] = VisionRecord.of(update["vision_llm_result"]).as_result()
+    if "integrated_result" in update:
+        legacy["integrated_result"] = IntegrationRecord.of(update["integrated_result"]).as_result(system.model_weights)
+    if "knowledge_content" in update:
+        entry = system._knowledge_base().entry(KnowledgeRecord.of(update["knowledge_content"]).key)
+        legacy["knowledge_content"] = _as_lists(entry)
+    if "final_report" in update:
+        report = _as_lists(DR_Test.report_from_state(state))
+        legacy["final_report"] = report
+        legacy["messages"] = [HumanMessage(content=DR_Test.format_report_for_display(report))]
+    return legacy
+
+
+def _as_lists(value):
+    """改动前每次新建建议字典，字段为列表"""
+    if isinstance(value, dict):
+        return {key: _as_lists(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_as_lists(item) for item in value]
+    return value
+
+
+def step_payloads(update, channels):
+    """一步的序列化内容：写入本身 + 变更通道的完整新值（messages 为累积列表）"""
+    return [update] + [channels[name] for name in update]
+
+
+def measure(serde, steps):
+    """返回 (总字节, 总耗时秒)"""
+    total_bytes, elapsed = 0, 0.0
+    for payloads in steps:
+        for payload in payloads:
+            start = time.perf_counter()
+            _, data = serde.dumps_typed(payload)
+            elapsed += time.perf_counter() - start
+            total_bytes += len(data)
+    return total_bytes, elapsed
+
+
+def collect(DR_Test, graph, count, seed=0):
+    """逐请求收集 (新结构各步内容, 改动前各步内容)"""
+    rng = random.Random(seed)
+    new_steps, legacy_steps = [], []
+    for i in range(count):
+        patient = {"age": rng.randint(30, 85), "diabetes_type": "2型", "diabetes_duration": rng.randint(1, 30),
+                   "hbA1c": round(rng.uniform(5.5, 11), 1), "other_conditions": rng.sample(["高血压", "高脂血症"], rng.randint(0, 2))}
+        request = make_input(model_grade=rng.randrange(5), confidence=rng.randint(50, 99), patient_info=patient)
+        state = dict(request)
+        channels_new = {"messages": list(request["messages"])}
+        channels_legacy = {"messages": list(request["messages"])}
+        with quiet():
+            chunks = list(graph.stream(request, {"configurable": {"thread_id": f"state_{i}"}}, stream_mode="updates"))
+        for chunk in chunks:
+            for update in chunk.values():
+                if not update:
+                    continue
+                state.update(update)
+                legacy = legacy_update(DR_Test, update, state)
+                for channels, values in ((channels_new, update), (channels_legacy, legacy)):
+                    for name, value in values.items():
+                        channels[name] = channels.get(name, []) + value if name == "messages" else value
+                new_steps.append(step_payloads(update, channels_new))
+                legacy_steps.append(step_payloads(legacy, channels_legacy))
+    return new_steps, legacy_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="紧凑状态与改动前状态的序列化字节数与耗时")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--topology", choices=["supervisor", "dag"], default="supervisor")
+    args = parser.parse_args()
+
+    DR_Test = load_dr_test(StubLLM(latency=0.0))
+    config = {"checkpointing": False, "topology": args.topology}
+    new_steps, legacy_steps = collect(DR_Test, DR_Test.get_graph(config), args.requests)
+
+    serde = JsonPlusSerializer()
+    print(f"{args.requests} 次诊断，{len(new_steps)} 步（{args.topology} 拓扑）")
+    print(f"{'状态结构':<10} {'字节/请求':>10} {'字节/步':>8} {'序列化 µs/步':>13}")
+    results = {}
+    for name, steps in (("改动前", legacy_steps), ("紧凑记录", new_steps)):
+        measure(serde, steps[:200])  # 预热
+        total_bytes, elapsed = measure(serde, steps)
+        results[name] = total_bytes
+        print(f"{name:<10} {total_bytes / args.requests:>10,.0f} {total_bytes / len(steps):>8,.0f} "
+              f"{elapsed / len(steps) * 1e6:>13.1f}")
+    print(f"体积减少 {1 - results['紧凑记录'] / results['改动前']:.1%}")
+
+    # 实际检查点：BoundedMemorySaver 序列化的全部内容（检查点、元数据、写入与 blob）
+    from DR_Checkpoint import BoundedMemorySaver
+    counting = CountingSerde()
+    graph = DR_Test.create_builder().compile(checkpointer=BoundedMemorySaver(serde=counting)) \
+        if args.topology == "supervisor" else DR_Test.build_dag_graph(BoundedMemorySaver(serde=counting))
+    with quiet():
+        for i in range(args.requests):
+            graph.invoke(make_input(model_grade=i % 5), {"configurable": {"thread_id": f"ckpt_{i}"}})
+    print(f"实际检查点（紧凑记录）: {counting.bytes / args.requests:,.0f} 字节/请求，"
+          f"{counting.calls / args.requests:.0f} 次序列化/请求，{counting.seconds / counting.calls * 1e6:.1f} µs/次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# bench_stateless.py - 有/无检查点时单次诊断的额外开销
+#
+# 用法: python benchmarks/bench_stateless.py --requests 500
+import argparse
+import statistics
+import time
+
+from common import StubLLM, load_dr_test, make_input, quiet
+
+
+def measure(graph, requests, new_id):
+    timings = []
+    with quiet():
+        for _ in range(requests):
+            start = time.perf_counter()
+            graph.invoke(make_input(), {"configurable": {"thread_id": new_id()}})
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.mean(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查点开销对比")
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    dr = load_dr_test(StubLLM(latency=0.0))
+    from langgraph.checkpoint.memory import InMemorySaver
+
+    variants = [
+        ("InMemorySaver", dr.builder.compile(checkpointer=InMemorySaver())),
+        ("BoundedMemorySaver", dr.graph),
+        ("stateless", dr.stateless_graph),
+    ]
+    # 预热
+    for _, graph in variants:
+        measure(graph, 20, dr.new_request_id)
+
+    print(f"{'mode':>20} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, graph in variants:
+        mean, p50, p99 = measure(graph, args.requests, dr.new_request_id)
+        print(f"{name:>20} {mean:>9.2f} {p50:>9.2f} {p99:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# bench_store.py - 诊断结果库：后台合批写入吞吐、put() 请求路径耗时，以及百万行上的分页查询延迟
+#
+# 用法: python benchmarks/bench_store.py --rows 1000000
+#       python benchmarks/bench_store.py --rows 200000 --db /tmp/dr_results.db --explain
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import common  # noqa: F401  将仓库根目录加入 sys.path
+from DR_Store import DiagnosisStore
+
+SEVERITY = ["无风险", "低至中度风险", "低至中度风险", "高风险", "极高风险"]
+DAY = 86400
+
+
+def make_report(grade, rng):
+    """与 DRDiagnosisSystem.generate_diagnosis_report 结构一致的精简报告"""
+    return {
+        "diagnosis_summary": {"grade": grade, "description": f"{grade}级", "severity": SEVERITY[grade]},
+        "model_analysis": {
+            "grading_model_result": grade,
+            "vision_llm_result": grade,
+            "agreement": True,
+            "final_confidence": {"grading_model": rng.randint(60, 99), "vision_llm": 85},
+            "diagnosis_path": "ensemble"
+        },
+        "clinical_recommendations": {"followup_plan": {"interval": "12个月"}},
+        "patient_information": {"age": rng.randint(30, 85), "diabetes_type": "2型", "other_conditions": []}
+    }
+
+
+def timed(fn, repeat):
+    """返回 (中位耗时 ms, 最后一次结果)"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, result
+
+
+def baseline_sync_insert(db_path, rows, rng):
+    """对照：每个请求在请求路径上单独插入并提交（默认回滚日志 + synchronous=FULL）"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous=FULL")
+    conn.execute("CREATE TABLE t (request_id TEXT PRIMARY KEY, grade INTEGER, created_at REAL, report TEXT)")
+    start = time.perf_counter()
+    for i in range(rows):
+        with conn:
+            conn.execute("INSERT INTO t VALUES (?, ?, ?, ?)", (f"r{i}", 0, time.time(), str(make_report(0, rng))))
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed / rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="诊断结果库写入与查询基准")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--patients", type=int, default=200000, help="不同患者数")
+    parser.add_argument("--days", type=int, default=365, help="结果时间跨度（天）")
+    parser.add_argument("--db", default=None, help="数据库路径（默认临时目录，结束后删除）")
+    parser.add_argument("--baseline-rows", type=int, default=500, help="逐条同步提交对照的行数")
+    parser.add_argument("--explain", action="store_true", help="打印各查询的执行计划")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dr_bench_store_")
+    db_path = args.db or os.path.join(workdir, "results.db")
+    rng = random.Random(0)
+
+    per_row = baseline_sync_insert(os.path.join(workdir, "baseline.db"), args.baseline_rows, rng)
+    print(f"对照：请求路径逐条插入并提交 {per_row * 1000:.2f} ms/条（{1 / per_row:,.0f} 条/秒）")
+
+    store = DiagnosisStore(db_path)
+    now = time.time()
+    start_at = now - args.days * DAY
+    put_latencies = []
+    start = time.perf_counter()
+    for i in range(args.rows):
+        grade = rng.choices(range(5), weights=[70, 12, 10, 5, 3])[0]
+        report = make_report(grade, rng)
+        created_at = start_at + (now - start_at) * i / args.rows
+        t0 = time.perf_counter()
+        while not store.put(f"req-{i}", report, f"patient-{rng.randrange(args.patients)}", created_at):
+            time.sleep(0.001)  # 队列满：压测时等写线程追上，线上会丢弃并计数
+        put_latencies.append(time.perf_counter() - t0)
+    enqueue_elapsed = time.perf_counter() - start
+    store.flush()
+    total_elapsed = time.perf_counter() - start
+    stats = store.stats()
+    put_latencies.sort()
+    print(f"写入 {args.rows:,} 行: {args.rows / total_elapsed:,.0f} 行/秒（入队 {enqueue_elapsed:.1f}s，落库完成 {total_elapsed:.1f}s），"
+          f"{stats['batches']:,} 批，平均每批 {stats['written'] / max(stats['batches'], 1):.0f} 行")
+    print(f"put() 请求路径耗时: p50 {put_latencies[len(put_latencies) // 2] * 1e6:.1f} µs  "
+          f"p99 {put_latencies[int(len(put_latencies) * 0.99)] * 1e6:.1f} µs")
+    print(f"数据库大小 {os.path.getsize(db_path) / 1e6:,.0f} MB")
+
+    week = now - 7 * DAY
+    month = now - 30 * DAY
+    patient = "patient-42"
+    _, cursor = store.query(min_grade=3, since=week)
+    for _ in range(18):
+        _, cursor = store.query(min_grade=3, since=week, cursor=cursor) if cursor else (None, None)
+    # 游标为 None 说明匹配行不足 20 页，"第 20 页" 的计时会退化为第 1 页，此时不测深页
+    deep_pages = cursor is not None
+    if not deep_pages:
+        print(f"近一周 ≥3 级结果不足 20 页（{store.count(min_grade=3, since=week)} 行），跳过第 20 页查询；"
+              f"请增大 --rows 或减小 --days")
+
+    queries = [
+        ("近一周 ≥3 级，第 1 页", lambda: store.query(min_grade=3, since=week)[0]),
+        ("近一周 ≥3 级，第 20 页（游标）", lambda: store.query(min_grade=3, since=week, cursor=cursor)[0]),
+        ("近一周 ≥3 级，第 20 页（OFFSET）", lambda: store._reader().execute(
+            "SELECT id FROM diagnoses WHERE grade >= 3 AND created_at >= ? ORDER BY created_at DESC, id DESC "
+            "LIMIT 50 OFFSET 950", (week,)).fetchall()),
+        ("近一周 ≥3 级，含报告正文", lambda: store.query(min_grade=3, since=week, include_report=True)[0]),
+        ("近 30 天高风险", lambda: store.query(severity="高风险", since=month)[0]),
+        ("单个患者历史", lambda: store.query(patient_id=patient)[0]),
+        ("按请求 ID 取报告", lambda: store.get(f"req-{args.rows // 2}")),
+        ("全部 4 级，第 1 页", lambda: store.query(min_grade=4)[0]),
+        ("近一周 ≥3 级计数", lambda: store.count(min_grade=3, since=week)),
+    ]
+    if not deep_pages:
+        queries = [(name, fn) for name, fn in queries if "第 20 页" not in name]
+    print(f"{'查询':<26} {'中位 ms':>8} {'行数':>6}")
+    for name, fn in queries:
+        elapsed, result = timed(fn, 50)
+        size = result if isinstance(result, int) else len(result) if isinstance(result, list) else 1
+        print(f"{name:<26} {elapsed:>8.2f} {size:>6}")
+
+    if args.explain:
+        # ≥3 级分页走 created_at 索引倒序扫描并过滤等级；计数走 (grade, created_at) 覆盖索引
+        for sql, params in (
+            ("SELECT id FROM diagnoses WHERE grade >= 3 AND created_at >= ? ORDER BY created_at DESC, id DESC LIMIT 50", (week,)),
+            ("SELECT COUNT(*) FROM diagnoses WHERE grade >= 3 AND created_at >= ?", (week,)),
+            ("SELECT id FROM diagnoses WHERE severity = ? AND created_at >= ? ORDER BY created_at DESC, id DESC LIMIT 50", ("高风险", month)),
+            ("SELECT id FROM diagnoses WHERE patient_id = ? ORDER BY created_at DESC, id DESC LIMIT 50", (patient,)),
+        ):
+            plan = store._reader().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            print(sql, "\n  ", " | ".join(row[3] for row in plan))
+
+    store.close()
+    if not args.db:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bench_stream_parse.py - 视觉输出容错解析的失败率，以及流式提前结束每次调用节省的时间
+#
+# 用法: python benchmarks/bench_stream_parse.py --latency 0.3 --token-latency 0.01 --runs 20
+import argparse
+import asyncio
+import json
+import time
+
+from common import load_dr_test, make_input
+from DR_FakeLLMServer import FakeLLMConfig, start_fake_llm_server
+from DR_LLMClient import OpenAICompatibleChatClient, ResilientLLM
+from DR_Records import VisionRecord
+from DR_StreamParse import VisionStreamParser, parse_vision_output
+
+CLEAN = json.dumps({
+    "predicted_grade": 2,
+    "confidence": 0.85,
+    "key_findings": ["微动脉瘤", "硬性渗出"],
+    "rationale": "可见多处微动脉瘤及点状出血，未见新生血管"
+}, ensure_ascii=False)
+
+# 大模型常见的输出畸形
+VARIANTS = {
+    "合法 JSON": CLEAN,
+    "markdown 代码块": f"```json\n{CLEAN}\n```",
+    "前置说明文字": f"根据眼底图像分析，结果如下：\n{CLEAN}\n以上仅供参考。",
+    "尾逗号": CLEAN.replace('"硬性渗出"]', '"硬性渗出",]'),
+    "中文标点": CLEAN.replace('"predicted_grade": 2,', '“predicted_grade”： 2，'),
+    "输出被截断": CLEAN[:CLEAN.index("rationale") + 20],
+    "百分数置信度": CLEAN.replace("0.85", "85%"),
+    "字符串分级": CLEAN.replace('"predicted_grade": 2', '"predicted_grade": "2级"'),
+    "无 JSON": "图像质量不足，无法判断病变分级。",
+}
+
+
+def strict_parse(text):
+    """原实现：json.loads，且分级须为整数才能参与集成"""
+    try:
+        result = json.loads(text)
+    except ValueError:
+        return None
+    return result if isinstance(result.get("predicted_grade"), int) else None
+
+
+def parse_failure_table():
+    print(f"{'输出形式':<14} {'json.loads':>10} {'容错解析':>10}")
+    strict_failures = tolerant_failures = 0
+    for name, text in VARIANTS.items():
+        strict = strict_parse(text)
+        result, outcome = parse_vision_output(text)
+        strict_failures += strict is None
+        tolerant_failures += result is None
+        print(f"{name:<14} {'失败' if strict is None else '成功':>10} {outcome:>10}")
+    total = len(VARIANTS)
+    print(f"解析失败率: json.loads {strict_failures / total:.0%}  容错解析 {tolerant_failures / total:.0%}")
+
+
+def parser_overhead(rounds=2000, chunk_chars=4):
+    """逐 chunk 喂入的解析开销"""
+    chunks = [CLEAN[i:i + chunk_chars] for i in range(0, len(CLEAN), chunk_chars)]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parser = VisionStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.finish()
+    return (time.perf_counter() - start) / rounds
+
+
+async def diagnose(graph, runs):
+    latencies = []
+    for i in range(runs):
+        start = time.perf_counter()
+        result = await graph.ainvoke(make_input(model_grade=3), {"configurable": {"thread_id": f"stream_{i}"}})
+        latencies.append(time.perf_counter() - start)
+        assert VisionRecord.of(result["vision_llm_result"]).predicted_grade == 3
+    return sum(latencies) / len(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视觉输出容错解析与提前结束生成")
+    parser.add_argument("--latency", type=float, default=0.3, help="假服务首 token 延迟（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="假服务每个 chunk 的间隔（秒）")
+    parser.add_argument("--rationale-chars", type=int, default=120, help="rationale 字段长度")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    parse_failure_table()
+    print(f"\n逐 chunk 解析开销: {parser_overhead() * 1e6:.1f} µs/次")
+
+    config = FakeLLMConfig(args.latency, 0.0, token_latency=args.token_latency, rationale_chars=args.rationale_chars)
+    server = start_fake_llm_server(config=config)
+    llm = ResilientLLM(OpenAICompatibleChatClient(f"http://127.0.0.1:{server.server_port}/v1", "fake"), timeout=30)
+    DR_Test = load_dr_test(llm)
+    graph = DR_Test.get_graph({"checkpointing": False})
+
+    print(f"\n{'模式':<10} {'平均诊断耗时 ms':>16}")
+    results = {}
+    for name, early_stop in (("完整生成", False), ("提前结束", True)):
+        DR_Test.VISION_EARLY_STOP = early_stop
+        results[name] = asyncio.run(diagnose(graph, args.runs))
+        print(f"{name:<10} {results[name] * 1000:>16.1f}")
+    print(f"每次调用节省: {(results['完整生成'] - results['提前结束']) * 1000:.1f} ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
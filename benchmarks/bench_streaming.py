@@ -0,0 +1,57 @@
+# bench_streaming.py - 流式处理函数的首字节时间：占位内容、首个阶段事件、首个视觉 token
+#
+# 处理函数先立即返回占位内容，TTFB 按首个真实阶段事件（或视觉 token）计，不按占位内容计。
+#
+# 用法: python benchmarks/bench_streaming.py --latency 3.0
+import argparse
+import asyncio
+import os
+import time
+
+from common import StreamingStubLLM, load_dr_test, quiet
+
+
+async def measure(handler, text, placeholders):
+    start = time.perf_counter()
+    placeholder = first_event = first_token = None
+    updates = 0
+    final = ""
+    async for output in handler(text, None):
+        now = time.perf_counter() - start
+        updates += 1
+        if placeholder is None:
+            placeholder = now
+        if first_event is None and output not in placeholders:
+            first_event = now
+        if first_token is None and "视觉模型输出" in output:
+            first_token = now
+        final = output
+    return placeholder, first_event, first_token, time.perf_counter() - start, updates, final
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式诊断首字节时间")
+    parser.add_argument("--latency", type=float, default=3.0, help="桩模型总生成时间（秒）")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    # 每轮输入相同，关闭结果复用，否则第二轮起直接命中合并缓存
+    os.environ["DR_COALESCE_TTL"] = "0"
+    load_dr_test(StreamingStubLLM(latency=args.latency))
+    with quiet():
+        import DR_Test_Server
+
+    placeholders = {DR_Test_Server._render_progress([], "")}
+    print(f"{'run':>4} {'placeholder ms':>15} {'TTFB ms':>9} {'first token ms':>15} {'total ms':>9} {'updates':>8}")
+    for run in range(args.runs):
+        with quiet():
+            placeholder, first_event, first_token, total, updates, final = asyncio.run(
+                measure(DR_Test_Server.process_dr_diagnosis, "62岁男性，中度病变", placeholders)
+            )
+        assert final.startswith("## 🩺"), "最终输出应为完整诊断报告"
+        print(f"{run:>4} {placeholder * 1000:>15.1f} {first_event * 1000:>9.1f} {first_token * 1000:>15.1f} "
+              f"{total * 1000:>9.1f} {updates:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# bench_triage.py - 分诊回放：对比"每例调用视觉大模型"基线与按阈值跳过的分诊策略
+#
+# 用法: python benchmarks/bench_triage.py cases.jsonl --latency 0.5 --thresholds '{"0": 95}'
+#       python benchmarks/bench_triage.py cases.jsonl --generate 2000   # 先生成模拟病例再回放
+#
+# 病例格式与 DR_Batch 输入一致；可选字段 vision_grade 为该例视觉大模型的回放答案（缺省时回显分级结果）。
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from langchain_core.messages import AIMessage
+
+from common import load_dr_test
+from DR_Records import IntegrationRecord
+
+
+class ReplayLLM:
+    """按病例回放视觉大模型答案，并模拟调用延迟"""
+    model_name = "replay"
+
+    def __init__(self, grade, latency, counter):
+        self.grade = grade
+        self.latency = latency
+        self.counter = counter
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        self.counter[0] += 1
+        await asyncio.sleep(self.latency)
+        return AIMessage(content=json.dumps({"predicted_grade": self.grade, "confidence": 0.85}))
+
+
+def generate_cases(path, count, seed=0):
+    """筛查场景的模拟病例：约七成无病变，分级模型在无病变图像上置信度普遍较高"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            grade = rng.choices(range(5), weights=[70, 12, 10, 5, 3])[0]
+            confidence = rng.randint(90, 100) if grade == 0 and rng.random() < 0.8 else rng.randint(55, 95)
+            vision_grade = grade if rng.random() < 0.9 else max(0, min(4, grade + rng.choice((-1, 1))))
+            f.write(json.dumps({
+                "case_id": f"case_{i}",
+                "model_grade": grade,
+                "confidence": confidence,
+                "vision_grade": vision_grade,
+                "image_path": "",
+                "patient_info": {}
+            }, ensure_ascii=False) + "\n")
+
+
+async def replay(graph, lines, latency, concurrency):
+    """返回 (各例最终分级, 各例耗时, 大模型调用次数)"""
+    counter = [0]
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(index, line):
+        case = json.loads(line)
+        llm = ReplayLLM(case.get("vision_grade", case.get("model_grade", 0)), latency, counter)
+        async with sem:
+            start = time.perf_counter()
+            result = await graph.ainvoke(
+                {"messages": [line]},
+                {"configurable": {"thread_id": f"triage_{index}", "llm": llm}}
+            )
+            return IntegrationRecord.of(result["integrated_result"]).final_grade, time.perf_counter() - start
+
+    results = await asyncio.gather(*(one(i, line) for i, line in enumerate(lines)))
+    return [grade for grade, _ in results], [seconds for _, seconds in results], counter[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分诊策略回放：跳过的大模型调用比例、节省的延迟与分级差异")
+    parser.add_argument("cases", help="JSONL 病例文件")
+    parser.add_argument("--generate", type=int, default=0, help="先生成指定数量的模拟病例写入 cases")
+    parser.add_argument("--thresholds", default='{"0": 95}', help="分诊阈值 JSON，键为等级、值为分级置信度")
+    parser.add_argument("--latency", type=float, default=0.5, help="回放大模型单次调用延迟（秒）")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--topology", default="dag", choices=["supervisor", "dag"])
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_cases(args.cases, args.generate)
+    with open(args.cases, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    DR_Test = load_dr_test()
+    system = DR_Test.get_dr_system()
+    graph = DR_Test.get_graph({"checkpointing": False, "topology": args.topology})
+
+    system.set_triage_thresholds({})
+    base_grades, base_latencies, base_calls = asyncio.run(replay(graph, lines, args.latency, args.concurrency))
+    system.set_triage_thresholds(json.loads(args.thresholds))
+    grades, latencies, calls = asyncio.run(replay(graph, lines, args.latency, args.concurrency))
+
+    total = len(lines)
+    disagreements = [(a, b) for a, b in zip(base_grades, grades) if a != b]
+    print(f"病例数: {total}  分诊阈值: {system.triage_thresholds}")
+    print(f"大模型调用: 基线 {base_calls}  分诊 {calls}  跳过 {1 - calls / base_calls:.1%}")
+    print(f"平均每例耗时: 基线 {sum(base_latencies) / total * 1000:.1f} ms  "
+          f"分诊 {sum(latencies) / total * 1000:.1f} ms  "
+          f"节省 {(sum(base_latencies) - sum(latencies)) / total * 1000:.1f} ms/例")
+    print(f"与基线最终分级不一致: {len(disagreements)} 例 ({len(disagreements) / total:.2%})")
+    for (base, triaged), count in sorted({pair: disagreements.count(pair) for pair in set(disagreements)}.items()):
+        print(f"  基线 {base}级 -> 分诊 {triaged}级: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# bench_voting.py - 视觉分级自洽投票：单次调用 / 顺序 N 次 / 并发 N 次（全部等待与提前结束）的延迟与准确率
+#
+# 用法: python benchmarks/bench_voting.py --samples 5 --accuracy 0.7 --latency 0.3 --cases 50
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from langchain_core.messages import AIMessage
+
+from common import load_dr_test, make_input
+from DR_Records import VisionRecord
+
+
+class NoisyStubLLM:
+    """以 accuracy 概率回答正确等级（提示词中的等级N），否则随机给出其他等级；延迟按对数正态抖动"""
+    model_name = "noisy-stub"
+
+    def __init__(self, accuracy, latency, seed=0):
+        self.accuracy = accuracy
+        self.latency = latency
+        self.calls = 0
+        self.cancelled = 0
+        self._random = random.Random(seed)
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        self.calls += 1
+        prompt = messages[-1]["content"]
+        grade = int(prompt.split("等级")[1][0])
+        if self._random.random() >= self.accuracy:
+            grade = self._random.choice([g for g in range(5) if g != grade])
+        try:
+            await asyncio.sleep(self.latency * self._random.lognormvariate(0, 0.3))
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return AIMessage(content=json.dumps({"predicted_grade": grade, "confidence": 0.85}))
+
+
+async def run(DR_Test, graph, llm, cases, sequential_samples=0):
+    """返回 (平均耗时, 视觉分级准确率, 平均票数占比)"""
+    latencies, correct, shares = [], 0, []
+    for i in range(cases):
+        grade = i % 5
+        start = time.perf_counter()
+        if sequential_samples:
+            # 顺序调用 N 次的对照：只统计耗时
+            for _ in range(sequential_samples):
+                await llm.ainvoke([{"role": "user", "content": f"等级{grade}"}])
+            latencies.append(time.perf_counter() - start)
+            continue
+        result = await graph.ainvoke(
+            make_input(model_grade=grade, confidence=50),
+            {"configurable": {"thread_id": f"vote_{i}", "llm": llm}}
+        )
+        latencies.append(time.perf_counter() - start)
+        vision = VisionRecord.of(result["vision_llm_result"])
+        correct += vision.predicted_grade == grade
+        shares.append(DR_Test.get_dr_system().vision_confidence if vision.vote_share is None else vision.vote_share)
+    share = sum(shares) / len(shares) if shares else 0.0
+    return sum(latencies) / cases, correct / cases, share
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视觉分级自洽投票的延迟、准确率与取消统计")
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--accuracy", type=float, default=0.7, help="单次采样答对的概率")
+    parser.add_argument("--latency", type=float, default=0.3, help="单次采样中位延迟（秒）")
+    parser.add_argument("--cases", type=int, default=50)
+    args = parser.parse_args()
+
+    DR_Test = load_dr_test()
+    DR_Test.get_dr_system().set_triage_thresholds({})
+    graph = DR_Test.get_graph({"checkpointing": False, "topology": "dag"})
+
+    print(f"{'模式':<22} {'平均耗时 ms':>11} {'准确率':>7} {'票数占比':>8} {'调用数':>6} {'取消':>5}")
+    configs = [
+        ("单次调用", 1, "majority", 0),
+        (f"顺序 {args.samples} 次", 1, "majority", args.samples),
+        (f"并发 {args.samples} 次 all", args.samples, "all", 0),
+        (f"并发 {args.samples} 次 majority", args.samples, "majority", 0),
+        (f"并发 {args.samples} 次 plurality", args.samples, "plurality", 0),
+    ]
+    for name, samples, rule, sequential in configs:
+        DR_Test.VISION_SAMPLES = samples
+        DR_Test.VISION_VOTE_RULE = rule
+        llm = NoisyStubLLM(args.accuracy, args.latency)
+        latency, accuracy, share = asyncio.run(run(DR_Test, graph, llm, args.cases, sequential))
+        accuracy = "-" if sequential else f"{accuracy:.1%}"
+        share = "-" if sequential else f"{share:.2f}"
+        print(f"{name:<22} {latency * 1000:>11.1f} {accuracy:>7} {share:>8} {llm.calls:>6} {llm.cancelled:>5}")
+
+
+if __name__ == "__main__":
+    main()
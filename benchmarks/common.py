@@ -0,0 +1,146 @@
+# common.py - 基准测试公共工具：桩大模型与 DR_Test 加载
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+class StubLLM:
+    """注入固定延迟的假视觉大模型，接口与 ChatTongyi 的 invoke/ainvoke 对齐"""
+
+    def __init__(self, latency=0.5, model_name="stub-vision"):
+        self.latency = latency
+        self.model_name = model_name
+        self.calls = 0
+
+    def _reply(self, messages):
+        self.calls += 1
+        prompt = messages[-1]["content"] if isinstance(messages[-1], dict) else messages[-1].content
+        match = re.search(r'等级(\d)', prompt)
+        grade = int(match.group(1)) if match else 0
+        return AIMessage(content=json.dumps({
+            "predicted_grade": grade,
+            "confidence": 0.85,
+            "key_findings": ["微动脉瘤"],
+            "rationale": "桩模型固定输出"
+        }, ensure_ascii=False))
+
+    def invoke(self, messages, config=None, **kwargs):
+        time.sleep(self.latency)
+        return self._reply(messages)
+
+    async def ainvoke(self, messages, config=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._reply(messages)
+
+    def batch(self, inputs, config=None, return_exceptions=False, **kwargs):
+        time.sleep(self.latency)
+        return [self._reply(messages) for messages in inputs]
+
+    async def abatch(self, inputs, config=None, return_exceptions=False, **kwargs):
+        await asyncio.sleep(self.latency)
+        return [self._reply(messages) for messages in inputs]
+
+
+class StreamingStubLLM(BaseChatModel):
+    """逐 token 输出的桩模型，总延迟均摊到各 token，用于流式/messages 模式测试"""
+
+    latency: float = 3.0
+    tokens: int = 60
+    model_name: str = "stub-vision-stream"
+
+    @property
+    def _llm_type(self):
+        return "stub-streaming"
+
+    def _content(self, messages):
+        match = re.search(r'等级(\d)', messages[-1].content)
+        return json.dumps({
+            "predicted_grade": int(match.group(1)) if match else 0,
+            "confidence": 0.85,
+            "key_findings": ["微动脉瘤", "点状出血"],
+            "rationale": "桩模型逐字输出的分析理由" * 4
+        }, ensure_ascii=False)
+
+    def _pieces(self, messages):
+        content = self._content(messages)
+        size = max(1, len(content) // self.tokens)
+        return [content[i:i + size] for i in range(0, len(content), size)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._content(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._content(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        pieces = self._pieces(messages)
+        for piece in pieces:
+            time.sleep(self.latency / len(pieces))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        pieces = self._pieces(messages)
+        for piece in pieces:
+            await asyncio.sleep(self.latency / len(pieces))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+def load_dr_test(llm=None, vision_cache=False):
+    """导入 DR_Test 并替换为桩模型，关闭离线无用的 LangSmith 追踪；默认禁用视觉结果缓存以免掩盖模型延迟"""
+    os.environ.setdefault("DASHSCOPE_API_KEY", "stub")
+    with quiet():
+        import DR_Test
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    if llm is not None:
+        DR_Test.set_llm(llm)
+    if not vision_cache:
+        from DR_Cache import VisionResultCache
+        DR_Test.set_vision_cache(VisionResultCache(max_entries=0))
+    return DR_Test
+
+
+def make_input(model_grade=2, confidence=85, **extra):
+    """构造与 process_dr_diagnosis 相同结构的诊断输入"""
+    data = {
+        "patient_query": "58岁女性，2型糖尿病8年，HbA1c 7.1%",
+        "model_grade": model_grade,
+        "confidence": confidence,
+        "image_path": "/data/retina_images/sample.jpg",
+        "patient_info": {
+            "age": 58,
+            "diabetes_type": "2型",
+            "diabetes_duration": 10,
+            "hbA1c": 7.5,
+            "other_conditions": []
+        }
+    }
+    data.update(extra)
+    return {"messages": [json.dumps(data, ensure_ascii=False)]}
+
+
+@contextlib.contextmanager
+def quiet():
+    """屏蔽节点中的调试输出，避免干扰计时"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
@@ -0,0 +1,23 @@
+# conftest.py - 测试公共设置：仓库根目录与 benchmarks/ 加入 sys.path，测试直接导入 DR_* 模块与基准的桩模型
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture(scope="session")
+def stub_llm():
+    from common import StubLLM
+    return StubLLM(latency=0.2)
+
+
+@pytest.fixture(scope="session")
+def dr_test(stub_llm):
+    """换上桩模型并禁用视觉结果缓存的 DR_Test"""
+    from common import load_dr_test
+    return load_dr_test(stub_llm)
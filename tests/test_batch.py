@@ -0,0 +1,45 @@
+# test_batch.py - 批量诊断：诊断图未生成报告时的结果行
+import asyncio
+import json
+
+from langchain_core.messages import HumanMessage
+
+import DR_Batch
+
+
+class _FixedGraph:
+    """ainvoke 直接返回给定的最终状态"""
+
+    def __init__(self, state):
+        self.state = state
+
+    async def ainvoke(self, graph_input, config=None):
+        return self.state
+
+
+def _diagnose(monkeypatch, state):
+    monkeypatch.setattr(DR_Batch, "get_graph", lambda graph_config=None: _FixedGraph(state))
+    line = json.dumps({"case_id": "case-1", "model_grade": 2, "confidence": 80})
+
+    async def run():
+        return await DR_Batch._diagnose_case(0, line, None, asyncio.Semaphore(1), "test")
+    return asyncio.run(run())
+
+
+def test_missing_report_with_string_message(monkeypatch):
+    result = _diagnose(monkeypatch, {"messages": ["诊断系统无法处理此请求"]})
+    assert result["error"] == "诊断未生成报告"
+    assert result["report_text"] == "诊断系统无法处理此请求"
+    assert result["case_id"] == "case-1"
+
+
+def test_missing_report_with_message_object(monkeypatch):
+    result = _diagnose(monkeypatch, {"messages": ["{}", HumanMessage(content="诊断系统无法处理此请求")]})
+    assert result["error"] == "诊断未生成报告"
+    assert result["report_text"] == "诊断系统无法处理此请求"
+
+
+def test_missing_report_without_messages(monkeypatch):
+    result = _diagnose(monkeypatch, {})
+    assert result["error"] == "诊断未生成报告"
+    assert result["report_text"] == ""
@@ -0,0 +1,38 @@
+# test_image.py - 预处理缓存目录的容量上限与最近使用淘汰
+import io
+import os
+
+from PIL import Image
+
+from DR_Image import FundusImageStore
+
+
+def _jpeg(shade):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), (shade, 80, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def test_cache_dir_evicts_least_recently_used(tmp_path):
+    store = FundusImageStore(str(tmp_path), size=16, workers=1)
+    first = store.ingest_bytes(_jpeg(100))
+    per_file = store.stats()["bytes"]
+    store.max_bytes = per_file * 2
+
+    second = store.ingest_bytes(_jpeg(150))
+    store.ingest_bytes(_jpeg(100))  # 命中后 first 成为最近使用
+    store.ingest_bytes(_jpeg(200))
+
+    stats = store.stats()
+    assert stats["evictions"] == 1 and stats["files"] == 2 and stats["bytes"] <= store.max_bytes
+    assert os.path.exists(first.path) and not os.path.exists(second.path)
+
+
+def test_reopen_trims_to_limit(tmp_path):
+    store = FundusImageStore(str(tmp_path), size=16, workers=1)
+    for shade in (60, 120, 180):
+        store.ingest_bytes(_jpeg(shade))
+    per_file = store.stats()["bytes"] // 3
+
+    reopened = FundusImageStore(str(tmp_path), size=16, workers=1, max_bytes=per_file)
+    assert reopened.stats()["files"] == 1 and reopened.stats()["evictions"] == 2
@@ -0,0 +1,17 @@
+# test_patient_info.py - 患者信息抽取：标注语料逐条与期望结果一致
+import json
+import os
+
+import pytest
+
+from DR_PatientInfo import extract
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "data", "patient_notes.jsonl")
+
+with open(CORPUS, 'r', encoding='utf-8') as f:
+    CASES = [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["text"][:24] for case in CASES])
+def test_corpus_case(case):
+    assert extract(case["text"]) == case["expected"]
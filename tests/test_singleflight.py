@@ -0,0 +1,76 @@
+# test_singleflight.py - 重复诊断请求合并：N 个相同的并发请求只调用一次视觉大模型
+import asyncio
+import json
+import threading
+
+import pytest
+
+from common import make_input, quiet
+
+N = 8
+
+
+def _input(**extra):
+    return json.loads(make_input(**extra)["messages"][0])
+
+
+def _calls(llm, fn):
+    before = llm.calls
+    with quiet():
+        result = fn()
+    return llm.calls - before, result
+
+
+async def _adiagnose_all(dr_test, inputs):
+    return await asyncio.gather(*(dr_test.adiagnose(item) for item in inputs))
+
+
+def test_concurrent_adiagnose_makes_one_call(dr_test, stub_llm):
+    # 仅 timestamp 不同视为同一请求
+    same = [_input(model_grade=2, timestamp=f"2024-06-01T10:00:{i:02d}") for i in range(N)]
+    calls, states = _calls(stub_llm, lambda: asyncio.run(_adiagnose_all(dr_test, same)))
+    assert calls == 1
+    assert all(dr_test.report_from_state(state) for state in states)
+
+    # 完成后立即重复提交命中结果缓存
+    calls, _ = _calls(stub_llm, lambda: dr_test.diagnose(same[0]))
+    assert calls == 0
+
+
+def test_concurrent_threads_make_one_call(dr_test, stub_llm):
+    inputs = [_input(model_grade=3) for _ in range(N)]
+
+    def run():
+        threads = [threading.Thread(target=dr_test.diagnose, args=(item,)) for item in inputs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    calls, _ = _calls(stub_llm, run)
+    assert calls == 1
+
+
+def test_different_patients_run_separately(dr_test, stub_llm):
+    inputs = [_input(model_grade=1, patient_query=f"患者 {i}，2型糖尿病") for i in range(3)]
+    calls, _ = _calls(stub_llm, lambda: asyncio.run(_adiagnose_all(dr_test, inputs)))
+    assert calls == 3
+
+
+def test_server_handler_coalesces(dr_test, stub_llm):
+    pytest.importorskip("gradio")
+    with quiet():
+        import DR_Test_Server
+
+    async def consume():
+        final = ""
+        async for output in DR_Test_Server.process_dr_diagnosis("62岁男性，中度病变", None):
+            final = output
+        return final
+
+    async def run():
+        return await asyncio.gather(*(consume() for _ in range(N)))
+    calls, reports = _calls(stub_llm, lambda: asyncio.run(run()))
+    assert calls == 1
+    # 每个调用方都拿到同一份完整报告
+    assert all(report.startswith("## 🩺") for report in reports)
+    assert len(set(reports)) == 1
@@ -0,0 +1,41 @@
+# test_stream_parse.py - 视觉输出容错解析：分级范围与 partial 结果的缓存
+import pytest
+
+from DR_StreamParse import VisionStreamParser, parse_vision_output
+
+
+@pytest.mark.parametrize("grade", ["7", "-1", "2.5"])
+def test_out_of_range_grade_rejected(grade):
+    result, outcome = parse_vision_output(f'{{"predicted_grade": {grade}, "confidence": 0.8}}')
+    assert result is None and outcome == "failed"
+
+
+def test_out_of_range_grade_not_scanned():
+    parser = VisionStreamParser()
+    assert not parser.feed('{"predicted_grade": 9, "confidence": 0.8, ')
+    assert "predicted_grade" not in parser.fields
+
+
+def test_valid_json_cacheable():
+    parser = VisionStreamParser()
+    parser.feed('```json\n{"predicted_grade": 3, "confidence": 0.9}\n```')
+    result, outcome = parser.finish()
+    assert result["predicted_grade"] == 3 and outcome == "repaired"
+    assert parser.cacheable
+
+
+def test_malformed_partial_not_cacheable():
+    parser = VisionStreamParser()
+    parser.feed('分级结果 predicted_grade: 2, confidence: 0.7 ]] 之后输出乱码 {{')
+    result, outcome = parser.finish()
+    assert outcome == "partial" and result["predicted_grade"] == 2
+    assert not parser.cacheable
+
+
+def test_early_stopped_partial_cacheable():
+    parser = VisionStreamParser()
+    assert parser.feed('{"predicted_grade": 2, "confidence": 0.7, "key_findings": ["微动')
+    parser.early_stopped = True
+    result, _ = parser.finish()
+    assert result["predicted_grade"] == 2
+    assert parser.cacheable
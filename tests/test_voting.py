@@ -0,0 +1,17 @@
+# test_voting.py - 自洽投票：提前结束时的票数占比与结果快照
+import asyncio
+
+from DR_Voting import avote
+
+
+def test_early_stop_share_counts_all_samples():
+    async def sample(index):
+        # 前 3 个采样立即返回等级 2，其余很慢，多数票规则下提前结束
+        await asyncio.sleep(0 if index < 3 else 1.0)
+        return 2, {"index": index}
+
+    summary = asyncio.run(avote(sample, 5, "majority"))
+    assert summary["grade"] == 2
+    assert summary["counted"] == 3 and summary["cancelled"] == 2
+    assert summary["share"] == 0.6
+    assert [index for index, _, _ in summary["ballots"]] == [0, 1, 2]